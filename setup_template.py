@@ -40,5 +40,5 @@ setuptools.setup(
     package_dir={"": "src"},
     install_requires=requirements,
     packages=setuptools.find_packages(where="src"),
-    python_requires=">=3.6",
+    python_requires=">=3.7",
 )
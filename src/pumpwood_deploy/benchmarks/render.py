@@ -0,0 +1,284 @@
+"""
+Benchmark of manifest rendering on synthetic stacks.
+
+Renders stacks with the standard services, auth, datalake and decision
+microservices (with their database load balancers) and an increasing
+number of PumpwoodModels and PumpwoodDecisionModel workers, and checks that
+render time grows linearly with the number of workers:
+
+    python -m pumpwood_deploy.benchmarks.render --workers 25 50 100 200
+
+Linearity is only checked with at least MIN_SIZES stack sizes rendered
+MIN_REPEAT times each, fewer measures are reported without failing.
+"""
+import os
+import time
+import argparse
+import tempfile
+import statistics
+from pumpwood_deploy.deploy import DeployPumpWood
+from pumpwood_deploy.templates import get_environment
+from pumpwood_deploy.models.deploy import PumpwoodModels
+from pumpwood_deploy.crawlers.criptocurrency.deploy import (
+    CrawlerCriptoCurrency)
+from pumpwood_deploy.microservices.api_gateway.deploy import ApiGateway
+from pumpwood_deploy.microservices.frontend.deploy import (
+    PumpwoodFrontEndMicroservice)
+from pumpwood_deploy.microservices.pumpwood_auth.deploy import (
+    PumpWoodAuthMicroservice)
+from pumpwood_deploy.microservices.pumpwood_datalake.deploy import (
+    PumpWoodDatalakeMicroservice)
+from pumpwood_deploy.microservices.pumpwood_decision.deploy import (
+    PumpWoodDescisionMicroservice, PumpwoodDecisionModel)
+from pumpwood_deploy.microservices.pumpwood_description_matcher.deploy \
+    import PumpWoodDescriptionMatcherMicroservice
+from pumpwood_deploy.microservices.pumpwood_estimation.deploy import (
+    PumpWoodEstimationMicroservice)
+from pumpwood_deploy.microservices.pumpwood_etl.deploy import (
+    PumpWoodETLMicroservice)
+from pumpwood_deploy.microservices.pumpwood_prediction.deploy import (
+    PumpWoodPredictionMicroservice)
+from pumpwood_deploy.microservices.pumpwood_scheduler.deploy import (
+    PumpWoodSchedulerMicroservice)
+from pumpwood_deploy.microservices.pumpwood_transformation.deploy import (
+    PumpWoodTransformationMicroservice)
+
+
+MIN_SIZES = 4
+MIN_REPEAT = 3
+DEFAULT_TEMPLATE_CACHE_PATH = os.path.join(
+    tempfile.gettempdir(), 'pumpwood_deploy_benchmark', 'jinja2')
+
+
+def use_template_cache(path: str = None):
+    """
+    Set the directory of compiled templates used by the benchmarks.
+
+    Benchmarks do not write on the user template cache: compiled templates
+    go to `path`, to PUMPWOOD_DEPLOY_TEMPLATE_CACHE if set, or to
+    DEFAULT_TEMPLATE_CACHE_PATH. Only has effect before the first render of
+    the process, see templates.get_environment.
+
+    Kwargs:
+        path (str): Cache directory, empty string to not cache on disk.
+    """
+    if path is not None:
+        os.environ['PUMPWOOD_DEPLOY_TEMPLATE_CACHE'] = path
+    else:
+        os.environ.setdefault(
+            'PUMPWOOD_DEPLOY_TEMPLATE_CACHE', DEFAULT_TEMPLATE_CACHE_PATH)
+
+
+def synthetic_stack(n_workers: int, bucket_key_path: str,
+                    output_path: str = 'outputs',
+                    all_microservices: bool = False,
+                    **kwargs) -> DeployPumpWood:
+    """
+    Build a stack with `n_workers` models and `n_workers` decision models.
+
+    Args:
+        n_workers (int): Number of PumpwoodModels and of
+            PumpwoodDecisionModel.
+        bucket_key_path (str): Path of a bucket key file.
+    Kwargs:
+        output_path (str): Output path of the deploy.
+        all_microservices (bool): Add also the description matcher,
+            estimation, ETL, prediction, scheduler, transformation,
+            crawler, frontend and api gateway microservices.
+            AirflowMicroservice is never added, its secrets template needs
+            a `secret_key` the class does not set.
+        **kwargs: Other DeployPumpWood arguments.
+    Returns:
+        DeployPumpWood: Stack, never deployed.
+    """
+    deploy = DeployPumpWood(
+        bucket_key_path=bucket_key_path, model_user_password='password',
+        rabbitmq_secret='secret', hash_salt='salt',
+        kong_db_disk_name='kong-db', kong_db_disk_size='10Gi',
+        cluster_name='benchmark', cluster_zone='zone',
+        cluster_project='project', output_path=output_path, **kwargs)
+    db = {
+        'db_password': 'password', 'microservice_password': 'password',
+        'bucket_name': 'bucket', 'version_app': '1.0',
+        'firewall_ips': ['10.0.0.0/8']}
+    deploy.add_microservice(PumpWoodAuthMicroservice(
+        secret_key='key', email_host_user='user',
+        email_host_password='password', version_static='1.0',
+        disk_name='auth-db', disk_size='10Gi', postgres_public_ip='10.0.0.1',
+        **db))
+    deploy.add_microservice(PumpWoodDatalakeMicroservice(
+        version_worker='1.0', disk_name='datalake-db', disk_size='10Gi',
+        postgres_public_ip='10.0.0.2', **db))
+    deploy.add_microservice(PumpWoodDescisionMicroservice(
+        disk_name='decision-db', disk_size='10Gi',
+        postgres_public_ip='10.0.0.3', **db))
+    if all_microservices:
+        deploy.add_microservice(PumpWoodDescriptionMatcherMicroservice(
+            disk_name='matcher-db', disk_size='10Gi', **db))
+        deploy.add_microservice(PumpWoodEstimationMicroservice(
+            version_worker='1.0', disk_name='estimation-db',
+            disk_size='10Gi', **db))
+        deploy.add_microservice(PumpWoodETLMicroservice(
+            version_worker='1.0', disk_name='etl-db', disk_size='10Gi',
+            **db))
+        deploy.add_microservice(PumpWoodPredictionMicroservice(
+            version_rawdata='1.0', version_dataloader='1.0',
+            disk_name='prediction-db', disk_size='10Gi', **db))
+        deploy.add_microservice(PumpWoodSchedulerMicroservice(
+            version_worker='1.0', disk_name='scheduler-db',
+            disk_size='10Gi', **db))
+        deploy.add_microservice(PumpWoodTransformationMicroservice(
+            disk_name='transformation-db', disk_size='10Gi', **db))
+        deploy.add_microservice(CrawlerCriptoCurrency(
+            db_password='password', microservice_password='password',
+            bitfinex_api_key='key', bitfinex_api_secret='secret',
+            disk_size='10Gi', disk_name='crawler-db', bucket_name='bucket',
+            version_app='1.0', version_worker_candle='1.0',
+            version_worker_balance='1.0', version_worker_order='1.0'))
+        deploy.add_microservice(PumpwoodFrontEndMicroservice(
+            version='1.0', gateway_public_ip='10.0.0.4',
+            microservice_password='password'))
+    for i in range(n_workers):
+        deploy.add_microservice(PumpwoodModels(
+            model_type='model-%s' % i, version='1.0', bucket_name='bucket'))
+        deploy.add_microservice(PumpwoodDecisionModel(
+            decision_model_name='decision-%s' % i, version='1.0',
+            bucket_name='bucket', repository='gcr.io/repository'))
+    if all_microservices:
+        deploy.add_microservice(ApiGateway(
+            gateway_public_ip='10.0.0.4', email_contact='admin@pumpwood.io',
+            version='1.0'))
+    return deploy
+
+
+def time_render(deploy: DeployPumpWood, repeat: int = 3) -> dict:
+    """
+    Time the render of all microservices of a stack.
+
+    Args:
+        deploy (DeployPumpWood): Stack.
+    Kwargs:
+        repeat (int): Number of renders, the median is reported.
+    Returns:
+        dict: Median `seconds` of the renders, `n_resources` rendered and
+            `repeat`.
+    """
+    times = []
+    n_resources = 0
+    for i in range(repeat):
+        start = time.perf_counter()
+        n_resources = 0
+        for m in deploy.microsservices_to_deploy:
+            n_resources = n_resources + len(deploy._render_resources(m))
+        times.append(time.perf_counter() - start)
+    return {
+        'seconds': statistics.median(times), 'n_resources': n_resources,
+        'repeat': repeat}
+
+
+def linear_fit(x: list, y: list) -> dict:
+    """
+    Least squares fit of y = intercept + slope * x.
+
+    Returns:
+        dict: `slope`, `intercept` and `r2`.
+    """
+    n = float(len(x))
+    mean_x = sum(x) / n
+    mean_y = sum(y) / n
+    sxx = sum([(xi - mean_x) ** 2 for xi in x])
+    sxy = sum([(xi - mean_x) * (yi - mean_y) for xi, yi in zip(x, y)])
+    slope = sxy / sxx if sxx else 0.0
+    intercept = mean_y - slope * mean_x
+    ss_tot = sum([(yi - mean_y) ** 2 for yi in y])
+    ss_res = sum([
+        (yi - intercept - slope * xi) ** 2 for xi, yi in zip(x, y)])
+    r2 = 1.0 - ss_res / ss_tot if ss_tot else 1.0
+    return {'slope': slope, 'intercept': intercept, 'r2': r2}
+
+
+def render_benchmark(sizes: list = (25, 50, 100, 200), repeat: int = 3,
+                     min_r2: float = 0.95,
+                     template_cache: str = None) -> dict:
+    """
+    Benchmark render time against the number of workers.
+
+    Kwargs:
+        sizes (list): Numbers of models (and of decision models) of each
+            stack.
+        repeat (int): Renders of each stack, the median is reported.
+        min_r2 (float): Minimum r2 of the linear fit of render time on the
+            number of workers to consider the growth linear.
+        template_cache (str): Directory of compiled templates, see
+            use_template_cache.
+    Returns:
+        dict: `results` with `n_workers`, `n_resources`, `seconds` and
+            `ms_per_worker` of each stack, `fit` (see linear_fit),
+            `linear` (None if there are less than MIN_SIZES sizes or
+            MIN_REPEAT repeats to check it) and `templates_compiled`
+            (compiled templates on the package environment, the same for
+            all stack sizes).
+    """
+    use_template_cache(template_cache)
+    results = []
+    compiled = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        key_path = os.path.join(temp_dir, 'key.json')
+        with open(key_path, 'w') as file:
+            file.write('{}')
+        for n_workers in sizes:
+            deploy = synthetic_stack(
+                n_workers, bucket_key_path=key_path,
+                output_path=os.path.join(temp_dir, 'outputs'))
+            result = time_render(deploy, repeat=repeat)
+            result['n_workers'] = n_workers
+            result['ms_per_worker'] = \
+                1000 * result['seconds'] / max(n_workers, 1)
+            results.append(result)
+            compiled.append(len(get_environment().cache))
+
+    fit = linear_fit(
+        [r['n_workers'] for r in results], [r['seconds'] for r in results])
+    linear = None
+    if len(set(sizes)) >= MIN_SIZES and repeat >= MIN_REPEAT:
+        linear = fit['r2'] >= min_r2
+    return {
+        'results': results, 'fit': fit, 'linear': linear,
+        'templates_compiled': compiled}
+
+
+def main():
+    """Run the benchmark from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument(
+        '--workers', type=int, nargs='+', default=[25, 50, 100, 200],
+        help='Numbers of models and decision models of the stacks.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument(
+        '--template-cache', default=None,
+        help='Directory of compiled templates, default a temp directory.')
+    args = parser.parse_args()
+
+    benchmark = render_benchmark(
+        sizes=args.workers, repeat=args.repeat,
+        template_cache=args.template_cache)
+    print('%10s %10s %10s %14s' % (
+        'workers', 'resources', 'seconds', 'ms/worker'))
+    for r in benchmark['results']:
+        print('%10s %10s %10.3f %14.3f' % (
+            r['n_workers'], r['n_resources'], r['seconds'],
+            r['ms_per_worker']))
+    fit = benchmark['fit']
+    verdict = {
+        True: 'linear', False: 'NOT linear',
+        None: 'not checked, needs %s sizes and %s repeats' % (
+            MIN_SIZES, MIN_REPEAT)}[benchmark['linear']]
+    print('fit: %.3f ms/worker + %.3f ms, r2 %.4f -> %s' % (
+        1000 * fit['slope'], 1000 * fit['intercept'], fit['r2'], verdict))
+    print('compiled templates: %s' % (benchmark['templates_compiled'], ))
+    if benchmark['linear'] is False:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
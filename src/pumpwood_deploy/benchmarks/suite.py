@@ -0,0 +1,467 @@
+"""
+Benchmark suite of stack construction, render, deploy files and deploy.
+
+Builds synthetic stacks with all microservice classes and 10, 100 and 1000
+PumpwoodModels and PumpwoodDecisionModel, and measures for each one the
+wall time, peak Python memory (tracemalloc, on a second run) and processes
+spawned of:
+
+- constructor: creating DeployPumpWood and the microservice objects;
+- create_deployment_file: templates of all microservices;
+- render: DeployPumpWood.render, in memory;
+- create_deploy_files: render and write the deploy files;
+- deploy_cluster: deploy end to end against stub kubectl and gcloud
+    commands that record their calls.
+
+Results are compared with stored baselines (baselines.json next to this
+module) and the command fails on regressions:
+
+    python -m pumpwood_deploy.benchmarks.suite --models 10 100 1000
+    python -m pumpwood_deploy.benchmarks.suite --save-baseline
+
+Wall times are stored and compared as multiples of the time of a fixed
+reference workload measured on the same run (see reference_seconds), so
+baselines recorded on one machine can be checked on another one. Memory
+and spawns do not depend on the machine speed and are compared as they
+are.
+"""
+import io
+import os
+import sys
+import json
+import time
+import hashlib
+import platform
+import statistics
+import argparse
+import tempfile
+import threading
+import contextlib
+import subprocess
+import tracemalloc
+from pumpwood_deploy.benchmarks.render import (
+    synthetic_stack, use_template_cache)
+from pumpwood_deploy.kubernets.credentials import ContextCache
+
+STAGES = [
+    'constructor', 'create_deployment_file', 'render',
+    'create_deploy_files', 'deploy_cluster']
+DEFAULT_BASELINE_PATH = os.path.join(
+    os.path.dirname(__file__), 'baselines.json')
+
+STUB_KUBECTL = """#!/bin/sh
+echo "kubectl $*" >> "$PUMPWOOD_BENCHMARK_CALLS"
+case "$1" in
+    config)
+        [ "$2" = "view" ] && exit 1
+        ;;
+    get)
+        echo '{"metadata": {"name": "stub", "generation": 1},' \\
+            '"spec": {"replicas": 1}, "status": {"observedGeneration": 1,' \\
+            '"replicas": 1, "updatedReplicas": 1, "availableReplicas": 1,' \\
+            '"phase": "Bound"}, "subsets": [{"addresses":' \\
+            '[{"ip": "10.0.0.1"}]}]}'
+        ;;
+esac
+exit 0
+"""
+STUB_GCLOUD = """#!/bin/sh
+echo "gcloud $*" >> "$PUMPWOOD_BENCHMARK_CALLS"
+exit 0
+"""
+
+
+def reference_seconds(repeat: int = 5) -> float:
+    """
+    Time a fixed pure Python workload, the speed reference of the machine.
+
+    The workload serializes, parses, hashes and sorts a list of resource
+    like dicts, it does not use pumpwood_deploy code, so regressions of the
+    package do not change it.
+
+    Kwargs:
+        repeat (int): Runs of the workload, the median is returned.
+    Returns:
+        float: Median seconds of a run.
+    """
+    data = [{
+        'name': 'resource-%s' % i, 'labels': {'index': str(i)},
+        'values': list(range(20))} for i in range(2000)]
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        for j in range(5):
+            text = json.dumps(data, sort_keys=True)
+            json.loads(text)
+            hashlib.sha256(text.encode()).hexdigest()
+            sorted(data, key=lambda d: d['name'], reverse=j % 2 == 0)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+@contextlib.contextmanager
+def count_spawns():
+    """
+    Count the processes spawned with subprocess (also used by asyncio).
+
+    Yields:
+        dict: `spawns` updated while the context is open.
+    """
+    counter = {'spawns': 0}
+    lock = threading.Lock()
+    original_init = subprocess.Popen.__init__
+
+    def counted_init(popen, *args, **kwargs):
+        with lock:
+            counter['spawns'] = counter['spawns'] + 1
+        original_init(popen, *args, **kwargs)
+
+    subprocess.Popen.__init__ = counted_init
+    try:
+        yield counter
+    finally:
+        subprocess.Popen.__init__ = original_init
+
+
+def peak_memory(function, quiet: bool = True) -> float:
+    """
+    Run a function tracing Python allocations.
+
+    Args:
+        function (callable): Function without arguments.
+    Kwargs:
+        quiet (bool): Discard what the function prints.
+    Returns:
+        float: Peak traced memory in MB.
+    """
+    output = io.StringIO() if quiet else sys.stdout
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(output):
+            function()
+        return tracemalloc.get_traced_memory()[1] / 1024.0 ** 2
+    finally:
+        tracemalloc.stop()
+
+
+def measure(function, memory: bool = True, quiet: bool = True) -> dict:
+    """
+    Run a function measuring wall time, peak memory and spawns.
+
+    Wall time and spawns are measured on a first run. Peak memory is
+    measured on a second run tracing allocations, so wall time does not
+    include the tracing overhead.
+
+    Args:
+        function (callable): Function without arguments.
+    Kwargs:
+        memory (bool): Run again tracing Python allocations to report peak
+            memory.
+        quiet (bool): Discard what the function prints.
+    Returns:
+        dict: `seconds`, `peak_mb` (None if not traced), `spawns` and the
+            `result` of the first run.
+    """
+    output = io.StringIO() if quiet else sys.stdout
+    with count_spawns() as counter, contextlib.redirect_stdout(output):
+        start = time.perf_counter()
+        result = function()
+        seconds = time.perf_counter() - start
+
+    peak_mb = None
+    if memory:
+        peak_mb = peak_memory(function, quiet=quiet)
+    return {
+        'seconds': seconds, 'peak_mb': peak_mb,
+        'spawns': counter['spawns'], 'result': result}
+
+
+@contextlib.contextmanager
+def stub_commands(temp_dir: str):
+    """
+    Put stub kubectl and gcloud first on PATH.
+
+    Stubs record each call on a file, `get` returns a ready resource so
+    readiness waits finish on the first poll.
+
+    Args:
+        temp_dir (str): Directory of the stubs.
+    Yields:
+        str: Path of the calls file, one line for each call.
+    """
+    bin_path = os.path.join(temp_dir, 'bin')
+    os.makedirs(bin_path, exist_ok=True)
+    for name, content in [('kubectl', STUB_KUBECTL),
+                          ('gcloud', STUB_GCLOUD)]:
+        path = os.path.join(bin_path, name)
+        with open(path, 'w') as file:
+            file.write(content)
+        os.chmod(path, 0o755)
+    calls_path = os.path.join(temp_dir, 'calls.log')
+    open(calls_path, 'w').close()
+
+    environ = dict(os.environ)
+    os.environ['PATH'] = bin_path + os.pathsep + os.environ.get('PATH', '')
+    os.environ['PUMPWOOD_BENCHMARK_CALLS'] = calls_path
+    try:
+        yield calls_path
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+
+
+def benchmark_stack(n_models: int, stages: list = STAGES,
+                    memory: bool = True, max_workers: int = 8) -> list:
+    """
+    Benchmark the stages of a stack with `n_models` workers.
+
+    Args:
+        n_models (int): Number of models and of decision models.
+    Kwargs:
+        stages (list): Stages to run, see STAGES. The constructor is always
+            run.
+        memory (bool): Report peak memory, see measure.
+        max_workers (int): Concurrent deploy commands on deploy_cluster.
+    Returns:
+        list: Dicts with `stage`, `n_models`, `seconds`, `peak_mb`,
+            `spawns` and `n_steps`, deploy_cluster also with
+            `kubectl_calls` made by the deploy and its scripts.
+    """
+    results = []
+
+    def add(stage, measured, n_steps, **extra):
+        result = {
+            'stage': stage, 'n_models': n_models,
+            'seconds': measured['seconds'], 'peak_mb': measured['peak_mb'],
+            'spawns': measured['spawns'], 'n_steps': n_steps}
+        result.update(extra)
+        results.append(result)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        key_path = os.path.join(temp_dir, 'key.json')
+        with open(key_path, 'w') as file:
+            file.write('{}')
+        output_path = os.path.join(temp_dir, 'outputs')
+        # Stub logins must not be cached on the user cluster context cache
+        context_cache = ContextCache(
+            path=os.path.join(temp_dir, 'kube_context.json'))
+
+        measured = measure(lambda: synthetic_stack(
+            n_models, bucket_key_path=key_path, output_path=output_path,
+            all_microservices=True, context_cache=context_cache),
+            memory=memory)
+        deploy = measured['result']
+        add('constructor', measured, len(deploy.microsservices_to_deploy))
+
+        if 'create_deployment_file' in stages:
+            measured = measure(lambda: [
+                m.create_deployment_file()
+                for m in deploy.microsservices_to_deploy], memory=memory)
+            add('create_deployment_file', measured, sum(
+                [len(r) for r in measured['result']]))
+
+        if 'render' in stages:
+            measured = measure(deploy.render, memory=memory)
+            add('render', measured, len(measured['result'].steps))
+
+        if 'create_deploy_files' in stages:
+            measured = measure(deploy.create_deploy_files, memory=memory)
+            n_steps = len(measured['result']['service_cmds']) + \
+                len(measured['result']['microservice_cmds'])
+            add('create_deploy_files', measured, n_steps,
+                files=2 * n_steps)
+
+        if 'deploy_cluster' in stages:
+            def deploy_cluster():
+                return deploy.deploy_cluster(
+                    max_workers=max_workers, wait_ready=True)
+
+            with stub_commands(temp_dir) as calls_path:
+                measured = measure(deploy_cluster, memory=False)
+                with open(calls_path, 'r') as file:
+                    calls = file.read().splitlines()
+                if memory:
+                    measured['peak_mb'] = peak_memory(deploy_cluster)
+            report = measured['result']
+            add('deploy_cluster', measured, len(report['nodes']),
+                kubectl_calls=len(calls), failed=len(report['failed']))
+    return results
+
+
+def result_key(result: dict) -> str:
+    """Key of a result on the baselines, `<stage>/<n_models>`."""
+    return '%s/%s' % (result['stage'], result['n_models'])
+
+
+def load_baselines(path: str = DEFAULT_BASELINE_PATH) -> dict:
+    """
+    Load baselines.
+
+    Args:
+        path (str): Baselines file.
+    Returns:
+        dict: `reference_seconds` and `machine` of the run that recorded
+            them and `results` by result_key, None if the file does not
+            exist.
+    """
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r') as file:
+        baselines = json.load(file)
+    if 'results' not in baselines:
+        raise Exception(
+            'Baselines at %s have absolute times only, record them again '
+            'with --save-baseline' % path)
+    return baselines
+
+
+def save_baselines(results: list, reference: float,
+                   path: str = DEFAULT_BASELINE_PATH):
+    """
+    Store results as baselines.
+
+    Baselines of stages and sizes not run are kept only if they were
+    recorded with a similar reference time, otherwise all are replaced,
+    as are baselines with absolute times only.
+
+    Args:
+        results (list): Results of benchmark_stack.
+        reference (float): Reference time of the run, see
+            reference_seconds.
+    Kwargs:
+        path (str): Baselines file.
+    """
+    baselines = None
+    if os.path.isfile(path):
+        with open(path, 'r') as file:
+            baselines = json.load(file)
+    stored = {}
+    if baselines is not None and 'results' in baselines and abs(
+            baselines['reference_seconds'] / reference - 1) < 0.1:
+        stored = baselines['results']
+    for r in results:
+        stored[result_key(r)] = {
+            'relative_time': r['seconds'] / reference,
+            'seconds': r['seconds'], 'peak_mb': r['peak_mb'],
+            'spawns': r['spawns'], 'n_steps': r['n_steps']}
+    with open(path, 'w') as file:
+        json.dump({
+            'reference_seconds': reference,
+            'machine': {
+                'python': platform.python_version(),
+                'processor': platform.machine(),
+                'system': platform.system()},
+            'results': stored}, file, indent=2, sort_keys=True)
+        file.write('\n')
+
+
+def compare_baselines(results: list, baselines: dict, reference: float,
+                      time_tolerance: float = 0.5,
+                      memory_tolerance: float = 0.25) -> list:
+    """
+    Compare results with baselines.
+
+    Args:
+        results (list): Results of benchmark_stack.
+        baselines (dict): Baselines, see load_baselines.
+        reference (float): Reference time of the run, see
+            reference_seconds.
+    Kwargs:
+        time_tolerance (float): Allowed relative increase of wall time,
+            as a multiple of the reference time.
+        memory_tolerance (float): Allowed relative increase of peak
+            memory.
+    Returns:
+        list: Regressions as text, empty if none. More spawns than the
+            baseline is always a regression.
+    """
+    regressions = []
+    for r in results:
+        key = result_key(r)
+        baseline = baselines['results'].get(key)
+        if baseline is None:
+            continue
+        relative_time = r['seconds'] / reference
+        if relative_time > \
+                baseline['relative_time'] * (1 + time_tolerance):
+            regressions.append(
+                '%s: %.3fs (%.1fx reference), baseline %.1fx reference' % (
+                    key, r['seconds'], relative_time,
+                    baseline['relative_time']))
+        if r['peak_mb'] is not None and baseline['peak_mb'] is not None \
+                and r['peak_mb'] > \
+                baseline['peak_mb'] * (1 + memory_tolerance):
+            regressions.append('%s: %.1f MB peak, baseline %.1f MB' % (
+                key, r['peak_mb'], baseline['peak_mb']))
+        if r['spawns'] > baseline['spawns']:
+            regressions.append('%s: %s spawns, baseline %s' % (
+                key, r['spawns'], baseline['spawns']))
+    return regressions
+
+
+def main():
+    """Run the benchmark suite from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument(
+        '--models', type=int, nargs='+', default=[10, 100, 1000],
+        help='Numbers of models and decision models of the stacks.')
+    parser.add_argument(
+        '--deploy-models', type=int, nargs='+', default=[10, 100],
+        help='Stacks also deployed end to end with stub kubectl.')
+    parser.add_argument(
+        '--stages', nargs='+', default=STAGES, choices=STAGES)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH)
+    parser.add_argument(
+        '--save-baseline', action='store_true',
+        help='Store the results as baselines instead of comparing.')
+    parser.add_argument('--time-tolerance', type=float, default=0.5)
+    parser.add_argument('--memory-tolerance', type=float, default=0.25)
+    parser.add_argument(
+        '--no-memory', action='store_true',
+        help='Do not run each stage again to trace memory.')
+    args = parser.parse_args()
+
+    use_template_cache()
+    reference = reference_seconds()
+    print('Reference workload: %.3fs' % reference)
+    results = []
+    for n_models in args.models:
+        stages = [
+            s for s in args.stages
+            if s != 'deploy_cluster' or n_models in args.deploy_models]
+        results.extend(benchmark_stack(
+            n_models, stages=stages, memory=not args.no_memory))
+
+    print('%-24s %8s %10s %10s %8s %8s' % (
+        'stage', 'models', 'seconds', 'peak MB', 'spawns', 'steps'))
+    for r in results:
+        print('%-24s %8s %10.3f %10s %8s %8s' % (
+            r['stage'], r['n_models'], r['seconds'],
+            '-' if r['peak_mb'] is None else '%.1f' % r['peak_mb'],
+            r['spawns'], r['n_steps']))
+        if r['stage'] == 'deploy_cluster':
+            print('%-24s %8s kubectl/gcloud calls: %s, failed: %s' % (
+                '', '', r['kubectl_calls'], r['failed']))
+
+    if args.save_baseline:
+        save_baselines(results, reference=reference, path=args.baseline)
+        print('Baselines saved at: ' + args.baseline)
+        return
+
+    baselines = load_baselines(args.baseline)
+    if baselines is None:
+        print('!!!No baselines at %s, record them with --save-baseline' % (
+            args.baseline, ))
+        raise SystemExit(1)
+    regressions = compare_baselines(
+        results, baselines, reference=reference,
+        time_tolerance=args.time_tolerance,
+        memory_tolerance=args.memory_tolerance)
+    if regressions:
+        print('!!!Regressions:\n' + '\n'.join(regressions))
+        raise SystemExit(1)
+    print('No regressions against: ' + args.baseline)
+
+
+if __name__ == '__main__':
+    main()
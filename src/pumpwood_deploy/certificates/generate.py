@@ -0,0 +1,120 @@
+"""
+In-process TLS key and certificate generation.
+
+Keys and certificates are generated with cryptography, without openssl
+processes or temporary files, so they can be created from many threads at
+the same time. PEM output is the same openssl writes (PKCS#8 unencrypted
+keys and X.509 certificates).
+"""
+import datetime
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+
+
+KEY_TYPES = ['ecdsa-p256', 'rsa-2048', 'rsa-4096']
+"""Supported key types. ECDSA P-256 keys are generated in microseconds and
+have faster handshakes, but old clients may accept only RSA keys."""
+DEFAULT_KEY_TYPE = 'rsa-2048'
+"""Default key type, RSA 2048 as created by the former openssl command."""
+DEFAULT_COMMON_NAME = 'pumpwood.murabei.com'
+
+
+def generate_private_key(key_type: str = DEFAULT_KEY_TYPE):
+    """
+    Generate a private key.
+
+    Kwargs:
+        key_type (str): One of KEY_TYPES.
+    Returns:
+        Private key object of cryptography.
+    """
+    if key_type == 'ecdsa-p256':
+        return ec.generate_private_key(ec.SECP256R1())
+    if key_type in ['rsa-2048', 'rsa-4096']:
+        return rsa.generate_private_key(
+            public_exponent=65537, key_size=int(key_type.split('-')[1]))
+    raise Exception('Key type not implemented: %s, use one of %s' % (
+        key_type, KEY_TYPES))
+
+
+def key_pem(private_key) -> str:
+    """Serialize a private key as unencrypted PKCS#8 PEM."""
+    return private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()).decode()
+
+
+def certificate_pem(certificate) -> str:
+    """Serialize a certificate as PEM."""
+    return certificate.public_bytes(serialization.Encoding.PEM).decode()
+
+
+def create_certificate(private_key, common_name: str = DEFAULT_COMMON_NAME,
+                       days: int = 365, issuer_key=None,
+                       issuer_certificate=None, is_ca: bool = False,
+                       dns_names: list = None):
+    """
+    Create a X.509 certificate for a key.
+
+    Args:
+        private_key: Key of the certificate, see generate_private_key.
+    Kwargs:
+        common_name (str): Common name of the subject.
+        days (int): Days the certificate is valid.
+        issuer_key: Key that signs the certificate, default `private_key`
+            (self-signed).
+        issuer_certificate: Certificate of the issuer, needed if
+            `issuer_key` is set.
+        is_ca (bool): Certificate may sign other certificates.
+        dns_names (list): Subject alternative names.
+    Returns:
+        cryptography.x509.Certificate: Signed certificate.
+    """
+    subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    issuer = subject
+    if issuer_key is None:
+        issuer_key = private_key
+    else:
+        issuer = issuer_certificate.subject
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    builder = x509.CertificateBuilder()\
+        .subject_name(subject)\
+        .issuer_name(issuer)\
+        .public_key(private_key.public_key())\
+        .serial_number(x509.random_serial_number())\
+        .not_valid_before(now - datetime.timedelta(minutes=5))\
+        .not_valid_after(now + datetime.timedelta(days=days))\
+        .add_extension(
+            x509.BasicConstraints(ca=is_ca, path_length=None),
+            critical=True)
+    if dns_names:
+        builder = builder.add_extension(
+            x509.SubjectAlternativeName(
+                [x509.DNSName(n) for n in dns_names]),
+            critical=False)
+    return builder.sign(private_key=issuer_key, algorithm=hashes.SHA256())
+
+
+def self_signed_key_crt(common_name: str = DEFAULT_COMMON_NAME,
+                        key_type: str = DEFAULT_KEY_TYPE,
+                        days: int = 365) -> dict:
+    """
+    Generate a key and its self-signed certificate.
+
+    Kwargs:
+        common_name (str): Common name of the certificate.
+        key_type (str): One of KEY_TYPES.
+        days (int): Days the certificate is valid.
+    Returns:
+        dict: `ssl_key` and `ssl_crt` as PEM strings.
+    """
+    private_key = generate_private_key(key_type)
+    certificate = create_certificate(
+        private_key, common_name=common_name, days=days)
+    return {
+        'ssl_key': key_pem(private_key),
+        'ssl_crt': certificate_pem(certificate)}
@@ -0,0 +1,205 @@
+"""
+Local store of the microservices TLS certificates.
+
+Certificates are kept on a directory and reused on every deploy until they
+are close to expire, so Secrets with certificates do not change between
+deploys (and postgres pods are not restarted). All certificates are signed
+by an internal CA of the store:
+
+    <path>/ca.json
+    <path>/<namespace>/<microservice>.json
+
+Private keys may be encrypted on disk with a passphrase.
+"""
+import os
+import json
+import time
+import tempfile
+import threading
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from pumpwood_deploy.certificates.generate import (
+    generate_private_key, create_certificate, certificate_pem, key_pem,
+    DEFAULT_KEY_TYPE, DEFAULT_COMMON_NAME)
+
+
+class CertificateStore:
+    """Persistent certificates keyed by microservice and namespace."""
+
+    ca_common_name = 'pumpwood-deploy internal CA'
+
+    def __init__(self, path: str, passphrase: str = None,
+                 key_type: str = DEFAULT_KEY_TYPE, days: int = 365,
+                 renew_before_days: int = 30, ca_days: int = 3650):
+        """
+        __init__.
+
+        Args:
+            path (str): Directory of the store.
+        Kwargs:
+            passphrase (str): If set, private keys are encrypted on disk.
+                Stores created with a passphrase can not be read without it.
+            key_type (str): Key type of new certificates, see
+                certificates.generate.KEY_TYPES. Stored certificates of
+                other types are renewed.
+            days (int): Days new certificates are valid.
+            renew_before_days (int): Certificates that expire in less days
+                are renewed.
+            ca_days (int): Days the internal CA is valid.
+        """
+        self.path = path
+        self.passphrase = passphrase
+        self.key_type = key_type
+        self.days = days
+        self.renew_before_days = renew_before_days
+        self.ca_days = ca_days
+        self._lock = threading.RLock()
+        self._ca = None
+
+    def __getstate__(self):
+        """Drop the lock and loaded CA when pickled to process pools."""
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_ca'] = None
+        return state
+
+    def __setstate__(self, state):
+        """Recreate the lock, the CA is loaded again from disk."""
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def _key_pem(self, private_key) -> str:
+        encryption = serialization.NoEncryption()
+        if self.passphrase is not None:
+            encryption = serialization.BestAvailableEncryption(
+                self.passphrase.encode())
+        return private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=encryption).decode()
+
+    def _load_key(self, pem: str):
+        password = None
+        if self.passphrase is not None:
+            password = self.passphrase.encode()
+        return serialization.load_pem_private_key(
+            pem.encode(), password=password)
+
+    def _read(self, path: str) -> dict:
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'r') as file:
+            return json.load(file)
+
+    def _write(self, path: str, data: dict):
+        dir_name = os.path.dirname(path)
+        if dir_name and not os.path.exists(dir_name):
+            os.makedirs(dir_name, mode=0o700, exist_ok=True)
+        # Unique temp file (created 0600) so concurrent writers of the same
+        # entry never write on the same file before the atomic replace
+        fd, temp_path = tempfile.mkstemp(
+            dir=dir_name or '.', prefix=os.path.basename(path) + '.',
+            suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as file:
+                json.dump(data, file, indent=2, sort_keys=True)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _expiring(self, entry: dict) -> bool:
+        renew_at = entry['not_after'] - self.renew_before_days * 86400
+        return time.time() >= renew_at
+
+    def _entry(self, private_key, certificate, days: int, **extra) -> dict:
+        entry = {
+            'ssl_key': self._key_pem(private_key),
+            'ssl_crt': certificate_pem(certificate),
+            'fingerprint': certificate.fingerprint(hashes.SHA256()).hex(),
+            'not_after': time.time() + days * 86400,
+            'key_type': self.key_type, 'created_at': time.time()}
+        entry.update(extra)
+        return entry
+
+    def ca(self) -> dict:
+        """
+        Return the internal CA, creating or renewing it if needed.
+
+        Returns:
+            dict: `key` and `certificate` objects and the CA `entry` as
+                stored.
+        """
+        with self._lock:
+            if self._ca is not None and not self._expiring(self._ca['entry']):
+                return self._ca
+            path = os.path.join(self.path, 'ca.json')
+            entry = self._read(path)
+            if entry is None or self._expiring(entry):
+                private_key = generate_private_key(self.key_type)
+                certificate = create_certificate(
+                    private_key, common_name=self.ca_common_name,
+                    days=self.ca_days, is_ca=True)
+                entry = self._entry(
+                    private_key, certificate, days=self.ca_days)
+                self._write(path, entry)
+                print('#####Created certificate store CA: ' + path)
+            else:
+                private_key = self._load_key(entry['ssl_key'])
+                certificate = x509.load_pem_x509_certificate(
+                    entry['ssl_crt'].encode())
+            self._ca = {
+                'key': private_key, 'certificate': certificate,
+                'entry': entry}
+            return self._ca
+
+    def ca_certificate(self) -> str:
+        """PEM certificate of the internal CA, to verify the servers."""
+        return self.ca()['entry']['ssl_crt']
+
+    def certificate(self, microservice: str, namespace: str,
+                    common_name: str = DEFAULT_COMMON_NAME) -> dict:
+        """
+        Return the certificate of a microservice on a namespace.
+
+        The stored certificate is returned while it is valid, signed by the
+        current CA and of the store key type, otherwise a new one is
+        issued and stored.
+
+        Args:
+            microservice (str): Name of the microservice.
+            namespace (str): Namespace of the deploy.
+        Kwargs:
+            common_name (str): Common name of new certificates.
+        Returns:
+            dict: `ssl_key` (unencrypted PEM), `ssl_crt` and `ca_crt`.
+        """
+        path = os.path.join(self.path, namespace, microservice + '.json')
+        with self._lock:
+            ca = self.ca()
+            entry = self._read(path)
+            if entry is None or self._expiring(entry) or \
+                    entry.get('ca_fingerprint') != \
+                    ca['entry']['fingerprint'] or \
+                    entry.get('key_type') != self.key_type:
+                private_key = generate_private_key(self.key_type)
+                certificate = create_certificate(
+                    private_key, common_name=common_name, days=self.days,
+                    issuer_key=ca['key'],
+                    issuer_certificate=ca['certificate'],
+                    dns_names=[common_name])
+                entry = self._entry(
+                    private_key, certificate, days=self.days,
+                    microservice=microservice,
+                    namespace=namespace,
+                    ca_fingerprint=ca['entry']['fingerprint'])
+                self._write(path, entry)
+                print('#####Issued certificate: %s/%s' % (
+                    namespace, microservice))
+            else:
+                private_key = self._load_key(entry['ssl_key'])
+
+        return {
+            'ssl_key': key_pem(private_key), 'ssl_crt': entry['ssl_crt'],
+            'ca_crt': ca['entry']['ssl_crt']}
@@ -2,13 +2,11 @@
 import os
 import base64
 from pumpwood_deploy.microservices.postgres.postgres import \
-    create_ssl_key_ssl_crt
-from jinja2 import Template
+    PostgresCertificates
+from pumpwood_deploy.templates import render_template
 from .resources.yml__resources import (
-    app_deployment, worker_candle_deployment,
-    worker_balance_deployment, worker_order_deployment,
-    deployment_postgres, secrets, services__load_balancer,
-    volume_postgres)
+    app_deployment, worker_candle_deployment, worker_balance_deployment,
+    worker_order_deployment, deployment_postgres, secrets, volume_postgres)
 
 
 class CrawlerCriptoCurrency:
@@ -55,7 +53,6 @@ class CrawlerCriptoCurrency:
           No example yet.
 
         """
-        postgres_certificates = create_ssl_key_ssl_crt()
         self._db_password = base64.b64encode(db_password.encode()).decode()
         self._microservice_password = base64.b64encode(
             microservice_password.encode()).decode()
@@ -64,10 +61,8 @@ class CrawlerCriptoCurrency:
         self._bitfinex_api_secret = base64.b64encode(
             bitfinex_api_secret.encode()).decode()
 
-        self._ssl_crt = base64.b64encode(
-            postgres_certificates['ssl_crt'].encode()).decode()
-        self._ssl_key = base64.b64encode(
-            postgres_certificates['ssl_key'].encode()).decode()
+        self._postgres_certificates = PostgresCertificates(
+            microservice=type(self).__name__)
 
         self.postgres_public_ip = postgres_public_ip
         self.firewall_ips = firewall_ips
@@ -92,8 +87,8 @@ class CrawlerCriptoCurrency:
             microservice_password=self._microservice_password,
             bitfinex_api_key=self._bitfinex_api_key,
             bitfinex_api_secret=self._bitfinex_api_secret,
-            ssl_key=self._ssl_key,
-            ssl_crt=self._ssl_crt)
+            ssl_key=self._postgres_certificates.ssl_key,
+            ssl_crt=self._postgres_certificates.ssl_crt)
         volume_postgres_text_formated = volume_postgres.format(
             disk_size=self.disk_size, disk_name=self.disk_name)
 
@@ -144,9 +139,9 @@ class CrawlerCriptoCurrency:
         ]
 
         if self.firewall_ips is not None and self.postgres_public_ip:
-            services__load_balancer_template = Template(
-                services__load_balancer)
-            svcs__load_balancer_text = services__load_balancer_template.render(
+            svcs__load_balancer_text = render_template(
+                '.resources.yml__resources', 'services__load_balancer',
+                package=__package__,
                 postgres_public_ip=self.postgres_public_ip,
                 firewall_ips=self.firewall_ips)
             list_return.append({
@@ -1,10 +1,87 @@
 """Pumpwood Deploy."""
 import os
-import stat
-import shutil
+import time
+import yaml
+from itertools import repeat
+from concurrent.futures import (
+    ThreadPoolExecutor, ProcessPoolExecutor, as_completed)
 from pumpwood_deploy.microservices.standard.standard import (
     StandardMicroservices)
+from pumpwood_deploy.microservices.postgres.postgres import (
+    use_certificate_store)
+from pumpwood_deploy.certificates.store import CertificateStore
 from pumpwood_deploy.kubernets.kubernets import Kubernets
+from pumpwood_deploy.kubernets.api import KubernetesAPIClient
+from pumpwood_deploy.kubernets.credentials import ContextCache
+from pumpwood_deploy.kubernets.executor import DeployGraph, DeployExecutor
+from pumpwood_deploy.kubernets.async_runner import AsyncDeployRunner
+from pumpwood_deploy.kubernets.wait import (
+    resource_conditions, conditions_from_manifest, wait_for_conditions)
+from pumpwood_deploy.kubernets.timeline import DeployTimeline
+from pumpwood_deploy.kubernets.events import EventMonitor
+from pumpwood_deploy.kubernets.plan import DeployPlanner, plan_summary
+from pumpwood_deploy.kubernets.prune import ResourcePruner, prune_summary
+from pumpwood_deploy.kubernets.rollout import (
+    CanaryRollout, CanaryFailedError, HealthGate)
+from pumpwood_deploy.manifests.hashing import (
+    fingerprint_manifests, content_hash, CONTENT_HASH_ANNOTATION)
+from pumpwood_deploy.manifests.data import render_data_resource
+from pumpwood_deploy.manifests.bundle import (
+    RenderBundle, DEPLOY_OUTPUT, SERVICES_OUTPUT)
+from pumpwood_deploy.manifests.schema import (
+    ManifestValidationError, format_error, parse_error,
+    DEFAULT_KUBERNETES_VERSION)
+from pumpwood_deploy.manifests.labels import owner_labels
+from pumpwood_deploy.manifests.model import (
+    load_manifests, load_documents, dump_documents)
+from pumpwood_deploy.history.state import DeployState
+from pumpwood_deploy.history.journal import DeployJournal
+from pumpwood_deploy.history.snapshots import SnapshotStore
+
+
+def render_microservice(microservice, stack_name: str,
+                        patches: list = ()) -> list:
+    """
+    Render the resources of a microservice.
+
+    Resources are parsed once, stamped with the ownership labels, patched
+    and fingerprinted, see DeployPumpWood.add_patch. The text rendered by
+    the microservice is kept on `templates`, to be validated as written.
+
+    Args:
+        microservice: Microservice object with create_deployment_file.
+        stack_name (str): Stack of the pumpwood.io/stack label.
+    Kwargs:
+        patches (list): Tuples of patch function and kinds patched.
+    Returns:
+        list: Resource dicts with `key`, `hash`, `content`, `manifests` and
+            `templates` (tuples of template name, as Microservice/resource,
+            and its text).
+    Raises:
+        ManifestValidationError: If a template is not valid YAML, with the
+            template name and line.
+    """
+    resources = []
+    microservice_name = type(microservice).__name__
+    for d in microservice.create_deployment_file():
+        d = render_data_resource(d)
+        template = microservice_name + '/' + d['name']
+        try:
+            manifests = load_manifests(d['content'])
+        except yaml.YAMLError as e:
+            raise ManifestValidationError([parse_error(e, file=template)])
+        labels = owner_labels(
+            stack=stack_name, microservice=microservice_name,
+            component=d['name'])
+        for m in manifests:
+            m.add_labels(labels)
+            for patch, kinds in patches:
+                if kinds is None or m.kind in kinds:
+                    patch(m)
+        resource = fingerprint_manifests(d, manifests)
+        resource['templates'] = [(template, d['content'])]
+        resources.append(resource)
+    return resources
 
 
 class DeployPumpWood():
@@ -13,13 +90,30 @@ class DeployPumpWood():
     create_kube_cmd = (
         'SCRIPTPATH="$( cd "$(dirname "$0")" ; pwd -P )"\n'
         'kubectl apply -f $SCRIPTPATH/{file} --namespace={namespace}')
+    server_side_apply_cmd = (
+        'SCRIPTPATH="$( cd "$(dirname "$0")" ; pwd -P )"\n'
+        'kubectl apply --server-side --field-manager={field_manager} '
+        '{force_conflicts}-f $SCRIPTPATH/{file} --namespace={namespace}')
+    field_manager = 'pumpwood-deploy'
+    state_path_template = '{output_path}/deploy_state__{namespace}.json'
+    journal_path_template = '{output_path}/deploy_journal__{namespace}.jsonl'
+    timeline_path_template = '{output_path}/deploy_timeline__{namespace}.json'
+    snapshot_path_template = '{output_path}/snapshots__{namespace}'
+    batch_types = ['secrets', 'deploy', 'volume', 'services']
 
     def __init__(self, bucket_key_path: str, model_user_password: str,
                  rabbitmq_secret: str, hash_salt: str, kong_db_disk_name: str,
                  kong_db_disk_size: str, cluster_name: str,
                  cluster_zone: str, cluster_project: str,
                  namespace="default",
-                 gateway_health_url: str = "health-check/pumpwood-auth-app/"):
+                 gateway_health_url: str = "health-check/pumpwood-auth-app/",
+                 api_client: KubernetesAPIClient = None,
+                 context_cache: ContextCache = None,
+                 output_path: str = 'outputs', kubeconfig: str = None,
+                 stack_name: str = None, render_workers: int = None,
+                 render_processes: bool = False,
+                 certificate_store: CertificateStore = None,
+                 kubernetes_version: str = DEFAULT_KUBERNETES_VERSION):
         """
         __init__.
 
@@ -34,13 +128,53 @@ class DeployPumpWood():
 
         Kwargs:
             namespace [str]: Which namespace to deploy the system.
+            gateway_health_url [str]: Health check path of the api gateway,
+                probed on canary rollouts, see deploy_cluster.
+            api_client [KubernetesAPIClient]: Talk directly to the API
+                server instead of calling kubectl, see Kubernets.
+            context_cache [ContextCache]: Cache of cluster logins, gcloud
+                and kubectl are called only when deploying and if the
+                cached login expired, see Kubernets.ensure_context.
+            output_path [str]: Directory of the deploy files, state,
+                journal and timeline. Relative paths are resolved on
+                object creation.
+            kubeconfig [str]: Kubeconfig used by gcloud and kubectl, default
+                the user kubeconfig. Use one file for each cluster to deploy
+                on many clusters at the same time.
+            stack_name [str]: Name of the stack, set on the
+                pumpwood.io/stack label of all resources and used to find
+                the resources to prune. Default the namespace.
+            render_workers [int]: Number of microservices rendered at the
+                same time, default the pool default for the number of
+                CPUs. Set 1 to render one after another.
+            render_processes [bool]: Render on a process pool instead of a
+                thread pool. Microservices and patches must be picklable
+                (patches defined at module level, not lambdas).
+            certificate_store [CertificateStore]: If set, the postgres
+                certificates of the microservices are taken from the store
+                (keyed by microservice and namespace) and reused on every
+                deploy until they are close to expire, so the database
+                secrets do not change between deploys.
+            kubernetes_version [str]: Kubernetes minor version of the
+                cluster, manifests are validated against its schemas when
+                asked, see validate. It is not checked against the version
+                the cluster reports.
         """
         self.deploy = []
 
         self.kube_client = Kubernets(
             cluster_name=cluster_name, zone=cluster_zone,
-            project=cluster_project, namespace=namespace)
+            project=cluster_project, namespace=namespace,
+            api_client=api_client, context_cache=context_cache,
+            kubeconfig=kubeconfig)
         self.namespace = namespace
+        self.gateway_health_url = gateway_health_url
+        self.output_path = os.path.abspath(output_path)
+        self.stack_name = stack_name or namespace
+        self.render_workers = render_workers
+        self.render_processes = render_processes
+        self.certificate_store = certificate_store
+        self.kubernetes_version = kubernetes_version
 
         standard_microservices = StandardMicroservices(
             hash_salt=hash_salt,
@@ -53,196 +187,726 @@ class DeployPumpWood():
 
         self.microsservices_to_deploy = [
             standard_microservices]
+        self.patches = []
         self.base_path = os.getcwd()
 
     def add_microservice(self, microservice):
         """
         add_microservice.
 
-        .
+        If the deploy has a certificate_store, the postgres certificates of
+        the microservice are set from it.
         """
+        if self.certificate_store is not None and \
+                hasattr(microservice, '_postgres_certificates'):
+            use_certificate_store(
+                microservice, store=self.certificate_store,
+                namespace=self.namespace)
         self.microsservices_to_deploy.append(microservice)
 
-    def create_deploy_files(self):
-        """create_deploy_files."""
-        sevice_cmds = []
-        deploy_cmds = []
+    def add_patch(self, patch, kinds: list = None):
+        """
+        Add a patch applied to every rendered manifest document.
+
+        Patches change the documents in memory before they are hashed and
+        serialized, so cross-cutting changes do not need to edit the
+        templates:
+
+            deploy.add_patch(
+                lambda m: m.set_resources(requests={'cpu': '10m'}),
+                kinds=['Deployment'])
 
-        counter = 0
-        service_counter = 0
+        Args:
+            patch (callable): Function receiving the Manifest object of a
+                document (see manifests.model) and changing it in place.
+        Kwargs:
+            kinds (list): Kinds patched, default all.
+        """
+        self.patches.append((patch, kinds))
 
-        ###################################################################
-        # Limpa o deploy anterior e cria as pastas para receber os arquivos
-        # do novo deploy
-        if os.path.exists('outputs/deploy_output'):
-            shutil.rmtree('outputs/deploy_output')
-        os.makedirs('outputs/deploy_output')
-        os.makedirs('outputs/deploy_output/resources/')
+    def _render_resources(self, microservice) -> list:
+        """Render the resources of a microservice as manifest objects."""
+        return render_microservice(
+            microservice, stack_name=self.stack_name, patches=self.patches)
 
-        if os.path.exists('outputs/services_output'):
-            shutil.rmtree('outputs/services_output')
-        os.makedirs('outputs/services_output')
-        os.makedirs('outputs/services_output/resources/')
-        ###################################################################
+    def _render_all(self) -> list:
+        """
+        Render the resources of all microservices.
+
+        Microservices are rendered concurrently on a pool of
+        `render_workers`, results are returned in the order of
+        microsservices_to_deploy whatever the order they finish.
+        """
+        microservices = self.microsservices_to_deploy
+        if self.render_workers == 1 or len(microservices) < 2:
+            return [self._render_resources(m) for m in microservices]
+        pool_class = ThreadPoolExecutor
+        if self.render_processes:
+            # Certificates created on the workers would be lost, create them
+            # here so they are the same on every render
+            for m in microservices:
+                if hasattr(m, '_postgres_certificates'):
+                    m._postgres_certificates.get()
+            pool_class = ProcessPoolExecutor
+        with pool_class(max_workers=self.render_workers) as pool:
+            return list(pool.map(
+                render_microservice, microservices,
+                repeat(self.stack_name), repeat(self.patches)))
+
+    def render(self, batch: bool = False,
+               force_conflicts: bool = False) -> RenderBundle:
+        """
+        Render the deploy of all microservices in memory.
+
+        Kwargs:
+            batch (bool): Merge the secrets, volumes, deployments and
+                services of each microservice in one multi-document step
+                applied with a single server-side apply, instead of one step
+                and one kubectl call for each resource.
+            force_conflicts (bool): On batch mode, force server-side apply
+                to take ownership of fields managed by other field managers,
+                if False kubectl fails on conflicts.
+        Returns:
+            RenderBundle: Deploy steps in order, nothing is written on
+                disk, see RenderBundle.write.
+        """
+        bundle = RenderBundle(namespace=self.namespace)
 
         #####################################################################
         # Usa os arqivos de template e subistitui com as variáveis para criar
         # os templates de deploy
-        print('###Creating microservices files:')
-        # m = self.microsservices_to_deploy[0]
-        for m in self.microsservices_to_deploy:
+        print('###Rendering microservices:')
+        rendered = self._render_all()
+        for m_index, m in enumerate(self.microsservices_to_deploy):
             print('\nProcessing: ' + str(m))
-            temp_deployments = m.create_deployment_file()
+            temp_deployments = rendered[m_index]
+            batch_resources = []
             for d in temp_deployments:
-                if d['type'] in ['secrets', 'deploy', 'volume']:
-                    file_name_temp = 'resources/{counter}__{name}.yml'
-                    file_name = file_name_temp.format(
-                        counter=counter,
-                        name=d['name'])
-
-                    print('Creating secrets/deploy: ' + file_name)
-                    with open('outputs/deploy_output/' +
-                              file_name, 'w') as file:
-                        file.write(d['content'])
-
-                    file_name_sh_temp = (
-                        'outputs/deploy_output/{counter}__{name}.sh')
-                    file_name_sh = file_name_sh_temp.format(
-                        counter=counter, name=d['name'])
-
-                    with open(file_name_sh, 'w') as file:
-                        content = self.create_kube_cmd.format(
-                            file=file_name, namespace=self.namespace)
-                        file.write(content)
-                    os.chmod(file_name_sh, stat.S_IRWXU)
-
-                    deploy_cmds.append({
-                        'command': 'run', 'file': file_name_sh,
-                        'sleep': d.get('sleep')})
-                    counter = counter + 1
-
-                elif d['type'] == 'secrets_file':
-                    command_formated = (
-                        'SCRIPTPATH="$( cd "$(dirname "$0")" ; pwd -P )"\n'
-                        "kubectl delete secret --namespace={namespace} {name};"
-                        "\n"
-                        "kubectl create secret generic {name} "
-                        "--from-file='{path}' "
-                        "--namespace={namespace}").format(
-                            name=d["name"], path=d["path"],
-                            namespace=self.namespace)
-                    file_name_temp = (
-                        'outputs/deploy_output/{counter}__{name}.sh')
-                    file_name = file_name_temp.format(
-                        counter=counter, name=d['name'])
-
-                    print('Creating secrets_file: ' + file_name)
-                    with open(file_name, 'w') as file:
-                        file.write(command_formated)
-                    os.chmod(file_name, stat.S_IRWXU)
-                    deploy_cmds.append({
-                        'command': 'run', 'file': file_name,
-                        'sleep': d.get('sleep')})
-                    counter = counter + 1
-
-                elif d['type'] == 'configmap':
-                    file_name_resource_temp = 'resources/{name}'
-                    file_name_resource = file_name_resource_temp.format(
-                        name=d['file_name'])
-
-                    if 'content' in d.keys():
-                        with open('outputs/deploy_output/' +
-                                  file_name_resource, 'w') as file:
-                            file.write(d['content'])
-                    elif 'file_path' in d.keys():
-                        with open(d['file_path'], 'rb') as file:
-                            file_data = file.read()
-                        with open('outputs/deploy_output/' +
-                                  file_name_resource, 'wb') as file:
-                            file.write(file_data)
-
-                    command_formated = None
-                    if d.get('keyname') is None:
-                        command_text = (
-                            'SCRIPTPATH="$( cd "$(dirname "$0")" ; pwd -P )"\n'
-                            "kubectl delete configmap {name};\n"
-                            "kubectl create configmap {name} "
-                            '--from-file="$SCRIPTPATH/{file_name}" '
-                            '--namespace={namespace}')
-                        command_formated = command_text.format(
-                            name=d['name'], file_name=file_name_resource,
-                            namespace=self.namespace)
-                    else:
-                        command_text = (
-                            'SCRIPTPATH="$( cd "$(dirname "$0")" ; pwd -P )"\n'
-                            "kubectl delete configmap {name};\n"
-                            "kubectl create configmap {name} "
-                            '--from-file="{keyname}=$SCRIPTPATH/{file_name}" '
-                            '--namespace={namespace}')
-                        command_formated = command_text.format(
-                            name=d['name'], file_name=file_name_resource,
-                            keyname=d['keyname'], namespace=self.namespace)
-
-                    file_name_temp = 'outputs/deploy_output/' + \
-                                     '{counter}__{name}.sh'
-                    file_name = file_name_temp.format(
-                        counter=counter,
-                        name=d['name'])
-
-                    print('Creating configmap: ' + file_name)
-                    with open(file_name, 'w') as file:
-                        file.write(command_formated)
-                    deploy_cmds.append({'command': 'run', 'file': file_name,
-                                        'sleep': d.get('sleep')})
-                    os.chmod(file_name, stat.S_IRWXU)
-                    counter = counter + 1
+                if batch and d['type'] in self.batch_types:
+                    batch_resources.append(d)
+
+                elif d['type'] in ['secrets', 'deploy', 'volume']:
+                    bundle.add_step(
+                        DEPLOY_OUTPUT, name=d['name'], content=d['content'],
+                        script_template=self.create_kube_cmd,
+                        manifests=d['manifests'], sleep=d.get('sleep'),
+                        type=d['type'], microservice=m_index,
+                        wait=resource_conditions(d),
+                        skip_unchanged=d.get('skip_unchanged', False),
+                        templates=d['templates'],
+                        key=d['key'], hash=d['hash'])
 
                 elif d['type'] == 'services':
-                    file_name_temp = 'resources/{service_counter}__{name}.yml'
-                    file_name = file_name_temp.format(
-                        service_counter=service_counter,
-                        name=d['name'])
-
-                    print('Creating services: ' + file_name)
-                    with open('outputs/services_output/' +
-                              file_name, 'w') as file:
-                        file.write(d['content'])
-
-                    file_name_sh_temp = \
-                        'outputs/services_output/' +\
-                        '{service_counter}__{name}.sh'
-                    file_name_sh = file_name_sh_temp .format(
-                        service_counter=service_counter,
-                        name=d['name'])
-
-                    with open(file_name_sh, 'w') as file:
-                        content = self.create_kube_cmd.format(
-                            file=file_name, namespace=self.namespace)
-                        file.write(content)
-
-                    os.chmod(file_name_sh, stat.S_IRWXU)
-                    sevice_cmds.append({
-                        'command': 'run', 'file': file_name_sh,
-                        'sleep': d.get('sleep')})
-                    service_counter = service_counter + 1
+                    bundle.add_step(
+                        SERVICES_OUTPUT, name=d['name'],
+                        content=d['content'],
+                        script_template=self.create_kube_cmd,
+                        manifests=d['manifests'], sleep=d.get('sleep'),
+                        type=d['type'], microservice=m_index,
+                        wait=resource_conditions(d),
+                        templates=d['templates'],
+                        key=d['key'], hash=d['hash'])
 
                 elif d['type'] == 'endpoint_services':
                     raise Exception('Not used anymore')
                 else:
                     raise Exception('Type not implemented: %s' % (d['type'], ))
+
+            if len(batch_resources) != 0:
+                wait_conditions = []
+                manifests = []
+                for b in batch_resources:
+                    wait_conditions.extend(resource_conditions(b))
+                    manifests.extend(b['manifests'])
+                bundle.add_step(
+                    DEPLOY_OUTPUT, name=m.__class__.__name__,
+                    content='\n---\n'.join(
+                        [b['content'] for b in batch_resources]),
+                    script_template=self.server_side_apply_cmd,
+                    script_context={
+                        'field_manager': self.field_manager,
+                        'force_conflicts': (
+                            '--force-conflicts ' if force_conflicts
+                            else '')},
+                    manifests=manifests,
+                    sleep=max([b.get('sleep') or 0
+                               for b in batch_resources]),
+                    type='batch', microservice=m_index,
+                    wait=wait_conditions, force_conflicts=force_conflicts,
+                    templates=[
+                        t for b in batch_resources for t in b['templates']],
+                    key=','.join([b['key'] for b in batch_resources]),
+                    hash=content_hash(
+                        ','.join([b['hash'] for b in batch_resources])
+                        .encode()))
         #####################################################################
+        return bundle.resolve_dependencies()
+
+    def _validate_bundle(self, bundle: RenderBundle) -> list:
+        start = time.time()
+        errors = bundle.validate(kubernetes_version=self.kubernetes_version)
+        print('###Validated %s manifests against Kubernetes %s in %.3fs, '
+              '%s errors' % (len(bundle.steps), self.kubernetes_version,
+                             time.time() - start, len(errors)))
+        for e in errors:
+            print('!!! ' + format_error(e))
+        return errors
+
+    def validate(self, batch: bool = False) -> list:
+        """
+        Validate the rendered manifests without any cluster call.
+
+        All microservices are rendered in memory and every document is
+        checked against the bundled OpenAPI schemas of
+        `kubernetes_version`: unknown fields, wrong types, invalid values,
+        missing required fields and duplicated keys, see SchemaValidator.
+
+        Kwargs:
+            batch (bool): Validate the batch mode steps, see render.
+        Returns:
+            list: Errors with `file` (template of the resource, as
+                Microservice/resource name), `line` on the template,
+                `kind`, `name`, `path` and `message`. Empty if all
+                manifests are valid.
+        """
+        return self._validate_bundle(self.render(batch=batch))
+
+    def create_deploy_files(self, batch: bool = False,
+                            force_conflicts: bool = False,
+                            write_files: bool = True,
+                            validate: bool = False):
+        """
+        create_deploy_files.
+
+        Kwargs:
+            batch (bool): Merge the resources of each microservice in one
+                server-side apply, see render.
+            force_conflicts (bool): On batch mode, force server-side apply
+                conflicts, see render.
+            write_files (bool): Write the manifests and deploy scripts on
+                <output_path>/deploy_output and
+                <output_path>/services_output. If False the commands keep
+                their manifests in memory and can only be applied with an
+                api_client.
+            validate (bool): Validate the manifests before writing them,
+                see validate.
+        Returns:
+            dict: `service_cmds` and `microservice_cmds` deploy commands.
+        Raises:
+            ManifestValidationError: If `validate` is set and any manifest
+                is not valid, nothing is written.
+        """
+        bundle = self.render(batch=batch, force_conflicts=force_conflicts)
+        if validate:
+            errors = self._validate_bundle(bundle)
+            if len(errors) != 0:
+                raise ManifestValidationError(errors)
+        if write_files:
+            bundle.write(self.output_path)
+        return bundle.commands()
+
+    def _check_write_files(self, write_files: bool):
+        if not write_files and self.kube_client.api_client is None:
+            raise Exception(
+                'Deploy without files needs an api_client, kubectl applies '
+                'the written deploy files')
+
+    def plan(self, max_workers: int = 20) -> dict:
+        """
+        Show what deploy_cluster would change, without changing the cluster.
 
-        return {
-            'service_cmds': sevice_cmds,
-            'microservice_cmds': deploy_cmds}
+        All microservices are rendered in memory and every resource is
+        applied with server-side dry-run concurrently. Resources are
+        classified as create, update (with the changed fields), unchanged
+        or orphaned (deployed by pumpwood deploy on this stack but not
+        rendered anymore).
 
-    def deploy_cluster(self):
-        """Deploy cluster."""
-        deploy_cmds = self.create_deploy_files()
-        print('\n\n###Deploying Services:')
-        self.kube_client.run_deploy_commmands(
-            deploy_cmds['service_cmds'])
+        Kwargs:
+            max_workers (int): Maximum number of concurrent requests to the
+                cluster.
+        Returns:
+            dict: Plan with `resources`, `summary` and `wall_time`, see
+                DeployPlanner.plan.
+        """
+        documents = []
+        for resources in self._render_all():
+            for d in resources:
+                documents.extend([
+                    (manifest.document, d['name'])
+                    for manifest in d['manifests']])
+
+        planner = DeployPlanner(
+            kube_client=self.kube_client, max_workers=max_workers)
+        plan = planner.plan(documents, stack=self.stack_name)
+        print(plan_summary(plan))
+        return plan
+
+    def prune(self, dry_run: bool = True, kinds: list = None,
+              max_workers: int = 10) -> dict:
+        """
+        Delete resources of the stack that are not rendered anymore.
+
+        Resources are found by their pumpwood.io/stack label, listed in bulk
+        one request per kind. The ones whose Kind/name is not rendered by
+        the current microservices (a removed PumpwoodModels, a renamed
+        secret) are deleted. Run with `dry_run` first to check the report.
+
+        Kwargs:
+            dry_run (bool): Only report the resources that would be pruned.
+            kinds (list): Kinds to prune, default secrets, configmaps,
+                deployments and services. Volumes are only pruned if
+                PersistentVolumeClaim or PersistentVolume are asked.
+            max_workers (int): Maximum number of concurrent requests.
+        Returns:
+            dict: Prune report with `resources`, `kept`, `dry_run` and
+                `wall_time`, see ResourcePruner.prune.
+        """
+        documents = []
+        for resources in self._render_all():
+            for d in resources:
+                documents.extend([
+                    manifest.document for manifest in d['manifests']])
+
+        pruner = ResourcePruner(
+            kube_client=self.kube_client, max_workers=max_workers)
+        prune_report = pruner.prune(
+            documents, stack=self.stack_name, kinds=kinds, dry_run=dry_run)
+        print(prune_summary(prune_report))
+        return prune_report
+
+    def deploy_cluster(self, max_workers: int = None,
+                       wait_ready: bool = False, timeout: float = 600,
+                       batch: bool = False, force_conflicts: bool = False,
+                       incremental: bool = False, resume: bool = False,
+                       canary_gate: HealthGate = None,
+                       gateway_url: str = None, prune: bool = False,
+                       watch_events: bool = False, stall_after: float = 30,
+                       write_files: bool = True, validate: bool = False):
+        """
+        Deploy cluster.
+
+        Kwargs:
+            max_workers (int): If set, deploy commands are run concurrently
+                following their dependency graph (secrets and volumes, then
+                postgres, then apps and workers) with at most `max_workers`
+                commands at the same time. If None the commands are run one
+                after another.
+            wait_ready (bool): Wait each resource to be ready (secret exists,
+                PVC bound, deployment rollout complete, service exists)
+                instead of sleeping the fixed `sleep` time.
+                Dependents start as soon as their dependencies are ready.
+            timeout (float): Timeout in seconds waiting for each resource.
+            batch (bool): Apply each microservice with one server-side
+                apply, see create_deploy_files.
+            force_conflicts (bool): Force server-side apply conflicts on
+                batch mode.
+            incremental (bool): Skip resources whose content hash is equal to
+                the one of their last successful deploy on this namespace.
+            resume (bool): Resume the last deploy run, only the steps that
+                failed or were not executed (or whose content changed) on the
+                last run are executed. Runs are recorded on an append-only
+                journal at <output_path>/deploy_journal__<namespace>.jsonl.
+            canary_gate (HealthGate): If set, app deployments are rolled out
+                progressively: a one replica canary is deployed and its
+                health-check path probed, the deployment is applied only if
+                the probes pass the gate latency and error thresholds, see
+                CanaryRollout. Failed canaries are removed and the step
+                fails.
+            gateway_url (str): Base url of the api gateway, if set
+                `gateway_health_url` is also probed with canaries running.
+            prune (bool): After a successful deploy, delete the resources
+                of the stack that are not rendered anymore, see prune.
+            watch_events (bool): Watch Pods and Events of the namespace
+                during the deploy, printing the time each new pod took to be
+                scheduled, pull its images, start and be ready, and why pods
+                are stalled (image pull, volume attach, crashloop), see
+                EventMonitor.
+            stall_after (float): Seconds a pod may take to be ready before
+                it is reported as stalled, when `watch_events` is set.
+            write_files (bool): Write the deploy files on `output_path`, if
+                False manifests are applied from memory, which needs an
+                api_client.
+            validate (bool): Validate all manifests offline against the
+                schemas of `kubernetes_version` before any cluster call, so
+                a wrong field fails the deploy before the first step runs.
+                Off by default, the default `kubernetes_version` may not be
+                the one of the cluster.
+        Returns:
+            dict: Deploy report with timing and critical path if
+                `max_workers` is set, None otherwise.
+        """
+        self._check_write_files(write_files)
+        deploy_cmds = self.create_deploy_files(
+            batch=batch, force_conflicts=force_conflicts,
+            write_files=write_files, validate=validate)
+        service_cmds = deploy_cmds['service_cmds']
+        microservice_cmds = deploy_cmds['microservice_cmds']
+        all_cmds = service_cmds + microservice_cmds
+
+        state = DeployState(
+            path=self.state_path_template.format(
+                output_path=self.output_path, namespace=self.namespace),
+            namespace=self.namespace)
+        journal = DeployJournal(
+            path=self.journal_path_template.format(
+                output_path=self.output_path, namespace=self.namespace))
+
+        skip_cmds = []
+        if incremental:
+            unchanged = [
+                c for c in service_cmds + microservice_cmds
+                if state.is_unchanged(c)]
+            print('\n\n###Unchanged resources, skipping %s commands:' % (
+                len(unchanged), ))
+            for c in unchanged:
+                print('  ' + c['file'])
+            skip_cmds.extend(unchanged)
+
+        resumed_from = None
+        if resume:
+            resumed_from = journal.last_run_id()
+            completed = journal.completed_steps(resumed_from)
+            already_run = [
+                c for c in service_cmds + microservice_cmds
+                if completed.get(c['key']) == c['hash'] and
+                c not in skip_cmds]
+            print('\n\n###Resuming run [%s], skipping %s commands:' % (
+                resumed_from, len(already_run)))
+            for c in already_run:
+                print('  ' + c['file'])
+            skip_cmds.extend(already_run)
+        service_cmds = [c for c in service_cmds if c not in skip_cmds]
+        microservice_cmds = [
+            c for c in microservice_cmds if c not in skip_cmds]
+
+        timeline = DeployTimeline()
+        rollout = None
+        canary_reports = []
+        if canary_gate is not None:
+            gateway_health = None
+            if gateway_url is not None:
+                gateway_health = gateway_url.rstrip('/') + '/' + \
+                    self.gateway_health_url.lstrip('/')
+            rollout = CanaryRollout(
+                kube_client=self.kube_client, gate=canary_gate,
+                gateway_url=gateway_health, timeout=timeout)
+
+        def deploy_command(cmd):
+            if rollout is None or cmd['type'] not in ['deploy', 'batch'] or \
+                    not rollout.app_deployments(cmd.get('content') or ''):
+                return self.kube_client.run_deploy_command(
+                    cmd, wait_ready=wait_ready, timeout=timeout)
+            try:
+                canary_reports.extend(rollout.rollout(
+                    cmd['content'],
+                    lambda: self.kube_client.run_deploy_command(
+                        cmd, wait_ready=wait_ready, timeout=timeout)))
+            except CanaryFailedError as e:
+                canary_reports.append(e.report)
+                raise
+            return 0
+
+        monitor = None
+        if watch_events:
+            monitor = EventMonitor(
+                kube_client=self.kube_client, stall_after=stall_after)
+
+        def run_function(cmd):
+            start = time.time()
+            journal.step_started(cmd)
+            if monitor is not None:
+                monitor.track(cmd)
+            with timeline.step(
+                    key=cmd['file'], name=cmd['name'],
+                    step_type=cmd['type']) as step:
+                try:
+                    return_code = deploy_command(cmd)
+                except Exception as e:
+                    error = str(e)
+                    if monitor is not None:
+                        diagnosis = monitor.diagnose_step(cmd)
+                        if diagnosis:
+                            error = error + '\nPods not ready:\n' + \
+                                '\n'.join(diagnosis)
+                            print('!!!Pods not ready on %s:\n%s' % (
+                                cmd['file'], '\n'.join(diagnosis)))
+                    journal.step_finished(cmd, 'failed', start, error=error)
+                    raise
+                finally:
+                    if monitor is not None:
+                        monitor.untrack(cmd)
+                if return_code in [0, None]:
+                    step.status = 'succeeded'
+                    state.update(cmd)
+                    journal.step_finished(cmd, 'succeeded', start)
+                else:
+                    step.status = 'failed'
+                    journal.step_finished(
+                        cmd, 'failed', start,
+                        error='Return code: %s' % (return_code, ))
+            return return_code
+
+        journal.start_run(resumed_from=resumed_from)
+        if monitor is not None:
+            monitor.start()
+        if max_workers is None:
+            run_status = 'failed'
+            try:
+                print('\n\n###Deploying Services:')
+                return_codes = []
+                for c in service_cmds:
+                    return_codes.append(run_function(c))
+
+                print('\n\n###Deploying Microservices:')
+                for c in microservice_cmds:
+                    return_codes.append(run_function(c))
+                if all([r in [0, None] for r in return_codes]):
+                    run_status = 'succeeded'
+                    self._save_snapshot(all_cmds, journal.run_id)
+                    if prune:
+                        self.prune(dry_run=False)
+            finally:
+                if monitor is not None:
+                    monitor.stop()
+                state.save()
+                journal.finish_run(run_status)
+                self._save_timeline(timeline)
+            return None
+
+        print('\n\n###Deploying Services and Microservices:')
+        graph = DeployGraph.from_deploy_commands(
+            service_cmds + microservice_cmds)
+        executor = DeployExecutor(
+            run_function=run_function, max_workers=max_workers)
+        run_status = 'failed'
+        report = None
+        prune_report = None
+        try:
+            report = executor.run(graph)
+            if len(report['failed']) == 0:
+                run_status = 'succeeded'
+                self._save_snapshot(all_cmds, journal.run_id)
+                if prune:
+                    prune_report = self.prune(
+                        dry_run=False, max_workers=max_workers)
+        finally:
+            if monitor is not None:
+                monitor.stop()
+            state.save()
+            journal.finish_run(run_status)
+            if report is not None:
+                timeline.finish(
+                    critical_path=report['critical_path'],
+                    critical_path_time=report['critical_path_time'])
+            self._save_timeline(timeline)
+        report['timeline'] = timeline.to_dict()
+        report['canary'] = canary_reports
+        report['prune'] = prune_report
+        report['pods'] = None if monitor is None else monitor.report()
+
+        if len(report['failed']) != 0:
+            print('!!!Failed commands: ' + ', '.join(report['failed']))
+        if len(report['skipped']) != 0:
+            print('!!!Skipped commands: ' + ', '.join(report['skipped']))
+        return report
+
+    async def deploy_cluster_async(self, max_concurrency: int = 10,
+                                   max_retries: int = 5,
+                                   wait_ready: bool = False,
+                                   timeout: float = 600, batch: bool = False,
+                                   force_conflicts: bool = False,
+                                   incremental: bool = False,
+                                   write_files: bool = True,
+                                   validate: bool = False):
+        """
+        Deploy cluster on an asyncio event loop.
 
-        print('\n\n###Deploying Microservices:')
-        self.kube_client.run_deploy_commmands(
-            deploy_cmds['microservice_cmds'])
+        Commands are run with AsyncDeployRunner, many workers
+        (PumpwoodModels, PumpwoodDecisionModel, ...) are applied at the same
+        time bounded by `max_concurrency`, retrying API server throttling and
+        transient errors with jittered exponential backoff. Steps are
+        recorded on the deploy journal and state as in deploy_cluster.
+
+        Kwargs:
+            max_concurrency (int): Maximum apply operations at the same time.
+            max_retries (int): Maximum retries of transient errors.
+            wait_ready (bool): Wait readiness instead of sleeping.
+            timeout (float): Timeout in seconds waiting for each resource.
+            batch (bool): Apply each microservice with one server-side apply.
+            force_conflicts (bool): Force server-side apply conflicts on
+                batch mode.
+            incremental (bool): Skip resources unchanged since their last
+                successful deploy.
+            write_files (bool): Write the deploy files, see deploy_cluster.
+            validate (bool): Validate the manifests before any cluster call,
+                see deploy_cluster.
+        Yields:
+            dict: Result of each command as it finishes, see
+                AsyncDeployRunner.run.
+        """
+        self._check_write_files(write_files)
+        deploy_cmds = self.create_deploy_files(
+            batch=batch, force_conflicts=force_conflicts,
+            write_files=write_files, validate=validate)
+        cmds = deploy_cmds['service_cmds'] + deploy_cmds['microservice_cmds']
+        all_cmds = cmds
+
+        state = DeployState(
+            path=self.state_path_template.format(
+                output_path=self.output_path, namespace=self.namespace),
+            namespace=self.namespace)
+        journal = DeployJournal(
+            path=self.journal_path_template.format(
+                output_path=self.output_path, namespace=self.namespace))
+        if incremental:
+            cmds = [c for c in cmds if not state.is_unchanged(c)]
+        cmds_by_file = dict([(c['file'], c) for c in cmds])
+
+        runner = AsyncDeployRunner(
+            kube_client=self.kube_client, max_concurrency=max_concurrency,
+            max_retries=max_retries, wait_ready=wait_ready, timeout=timeout)
+        journal.start_run()
+        run_status = 'succeeded'
+        try:
+            async for result in runner.run(cmds):
+                cmd = cmds_by_file[result['file']]
+                if result['status'] == 'succeeded':
+                    state.update(cmd)
+                else:
+                    run_status = 'failed'
+                if result['status'] != 'skipped':
+                    journal.step_finished(
+                        cmd, result['status'],
+                        time.time() - result['duration'],
+                        error=result['error'])
+                yield result
+            if run_status == 'succeeded':
+                self._save_snapshot(all_cmds, journal.run_id)
+        except BaseException:
+            run_status = 'failed'
+            raise
+        finally:
+            state.save()
+            journal.finish_run(run_status)
+
+    def _snapshot_store(self) -> SnapshotStore:
+        return SnapshotStore(self.snapshot_path_template.format(
+            output_path=self.output_path, namespace=self.namespace))
+
+    def _save_snapshot(self, cmds: list, run_id: str = None):
+        """Store the manifests of a successful deploy."""
+        documents = []
+        for c in cmds:
+            documents.extend(load_documents(c['content']))
+        snapshot_id = self._snapshot_store().save(documents, metadata={
+            'namespace': self.namespace, 'run_id': run_id})
+        print('#####Deploy snapshot: ' + snapshot_id)
+        return snapshot_id
+
+    def snapshots(self) -> list:
+        """
+        List the snapshots of successful deploys on the namespace.
+
+        Returns:
+            list: Snapshots with `id`, `deployed_at`, `metadata` and
+                `images`, oldest first.
+        """
+        return self._snapshot_store().list()
+
+    def rollback(self, to=None, max_workers: int = 10,
+                 wait_ready: bool = False, timeout: float = 600) -> dict:
+        """
+        Roll back the stack to the manifests of a previous deploy.
+
+        Each resource of the snapshot is compared with the cluster using the
+        content hash annotation and only the ones that differ (or do not
+        exist) are applied, in parallel. Secrets, configmaps and volumes
+        are applied before deployments and services. Resources created
+        after the snapshot are not removed, see prune.
+
+        Kwargs:
+            to (str|int): Snapshot id (or id prefix), or negative index of
+                the deploy history. Default the deploy before the last one.
+            max_workers (int): Maximum number of concurrent requests.
+            wait_ready (bool): Wait rolled back resources to be ready.
+            timeout (float): Timeout waiting resources.
+        Returns:
+            dict: `snapshot` id, `applied`, `unchanged` and `failed` keys
+                and `wall_time`.
+        """
+        start = time.time()
+        store = self._snapshot_store()
+        snapshot = store.load(store.resolve(to))
+        print('###Rolling back to snapshot: ' + snapshot['id'])
+
+        def differs(resource):
+            doc = resource['document']
+            live = self.kube_client.get_resource(
+                doc['kind'].lower(), doc['metadata']['name'])
+            if live is None:
+                return True
+            annotations = live.get('metadata', {}).get('annotations') or {}
+            return annotations.get(CONTENT_HASH_ANNOTATION) != \
+                resource['hash']
+
+        def apply(resource):
+            doc = resource['document']
+            self.kube_client.apply_document(doc)
+            if wait_ready:
+                wait_for_conditions(
+                    conditions_from_manifest(dump_documents([doc])),
+                    self.kube_client.get_resource, timeout=timeout)
+            return resource['key']
+
+        self.kube_client.ensure_context()
+        result = {
+            'snapshot': snapshot['id'], 'applied': [], 'unchanged': [],
+            'failed': []}
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            resources = snapshot['resources']
+            changed = [
+                r for r, d in zip(resources, pool.map(differs, resources))
+                if d]
+            result['unchanged'] = [
+                r['key'] for r in resources if r not in changed]
+            first_wave = [
+                r for r in changed
+                if r['document']['kind'] not in ['Deployment', 'Service']]
+            for wave in [first_wave, [
+                    r for r in changed if r not in first_wave]]:
+                futures = dict([
+                    (pool.submit(apply, r), r['key']) for r in wave])
+                for future in as_completed(futures):
+                    try:
+                        result['applied'].append(future.result())
+                        print('#####Rolled back: ' + futures[future])
+                    except Exception as e:
+                        result['failed'].append(futures[future])
+                        print('!!!Failed rollback %s: %s' % (
+                            futures[future], e))
+                if result['failed']:
+                    break
+
+        state = DeployState(
+            path=self.state_path_template.format(
+                output_path=self.output_path, namespace=self.namespace),
+            namespace=self.namespace)
+        state.invalidate(result['applied'] + result['failed'])
+        state.save()
+        result['wall_time'] = time.time() - start
+        print('###Rollback to %s: %s applied, %s unchanged, %s failed '
+              '[%.1fs]' % (
+                  snapshot['id'], len(result['applied']),
+                  len(result['unchanged']), len(result['failed']),
+                  result['wall_time']))
+        return result
+
+    def _save_timeline(self, timeline: DeployTimeline):
+        """Print timeline summary and save it as JSON."""
+        if timeline.end is None:
+            timeline.finish()
+        timeline_path = self.timeline_path_template.format(
+            output_path=self.output_path, namespace=self.namespace)
+        timeline.save(timeline_path)
+        print('\n\n' + timeline.summary())
+        print('#####Timeline saved at: ' + timeline_path)
@@ -0,0 +1,226 @@
+"""Deploy the same PumpWood stack on many clusters and namespaces."""
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class DeployTarget:
+    """Cluster and namespace where a stack is deployed."""
+
+    def __init__(self, name: str, cluster_name: str, cluster_zone: str,
+                 cluster_project: str, namespace: str = "default",
+                 overrides: dict = None, api_client=None):
+        """
+        __init__.
+
+        Args:
+            name (str): Unique name of the target (staging, prod, client-a).
+            cluster_name (str): Kubernets cluster name.
+            cluster_zone (str): Zone of the cluster.
+            cluster_project (str): Google project of the cluster.
+        Kwargs:
+            namespace (str): Namespace of the deploy.
+            overrides (dict): Target specific values used by the build
+                function (versions, disk names, replicas, ...).
+            api_client (KubernetesAPIClient): Client of the target cluster,
+                if None gcloud and kubectl are used with a kubeconfig file
+                of the target.
+        """
+        self.name = name
+        self.cluster_name = cluster_name
+        self.cluster_zone = cluster_zone
+        self.cluster_project = cluster_project
+        self.namespace = namespace
+        self.overrides = overrides or {}
+        self.api_client = api_client
+
+    def deploy_kwargs(self, output_path: str) -> dict:
+        """
+        Return the DeployPumpWood arguments that bind it to the target.
+
+        Each target has its own output directory and kubeconfig, so
+        deploys of different targets do not share files or kubectl current
+        context.
+
+        Args:
+            output_path (str): Base directory of the fleet deploy files.
+        Returns:
+            dict: cluster_name, cluster_zone, cluster_project, namespace,
+                api_client, output_path and kubeconfig arguments.
+        """
+        target_path = os.path.join(output_path, self.name)
+        return {
+            'cluster_name': self.cluster_name,
+            'cluster_zone': self.cluster_zone,
+            'cluster_project': self.cluster_project,
+            'namespace': self.namespace, 'api_client': self.api_client,
+            'output_path': target_path,
+            'kubeconfig': os.path.join(target_path, 'kubeconfig')}
+
+    def __repr__(self):
+        """__repr__."""
+        return 'DeployTarget({name}: {cluster}/{namespace})'.format(
+            name=self.name, cluster=self.cluster_name,
+            namespace=self.namespace)
+
+
+class FleetDeployer:
+    """
+    Deploy a PumpWood stack on many targets concurrently.
+
+    The stack is built once for each target by `build_function`, that
+    receives the target and the DeployPumpWood arguments bound to it:
+
+        def build(target, **deploy_kwargs):
+            deploy = DeployPumpWood(
+                bucket_key_path=..., **deploy_kwargs)
+            deploy.add_microservice(PumpWoodDatalakeMicroservice(
+                version_app=target.overrides.get('datalake', '1.0'), ...))
+            return deploy
+
+        fleet = FleetDeployer(build, targets=[staging, prod])
+        report = fleet.deploy(max_workers=4, wait_ready=True)
+
+    Stacks are built one at a time on the calling thread and deployed with
+    at most `max_concurrency` targets at the same time. Targets are always
+    deployed with the deploy graph (one command at a time if `max_workers`
+    is not set), so failed commands of every target are reported.
+    """
+
+    def __init__(self, build_function, targets: list,
+                 max_concurrency: int = 4,
+                 output_path: str = 'outputs/fleet'):
+        """
+        __init__.
+
+        Args:
+            build_function (callable): Function receiving a DeployTarget and
+                DeployPumpWood keyword arguments, returning a DeployPumpWood
+                with its microservices added.
+            targets (list): List of DeployTarget.
+        Kwargs:
+            max_concurrency (int): Maximum number of targets deployed at the
+                same time.
+            output_path (str): Base directory of the targets deploy files,
+                each target uses a sub directory with its name.
+        """
+        names = [t.name for t in targets]
+        duplicated = set([n for n in names if names.count(n) > 1])
+        if len(duplicated) != 0:
+            raise Exception('Duplicated target names: %s' % (
+                ', '.join(sorted(duplicated)), ))
+        if max_concurrency < 1:
+            raise Exception('max_concurrency must be greater than 0')
+        self.build_function = build_function
+        self.targets = targets
+        self.max_concurrency = max_concurrency
+        self.output_path = output_path
+
+    def build(self, target: DeployTarget):
+        """Build the DeployPumpWood of a target."""
+        deploy_kwargs = target.deploy_kwargs(self.output_path)
+        os.makedirs(deploy_kwargs['output_path'], exist_ok=True)
+        return self.build_function(target, **deploy_kwargs)
+
+    def _deploy_target(self, target: DeployTarget, deploy, **kwargs):
+        result = {
+            'target': target.name, 'cluster': target.cluster_name,
+            'namespace': target.namespace, 'status': None,
+            'wall_time': None, 'failed': [], 'skipped': [],
+            'report': None, 'error': None}
+        start = time.time()
+        try:
+            report = deploy.deploy_cluster(**kwargs)
+            result['report'] = report
+            result['failed'] = report['failed']
+            result['skipped'] = report['skipped']
+            result['status'] = (
+                'failed' if len(result['failed']) != 0 else 'succeeded')
+        except Exception as e:
+            result['status'] = 'failed'
+            result['error'] = '%s\n%s' % (e, traceback.format_exc())
+        result['wall_time'] = time.time() - start
+        return result
+
+    def deploy(self, targets: list = None, **kwargs) -> dict:
+        """
+        Deploy the stack on all targets.
+
+        Kwargs:
+            targets (list): Names of the targets to deploy, default all.
+            **kwargs: Arguments of DeployPumpWood.deploy_cluster, as
+                max_workers, wait_ready, incremental and canary_gate.
+                `max_workers` defaults to 1, the serial deploy of
+                deploy_cluster does not report failed commands.
+        Returns:
+            dict: `wall_time`, `succeeded` and `failed` target names and
+                `targets` with the result of each target: `status`,
+                `wall_time`, `failed` and `skipped` commands, deploy
+                `report` and `error`.
+        """
+        if kwargs.get('max_workers') is None:
+            kwargs['max_workers'] = 1
+        selected = [
+            t for t in self.targets if targets is None or t.name in targets]
+        start = time.time()
+
+        results = {}
+        deploys = []
+        for t in selected:
+            print('\n\n###Building target: %s' % (t, ))
+            try:
+                deploys.append((t, self.build(t)))
+            except Exception as e:
+                results[t.name] = {
+                    'target': t.name, 'cluster': t.cluster_name,
+                    'namespace': t.namespace, 'status': 'failed',
+                    'wall_time': 0.0, 'failed': [], 'skipped': [],
+                    'report': None,
+                    'error': '%s\n%s' % (e, traceback.format_exc())}
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool:
+            futures = [
+                pool.submit(self._deploy_target, t, d, **kwargs)
+                for t, d in deploys]
+            for future in as_completed(futures):
+                result = future.result()
+                results[result['target']] = result
+                print('###Target %s %s [%.1fs]' % (
+                    result['target'], result['status'],
+                    result['wall_time']))
+
+        ordered = [results[t.name] for t in selected]
+        fleet_report = {
+            'wall_time': time.time() - start,
+            'succeeded': [
+                r['target'] for r in ordered if r['status'] == 'succeeded'],
+            'failed': [
+                r['target'] for r in ordered if r['status'] == 'failed'],
+            'targets': ordered}
+        print('\n\n' + fleet_summary(fleet_report))
+        return fleet_report
+
+
+def fleet_summary(fleet_report: dict) -> str:
+    """
+    Text summary of a fleet deploy.
+
+    Args:
+        fleet_report (dict): Report returned by FleetDeployer.deploy.
+    Returns:
+        str: One line for each target with status, wall time and failures.
+    """
+    lines = ['###Fleet deploy: %s succeeded, %s failed [%.1fs]' % (
+        len(fleet_report['succeeded']), len(fleet_report['failed']),
+        fleet_report['wall_time'])]
+    for r in fleet_report['targets']:
+        detail = ''
+        if r['failed']:
+            detail = ' failed: ' + ', '.join(r['failed'])
+        elif r['error']:
+            detail = ' error: ' + r['error'].split('\n')[0]
+        lines.append('  %-10s %8.1fs %s (%s/%s)%s' % (
+            r['status'], r['wall_time'], r['target'], r['cluster'],
+            r['namespace'], detail))
+    return '\n'.join(lines)
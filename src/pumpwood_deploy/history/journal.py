@@ -0,0 +1,153 @@
+"""Append-only journal of deploy runs."""
+import os
+import json
+import time
+import uuid
+import threading
+
+
+class DeployJournal:
+    """
+    Append-only journal of deploy steps.
+
+    Each line of the journal is a JSON record. A run starts with a
+    `run_started` record, each step writes a `step` record when it starts and
+    when it finishes with its status, content hash and timing. Records are
+    flushed to disk as they are written so an interrupted deploy keeps the
+    status of every step that was executed.
+    """
+
+    def __init__(self, path: str):
+        """
+        __init__.
+
+        Args:
+            path (str): Path of the journal file.
+        """
+        self.path = path
+        self.run_id = None
+        self._lock = threading.Lock()
+
+    def _write(self, record: dict):
+        dir_name = os.path.dirname(self.path)
+        with self._lock:
+            if dir_name and not os.path.exists(dir_name):
+                os.makedirs(dir_name)
+            with open(self.path, 'a') as file:
+                file.write(json.dumps(record, sort_keys=True) + '\n')
+                file.flush()
+                os.fsync(file.fileno())
+
+    def read(self) -> list:
+        """
+        Read all journal records.
+
+        A truncated last line, from a process killed while writing, is
+        ignored.
+
+        Returns:
+            list: Journal records.
+        """
+        if not os.path.isfile(self.path):
+            return []
+        records = []
+        with open(self.path, 'r') as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+        return records
+
+    def start_run(self, resumed_from: str = None) -> str:
+        """
+        Start a new run.
+
+        Kwargs:
+            resumed_from (str): Id of the run being resumed.
+        Returns:
+            str: Id of the new run.
+        """
+        self.run_id = uuid.uuid4().hex
+        self._write({
+            'event': 'run_started', 'run_id': self.run_id,
+            'resumed_from': resumed_from, 'time': time.time()})
+        return self.run_id
+
+    def finish_run(self, status: str):
+        """
+        Finish current run.
+
+        Args:
+            status (str): Final status of the run (succeeded, failed).
+        """
+        self._write({
+            'event': 'run_finished', 'run_id': self.run_id,
+            'status': status, 'time': time.time()})
+
+    def step_started(self, cmd: dict):
+        """Register the start of a deploy step."""
+        self._write({
+            'event': 'step', 'run_id': self.run_id, 'status': 'started',
+            'key': cmd['key'], 'file': cmd['file'], 'hash': cmd['hash'],
+            'time': time.time()})
+
+    def step_finished(self, cmd: dict, status: str, start: float,
+                      error: str = None):
+        """
+        Register the end of a deploy step.
+
+        Args:
+            cmd (dict): Deploy command.
+            status (str): succeeded or failed.
+            start (float): Start time of the step.
+        Kwargs:
+            error (str): Error message of failed steps.
+        """
+        end = time.time()
+        self._write({
+            'event': 'step', 'run_id': self.run_id, 'status': status,
+            'key': cmd['key'], 'file': cmd['file'], 'hash': cmd['hash'],
+            'start': start, 'time': end, 'duration': end - start,
+            'error': error})
+
+    def last_run_id(self) -> str:
+        """Return the id of the last run on the journal, None if empty."""
+        run_ids = [
+            r['run_id'] for r in self.read()
+            if r['event'] == 'run_started']
+        if len(run_ids) == 0:
+            return None
+        return run_ids[-1]
+
+    def completed_steps(self, run_id: str = None) -> dict:
+        """
+        Return the steps that succeeded on a run and the runs it resumed.
+
+        Kwargs:
+            run_id (str): Id of the run, default last run.
+        Returns:
+            dict: Step key to content hash of the steps that succeeded.
+        """
+        records = self.read()
+        run_id = run_id or self.last_run_id()
+        resumed_from = dict([
+            (r['run_id'], r.get('resumed_from'))
+            for r in records if r['event'] == 'run_started'])
+
+        chain = []
+        while run_id is not None and run_id not in chain:
+            chain.append(run_id)
+            run_id = resumed_from.get(run_id)
+
+        completed = {}
+        # Older runs first, so newer results override them
+        for chain_run_id in reversed(chain):
+            for r in records:
+                if r['event'] != 'step' or r['run_id'] != chain_run_id:
+                    continue
+                if r['status'] == 'succeeded':
+                    completed[r['key']] = r['hash']
+                elif r['status'] == 'failed':
+                    completed.pop(r['key'], None)
+        return completed
@@ -0,0 +1,165 @@
+"""Compressed content-addressed snapshots of deployed manifests."""
+import os
+import gzip
+import json
+import time
+import hashlib
+from pumpwood_deploy.manifests.hashing import document_hash, document_key
+
+
+def document_images(document: dict) -> list:
+    """Return the container images of a Deployment document."""
+    if document.get('kind') != 'Deployment':
+        return []
+    pod_spec = document.get('spec', {}).get('template', {}).get('spec', {})
+    containers = (pod_spec.get('initContainers') or []) + \
+        (pod_spec.get('containers') or [])
+    return [c['image'] for c in containers if c.get('image')]
+
+
+class SnapshotStore:
+    """
+    Store of the manifests of successful deploys.
+
+    Each manifest document is stored once, gzip compressed, on
+    `objects/<hash>.json.gz` where hash is its content hash, so documents
+    that do not change between deploys share the same object. A snapshot
+    lists the key and hash of every document of the stack and the images of
+    its Deployments, it is stored on `snapshots/<snapshot id>.json.gz` and
+    its id is the hash of its documents.
+    """
+
+    def __init__(self, path: str):
+        """
+        __init__.
+
+        Args:
+            path (str): Directory of the store.
+        """
+        self.path = path
+
+    def _write_gzip(self, path: str, data: dict):
+        dir_name = os.path.dirname(path)
+        if not os.path.exists(dir_name):
+            os.makedirs(dir_name, exist_ok=True)
+        temp_path = '%s.%s.tmp' % (path, os.getpid())
+        with gzip.open(temp_path, 'wt') as file:
+            json.dump(data, file, sort_keys=True)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def _read_gzip(path: str) -> dict:
+        with gzip.open(path, 'rt') as file:
+            return json.load(file)
+
+    def _object_path(self, hash_value: str) -> str:
+        return os.path.join(
+            self.path, 'objects', hash_value[:2], hash_value + '.json.gz')
+
+    def _snapshot_path(self, snapshot_id: str) -> str:
+        return os.path.join(self.path, 'snapshots', snapshot_id + '.json.gz')
+
+    def save(self, documents: list, metadata: dict = None) -> str:
+        """
+        Store a snapshot.
+
+        Args:
+            documents (list): Parsed manifest documents of the stack.
+        Kwargs:
+            metadata (dict): Extra information of the snapshot (namespace,
+                run id).
+        Returns:
+            str: Id of the snapshot.
+        """
+        resources = []
+        images = {}
+        for doc in documents:
+            hash_value = document_hash(doc)
+            key = document_key(doc)
+            object_path = self._object_path(hash_value)
+            if not os.path.isfile(object_path):
+                self._write_gzip(object_path, doc)
+            resources.append({'key': key, 'hash': hash_value})
+            doc_images = document_images(doc)
+            if doc_images:
+                images[key] = doc_images
+
+        snapshot_id = hashlib.sha256(','.join([
+            r['key'] + '=' + r['hash'] for r in resources
+        ]).encode()).hexdigest()[:16]
+        snapshot_path = self._snapshot_path(snapshot_id)
+        created_at = time.time()
+        if os.path.isfile(snapshot_path):
+            snapshot = self._read_gzip(snapshot_path)
+            snapshot['deployed_at'].append(created_at)
+        else:
+            snapshot = {
+                'id': snapshot_id, 'created_at': created_at,
+                'deployed_at': [created_at], 'metadata': metadata or {},
+                'resources': resources, 'images': images}
+        self._write_gzip(snapshot_path, snapshot)
+        return snapshot_id
+
+    def list(self) -> list:
+        """
+        List snapshots, oldest deploy first.
+
+        Returns:
+            list: Snapshots with `id`, `deployed_at` (last deploy time),
+                `metadata` and `images`.
+        """
+        snapshots_dir = os.path.join(self.path, 'snapshots')
+        if not os.path.isdir(snapshots_dir):
+            return []
+        snapshots = []
+        for file_name in os.listdir(snapshots_dir):
+            if not file_name.endswith('.json.gz'):
+                continue
+            snapshot = self._read_gzip(os.path.join(snapshots_dir, file_name))
+            snapshots.append({
+                'id': snapshot['id'],
+                'deployed_at': snapshot['deployed_at'][-1],
+                'metadata': snapshot['metadata'],
+                'images': snapshot['images']})
+        return sorted(snapshots, key=lambda s: s['deployed_at'])
+
+    def resolve(self, to=None) -> str:
+        """
+        Return the id of a snapshot.
+
+        Args:
+            to (str|int): Snapshot id or unique id prefix, or negative
+                index on the deploy history (-1 last deploy, -2 the one
+                before). None is the deploy before the last one.
+        Returns:
+            str: Snapshot id.
+        """
+        snapshots = self.list()
+        if to is None:
+            to = -2
+        if isinstance(to, int):
+            if len(snapshots) < -to:
+                raise Exception(
+                    'Only %s snapshots stored, can not go back %s' % (
+                        len(snapshots), -to))
+            return snapshots[to]['id']
+        matches = [s['id'] for s in snapshots if s['id'].startswith(to)]
+        if len(matches) != 1:
+            raise Exception(
+                'Snapshot [%s] not found or ambiguous: %s' % (to, matches))
+        return matches[0]
+
+    def load(self, snapshot_id: str) -> dict:
+        """
+        Load a snapshot with its documents.
+
+        Args:
+            snapshot_id (str): Snapshot id.
+        Returns:
+            dict: Snapshot with `resources` list of `key`, `hash` and
+                `document`.
+        """
+        snapshot = self._read_gzip(self._snapshot_path(snapshot_id))
+        for r in snapshot['resources']:
+            r['document'] = self._read_gzip(self._object_path(r['hash']))
+        return snapshot
@@ -0,0 +1,81 @@
+"""Local state of deployed resources used on incremental deploys."""
+import os
+import json
+import time
+
+
+class DeployState:
+    """
+    Content hashes of the resources deployed on a namespace.
+
+    State is kept on a JSON file mapping each resource key (Kind/name of its
+    documents) to the content hash of its last successful deploy.
+    """
+
+    def __init__(self, path: str, namespace: str):
+        """
+        __init__.
+
+        Args:
+            path (str): Path of the state JSON file.
+            namespace (str): Namespace of the deploy.
+        """
+        self.path = path
+        self.namespace = namespace
+        self.resources = {}
+        if os.path.isfile(path):
+            with open(path, 'r') as file:
+                data = json.load(file)
+            self.resources = data.get('resources', {})
+
+    def is_unchanged(self, cmd: dict) -> bool:
+        """
+        Check if a deploy command was already applied with same content.
+
+        Args:
+            cmd (dict): Deploy command with `key` and `hash`.
+        Returns:
+            bool: True if the last deployed hash is equal to command hash.
+        """
+        resource = self.resources.get(cmd['key'])
+        if resource is None:
+            return False
+        return resource['hash'] == cmd['hash']
+
+    def update(self, cmd: dict):
+        """
+        Register a successful deploy of a command.
+
+        Args:
+            cmd (dict): Deploy command with `key`, `hash` and `name`.
+        """
+        self.resources[cmd['key']] = {
+            'hash': cmd['hash'], 'name': cmd['name'],
+            'deployed_at': time.time()}
+
+    def invalidate(self, keys: list):
+        """
+        Forget the deploy of the commands that have any of the keys.
+
+        Used when resources are changed outside a deploy (rollback), so the
+        next incremental deploy applies them again.
+
+        Args:
+            keys (list): Kind/name of resources.
+        """
+        keys = set(keys)
+        for cmd_key in list(self.resources.keys()):
+            if keys & set(cmd_key.split(',')):
+                del self.resources[cmd_key]
+
+    def save(self):
+        """Write state to file."""
+        dir_name = os.path.dirname(self.path)
+        if dir_name and not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({
+                'namespace': self.namespace,
+                'resources': self.resources}, file, indent=2, sort_keys=True)
+        os.replace(temp_path, self.path)
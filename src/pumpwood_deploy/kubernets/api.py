@@ -0,0 +1,547 @@
+"""Kubernetes API server client using a pooled HTTPS session."""
+import os
+import copy
+import json
+import time
+import atexit
+import base64
+import shutil
+import tempfile
+import threading
+import datetime
+import subprocess
+import yaml
+import requests
+from requests.adapters import HTTPAdapter
+from pumpwood_deploy.manifests.model import load_documents
+
+
+RESOURCES = {
+    'Namespace': ('v1', 'namespaces', False),
+    'Secret': ('v1', 'secrets', True),
+    'ConfigMap': ('v1', 'configmaps', True),
+    'Service': ('v1', 'services', True),
+    'Endpoints': ('v1', 'endpoints', True),
+    'Pod': ('v1', 'pods', True),
+    'Event': ('v1', 'events', True),
+    'PersistentVolume': ('v1', 'persistentvolumes', False),
+    'PersistentVolumeClaim': ('v1', 'persistentvolumeclaims', True),
+    'Deployment': ('apps/v1', 'deployments', True),
+    'ReplicaSet': ('apps/v1', 'replicasets', True),
+}
+"""Kind: (default apiVersion, plural, is namespaced)."""
+
+KUBECTL_KINDS = dict(
+    [(kind.lower(), kind) for kind in RESOURCES.keys()] +
+    [(plural, kind) for kind, (_, plural, _) in RESOURCES.items()])
+"""Map kubectl resource types (secret, deployments, ...) to kinds."""
+
+
+class KubernetesAPIError(Exception):
+    """Error returned by Kubernetes API server."""
+
+    def __init__(self, status_code: int, message: str, body: dict = None,
+                 retry_after: float = None):
+        """
+        __init__.
+
+        Args:
+            status_code (int): HTTP status code.
+            message (str): Error message.
+        Kwargs:
+            body (dict): Status object returned by API server.
+            retry_after (float): Seconds to wait before retrying, from the
+                Retry-After header of throttled requests.
+        """
+        super(KubernetesAPIError, self).__init__(
+            '[%s] %s' % (status_code, message))
+        self.status_code = status_code
+        self.body = body or {}
+        self.retry_after = retry_after
+
+    @property
+    def reason(self):
+        """Reason of the Status object (NotFound, Conflict, ...)."""
+        return self.body.get('reason')
+
+
+def resource_path(kind: str, namespace: str = None, name: str = None,
+                  api_version: str = None) -> str:
+    """
+    Return the API path of a resource.
+
+    Args:
+        kind (str): Kind of the resource (Deployment) or kubectl resource
+            type (deployment, deployments).
+    Kwargs:
+        namespace (str): Namespace of namespaced resources.
+        name (str): Name of the resource, if None the collection path is
+            returned.
+        api_version (str): Api version, default for the kind if None.
+    Returns:
+        str: API path.
+    """
+    kind = KUBECTL_KINDS.get(kind, kind)
+    if kind not in RESOURCES:
+        raise Exception('Kind not implemented: %s' % (kind, ))
+    default_version, plural, namespaced = RESOURCES[kind]
+    api_version = api_version or default_version
+
+    if '/' in api_version:
+        path = '/apis/' + api_version
+    else:
+        path = '/api/' + api_version
+    if namespaced:
+        path = path + '/namespaces/' + namespace
+    path = path + '/' + plural
+    if name is not None:
+        path = path + '/' + name
+    return path
+
+
+class KubernetesAPIClient:
+    """
+    Client for the Kubernetes API server.
+
+    All requests share one `requests.Session` with a connection pool, so TLS
+    handshakes and kubeconfig parsing are done once for the whole deploy.
+    Resources are applied with server-side apply.
+    """
+
+    def __init__(self, server: str, token: str = None, verify=True,
+                 cert: tuple = None, namespace: str = "default",
+                 field_manager: str = 'pumpwood-deploy',
+                 pool_maxsize: int = 20, timeout: float = 30,
+                 token_function=None):
+        """
+        __init__.
+
+        Args:
+            server (str): API server url (https://host:port).
+        Kwargs:
+            token (str): Bearer token.
+            verify (bool|str): Verify TLS certificates, or path to the CA
+                bundle.
+            cert (tuple): Client certificate and key paths.
+            namespace (str): Namespace of the resources.
+            field_manager (str): Field manager used on server-side apply.
+            pool_maxsize (int): Maximum number of pooled connections.
+            timeout (float): Request timeout in seconds.
+            token_function (callable): Function returning a token and its
+                expiration timestamp, used to refresh the token (exec
+                credential plugins).
+        """
+        self.server = server.rstrip('/')
+        self.namespace = namespace
+        self.field_manager = field_manager
+        self.timeout = timeout
+        self._token = token
+        self._token_expiry = None
+        self._token_function = token_function
+        self._token_lock = threading.Lock()
+        self._data_dir = None
+
+        self.session = requests.Session()
+        self.session.verify = verify
+        if cert is not None:
+            self.session.cert = cert
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def for_namespace(self, namespace: str):
+        """
+        Return a client of the same server on another namespace.
+
+        The new client shares the session (and its pooled connections) of
+        this one, which is not changed.
+
+        Args:
+            namespace (str): Namespace of the resources.
+        Returns:
+            KubernetesAPIClient: Client on `namespace`.
+        """
+        client = copy.copy(self)
+        client.namespace = namespace
+        return client
+
+    @classmethod
+    def from_kubeconfig(cls, path: str = None, context: str = None,
+                        namespace: str = None, **kwargs):
+        """
+        Create a client from a kubeconfig file.
+
+        Supports token, client certificate, gcp auth-provider and exec
+        credential plugins (gke-gcloud-auth-plugin). Embedded certificates
+        and keys are written, readable only by the user, to a private temp
+        directory that is removed on `close` or at exit.
+
+        Kwargs:
+            path (str): Path to kubeconfig, default KUBECONFIG environment
+                variable or ~/.kube/config.
+            context (str): Context to be used, default current-context.
+            namespace (str): Namespace, default the context namespace.
+            **kwargs: Other KubernetesAPIClient arguments.
+        Returns:
+            KubernetesAPIClient: New client.
+        """
+        if path is None:
+            path = os.environ.get(
+                'KUBECONFIG', os.path.expanduser('~/.kube/config'))
+            path = path.split(os.pathsep)[0]
+        with open(path, 'r') as file:
+            config = yaml.safe_load(file)
+
+        context_name = context or config.get('current-context')
+        context_dict = _get_named(config, 'contexts', context_name)
+        cluster = _get_named(config, 'clusters', context_dict['cluster'])
+        user = _get_named(config, 'users', context_dict['user'])
+
+        data_dir = None
+        if 'certificate-authority-data' in cluster or \
+                'client-certificate-data' in user:
+            data_dir = tempfile.mkdtemp(prefix='pumpwood-kubeconfig-')
+            atexit.register(shutil.rmtree, data_dir, True)
+
+        verify = True
+        if cluster.get('insecure-skip-tls-verify'):
+            verify = False
+        elif 'certificate-authority-data' in cluster:
+            verify = _data_file(
+                data_dir, 'ca.pem', cluster['certificate-authority-data'])
+        elif 'certificate-authority' in cluster:
+            verify = cluster['certificate-authority']
+
+        cert = None
+        if 'client-certificate-data' in user:
+            cert = (
+                _data_file(data_dir, 'client.pem',
+                           user['client-certificate-data']),
+                _data_file(data_dir, 'client-key.pem',
+                           user['client-key-data']))
+        elif 'client-certificate' in user:
+            cert = (user['client-certificate'], user['client-key'])
+
+        token = user.get('token')
+        token_function = None
+        if 'exec' in user:
+            token_function = _exec_token_function(user['exec'])
+        elif 'auth-provider' in user:
+            token = user['auth-provider'].get(
+                'config', {}).get('access-token')
+
+        namespace = namespace or context_dict.get('namespace', 'default')
+        client = cls(
+            server=cluster['server'], token=token, verify=verify, cert=cert,
+            namespace=namespace, token_function=token_function, **kwargs)
+        client._data_dir = data_dir
+        return client
+
+    def _headers(self):
+        if self._token_function is not None:
+            # Deploy threads share the client, only one of them runs the
+            # credential plugin when the token expires
+            with self._token_lock:
+                expired = (
+                    self._token_expiry is not None and
+                    self._token_expiry < time.time() + 60)
+                if self._token is None or expired:
+                    self._token, self._token_expiry = \
+                        self._token_function()
+        if self._token is None:
+            return {}
+        return {'Authorization': 'Bearer ' + self._token}
+
+    def request(self, method: str, path: str, params: dict = None,
+                data=None, content_type: str = None, stream: bool = False,
+                timeout: float = None):
+        """
+        Make a request to the API server.
+
+        Args:
+            method (str): HTTP method.
+            path (str): API path.
+        Kwargs:
+            params (dict): Query parameters.
+            data: Request body, dicts are serialized as JSON.
+            content_type (str): Body content type.
+            stream (bool): Return the response without reading the body.
+            timeout (float): Request timeout, default client timeout.
+        Returns:
+            dict|requests.Response: Response body, or the response if stream.
+        Raises:
+            KubernetesAPIError: If the response status is not 2xx.
+        """
+        headers = self._headers()
+        if isinstance(data, dict):
+            data = json.dumps(data)
+            content_type = content_type or 'application/json'
+        if content_type is not None:
+            headers['Content-Type'] = content_type
+
+        response = self.session.request(
+            method, self.server + path, params=params, data=data,
+            headers=headers, stream=stream,
+            timeout=timeout or self.timeout)
+        if response.status_code >= 300:
+            try:
+                body = response.json()
+            except ValueError:
+                body = {'message': response.text}
+            retry_after = response.headers.get('Retry-After')
+            try:
+                retry_after = float(retry_after)
+            except (TypeError, ValueError):
+                retry_after = None
+            raise KubernetesAPIError(
+                status_code=response.status_code,
+                message=body.get('message', response.reason), body=body,
+                retry_after=retry_after)
+        if stream:
+            return response
+        if len(response.content) == 0:
+            return {}
+        return response.json()
+
+    def apply(self, manifest: dict, dry_run: bool = False,
+              force_conflicts: bool = False) -> dict:
+        """
+        Create or patch a resource with server-side apply.
+
+        Args:
+            manifest (dict): Resource manifest.
+        Kwargs:
+            dry_run (bool): Server-side dry-run, nothing is persisted.
+            force_conflicts (bool): Take ownership of conflicting fields.
+        Returns:
+            dict: Resource returned by the API server.
+        """
+        path = resource_path(
+            kind=manifest['kind'], namespace=self.namespace,
+            name=manifest['metadata']['name'],
+            api_version=manifest.get('apiVersion'))
+        params = {'fieldManager': self.field_manager}
+        if force_conflicts:
+            params['force'] = 'true'
+        if dry_run:
+            params['dryRun'] = 'All'
+        return self.request(
+            'PATCH', path, params=params, data=json.dumps(manifest),
+            content_type='application/apply-patch+yaml')
+
+    def apply_manifest(self, content: str, dry_run: bool = False,
+                       force_conflicts: bool = False) -> list:
+        """
+        Apply all documents of a YAML manifest.
+
+        Args:
+            content (str): YAML manifest, may have more than one document.
+        Kwargs:
+            dry_run (bool): Server-side dry-run.
+            force_conflicts (bool): Take ownership of conflicting fields.
+        Returns:
+            list: Resources returned by the API server.
+        """
+        return [
+            self.apply(doc, dry_run=dry_run, force_conflicts=force_conflicts)
+            for doc in load_documents(content)]
+
+    def get(self, kind: str, name: str, api_version: str = None):
+        """
+        Get a resource.
+
+        Args:
+            kind (str): Kind or kubectl resource type.
+            name (str): Name of the resource.
+        Kwargs:
+            api_version (str): Api version, default for the kind if None.
+        Returns:
+            dict: The resource, None if it does not exist.
+        """
+        path = resource_path(
+            kind=kind, namespace=self.namespace, name=name,
+            api_version=api_version)
+        try:
+            return self.request('GET', path)
+        except KubernetesAPIError as e:
+            if e.status_code == 404:
+                return None
+            raise
+
+    def get_resource(self, kind: str, name: str):
+        """Get a resource, same interface as Kubernets.get_resource."""
+        return self.get(kind=kind, name=name)
+
+    def list(self, kind: str, label_selector: str = None,
+             api_version: str = None) -> list:
+        """
+        List resources of a kind.
+
+        Args:
+            kind (str): Kind or kubectl resource type.
+        Kwargs:
+            label_selector (str): Label selector (key=value,key2=value2).
+            api_version (str): Api version, default for the kind if None.
+        Returns:
+            list: Resources.
+        """
+        path = resource_path(
+            kind=kind, namespace=self.namespace, api_version=api_version)
+        params = {}
+        if label_selector is not None:
+            params['labelSelector'] = label_selector
+        return self.request('GET', path, params=params).get('items') or []
+
+    def delete(self, kind: str, name: str, api_version: str = None,
+               dry_run: bool = False) -> bool:
+        """
+        Delete a resource.
+
+        Args:
+            kind (str): Kind or kubectl resource type.
+            name (str): Name of the resource.
+        Kwargs:
+            api_version (str): Api version, default for the kind if None.
+            dry_run (bool): Server-side dry-run.
+        Returns:
+            bool: False if the resource did not exist.
+        """
+        path = resource_path(
+            kind=kind, namespace=self.namespace, name=name,
+            api_version=api_version)
+        params = {'propagationPolicy': 'Background'}
+        if dry_run:
+            params['dryRun'] = 'All'
+        try:
+            self.request('DELETE', path, params=params)
+        except KubernetesAPIError as e:
+            if e.status_code == 404:
+                return False
+            raise
+        return True
+
+    def watch(self, kind: str, label_selector: str = None,
+              resource_version: str = None, timeout_seconds: int = None):
+        """
+        Watch changes on resources of a kind.
+
+        Args:
+            kind (str): Kind or kubectl resource type.
+        Kwargs:
+            label_selector (str): Label selector.
+            resource_version (str): Start watching after this version.
+            timeout_seconds (int): Server side watch timeout.
+        Yields:
+            dict: Watch events with `type` (ADDED, MODIFIED, DELETED) and
+                `object`.
+        """
+        path = resource_path(kind=kind, namespace=self.namespace)
+        params = {'watch': 'true'}
+        if label_selector is not None:
+            params['labelSelector'] = label_selector
+        if resource_version is not None:
+            params['resourceVersion'] = resource_version
+        if timeout_seconds is not None:
+            params['timeoutSeconds'] = timeout_seconds
+
+        read_timeout = None
+        if timeout_seconds is not None:
+            read_timeout = timeout_seconds + self.timeout
+        response = self.request(
+            'GET', path, params=params, stream=True,
+            timeout=(self.timeout, read_timeout))
+        with response:
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def proxy_get(self, kind: str, name: str, path: str,
+                  port=None, timeout: float = None) -> tuple:
+        """
+        Make a GET request proxied by the API server to a pod or service.
+
+        Args:
+            kind (str): pods or services.
+            name (str): Name of the pod or service.
+            path (str): Path of the request on the pod or service.
+        Kwargs:
+            port (int|str): Port of the pod or service.
+            timeout (float): Request timeout, default client timeout.
+        Returns:
+            tuple: Status code and body text of the response.
+        """
+        target = name if port is None else '%s:%s' % (name, port)
+        path = '%s/%s/proxy/%s' % (
+            resource_path(kind=kind, namespace=self.namespace), target,
+            path.lstrip('/'))
+        response = self.session.get(
+            self.server + path, headers=self._headers(),
+            timeout=timeout or self.timeout)
+        return response.status_code, response.text
+
+    def ensure_namespace(self, namespace: str = None) -> bool:
+        """
+        Create the namespace if it does not exist.
+
+        Kwargs:
+            namespace (str): Namespace, default client namespace.
+        Returns:
+            bool: True if the namespace was created.
+        """
+        namespace = namespace or self.namespace
+        try:
+            self.request(
+                'POST', resource_path('Namespace'),
+                data={'apiVersion': 'v1', 'kind': 'Namespace',
+                      'metadata': {'name': namespace}})
+        except KubernetesAPIError as e:
+            if e.status_code == 409:
+                return False
+            raise
+        return True
+
+    def close(self):
+        """Close pooled connections and remove kubeconfig data files."""
+        self.session.close()
+        if self._data_dir is not None:
+            shutil.rmtree(self._data_dir, ignore_errors=True)
+            self._data_dir = None
+
+
+def _get_named(config: dict, key: str, name: str) -> dict:
+    for item in config.get(key) or []:
+        if item['name'] == name:
+            return item[key[:-1]]
+    raise Exception('[%s] not found in kubeconfig %s' % (name, key))
+
+
+def _data_file(directory: str, name: str, data: str) -> str:
+    """Write base64 kubeconfig data to a user only file, return its path."""
+    path = os.path.join(directory, name)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as file:
+        file.write(base64.b64decode(data))
+    return path
+
+
+def _exec_token_function(exec_config: dict):
+    """Return a function that runs a kubeconfig exec credential plugin."""
+    def token_function():
+        env = dict(os.environ)
+        for e in exec_config.get('env') or []:
+            env[e['name']] = e['value']
+        cmd = [exec_config['command']] + list(exec_config.get('args') or [])
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, env=env)
+        output, error = process.communicate()
+        if process.returncode != 0:
+            raise Exception('Credential plugin failed: %s' % (cmd, ))
+        status = json.loads(output)['status']
+
+        expiry = None
+        if status.get('expirationTimestamp'):
+            expiry = datetime.datetime.strptime(
+                status['expirationTimestamp'], '%Y-%m-%dT%H:%M:%SZ')\
+                .replace(tzinfo=datetime.timezone.utc).timestamp()
+        return status['token'], expiry
+    return token_function
@@ -0,0 +1,280 @@
+"""Asyncio deploy runner with bounded concurrency and retries."""
+import time
+import random
+import asyncio
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from pumpwood_deploy.kubernets.api import KubernetesAPIError
+from pumpwood_deploy.kubernets.executor import DeployGraph
+from pumpwood_deploy.kubernets.kubernets import script_command
+from pumpwood_deploy.kubernets.wait import async_wait_for_conditions
+
+
+TRANSIENT_STATUS_CODES = [429, 502, 503, 504]
+"""API server status codes that are always retried."""
+
+TRANSIENT_MESSAGES = [
+    'too many requests', 'toomanyrequests', 'etcdserver: request timed out',
+    'etcdserver: leader changed', 'etcdserver: too many requests',
+    'connection reset by peer', 'connection refused',
+    'tls handshake timeout', 'i/o timeout',
+    'the server is currently unable to handle the request',
+    'serviceunavailable', 'http2: client connection lost']
+"""Error messages (lower case) of throttling and transient failures, also
+matched on kubectl stderr."""
+
+
+class TransientError(Exception):
+    """Deploy command failed with an error that may succeed on retry."""
+
+    def __init__(self, message: str, retry_after: float = None):
+        """
+        __init__.
+
+        Args:
+            message (str): Error message.
+        Kwargs:
+            retry_after (float): Seconds asked by the server to wait.
+        """
+        super(TransientError, self).__init__(message)
+        self.retry_after = retry_after
+
+
+def is_transient(error) -> bool:
+    """
+    Check if an error is API server throttling or a transient failure.
+
+    Args:
+        error (Exception|str): Exception raised applying a resource or
+            kubectl stderr.
+    Returns:
+        bool: True if the command should be retried.
+    """
+    if isinstance(error, TransientError):
+        return True
+    if isinstance(error, KubernetesAPIError):
+        if error.status_code in TRANSIENT_STATUS_CODES:
+            return True
+    elif isinstance(error, (requests.ConnectionError, requests.Timeout,
+                            ConnectionResetError)):
+        return True
+    message = str(error).lower()
+    return any([m in message for m in TRANSIENT_MESSAGES])
+
+
+def backoff_delay(attempt: int, base_delay: float = 0.5,
+                  max_delay: float = 30, retry_after: float = None):
+    """
+    Return a jittered exponential backoff delay.
+
+    Uses full jitter, a random time between zero and
+    `base_delay * 2 ** attempt` capped at `max_delay`, so workers throttled
+    at the same time do not retry together. The Retry-After asked by the
+    server is the minimum delay.
+
+    Args:
+        attempt (int): Number of the retry, starting at 0.
+    Kwargs:
+        base_delay (float): Delay of the first retry.
+        max_delay (float): Maximum delay.
+        retry_after (float): Retry-After returned by the server.
+    Returns:
+        float: Seconds to wait before retrying.
+    """
+    delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, max_delay))
+    return delay
+
+
+class AsyncDeployRunner:
+    """
+    Run deploy commands concurrently on an asyncio event loop.
+
+    Alternative to Kubernets.run_deploy_commmands. Commands are dispatched
+    following the deploy graph dependencies (secrets and volumes, postgres,
+    then apps and workers) and at most `max_concurrency` apply operations
+    run at the same time. Throttled (429) and transient failures (etcd
+    timeouts, connection resets) are retried with jittered exponential
+    backoff. Waiting for readiness or the `sleep` time does not hold a
+    concurrency slot nor a thread: readiness is polled on the event loop
+    and the status reads run on their own thread pool, so pending rollouts
+    never delay applies.
+    """
+
+    def __init__(self, kube_client, max_concurrency: int = 10,
+                 max_retries: int = 5, base_delay: float = 0.5,
+                 max_delay: float = 30, wait_ready: bool = False,
+                 timeout: float = 600):
+        """
+        __init__.
+
+        Args:
+            kube_client (Kubernets): Kubernets client, if it has an
+                `api_client` manifests are applied on the API server, if not
+                the deploy scripts are run as subprocesses.
+        Kwargs:
+            max_concurrency (int): Maximum number of apply operations at the
+                same time.
+            max_retries (int): Maximum number of retries of transient errors
+                for each command.
+            base_delay (float): Backoff delay of the first retry.
+            max_delay (float): Maximum backoff delay.
+            wait_ready (bool): Wait readiness conditions of the commands
+                instead of sleeping.
+            timeout (float): Timeout for the readiness conditions.
+        """
+        if max_concurrency < 1:
+            raise Exception('max_concurrency must be greater than 0')
+        self.kube_client = kube_client
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.wait_ready = wait_ready
+        self.timeout = timeout
+
+    async def _apply(self, cmd: dict, loop, pool):
+        api_client = self.kube_client.api_client
+        if cmd['command'] != 'run':
+            raise Exception('Command not implemented: %s' % (
+                cmd['command'],))
+        if api_client is not None and cmd.get('content') is not None:
+            await loop.run_in_executor(pool, lambda: api_client.apply_manifest(
+                cmd['content'],
+                force_conflicts=cmd.get('force_conflicts', True)))
+            return
+
+        process = await asyncio.create_subprocess_exec(
+            *script_command(cmd['file']), stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE, env=self.kube_client.env)
+        output, error = await process.communicate()
+        if output:
+            print(output.decode(errors='replace').rstrip())
+        if process.returncode != 0:
+            error = error.decode(errors='replace').strip()
+            message = 'Return code %s: %s' % (process.returncode, error)
+            if is_transient(error):
+                raise TransientError(message)
+            raise Exception(message)
+
+    async def _run_command(self, cmd: dict, semaphore, loop, pool,
+                           wait_pool):
+        result = {
+            'key': cmd.get('key'), 'name': cmd.get('name'),
+            'file': cmd['file'], 'type': cmd.get('type'),
+            'status': None, 'unchanged': False, 'attempts': 0,
+            'retries': [], 'duration': None, 'error': None}
+        start = time.time()
+        try:
+            if cmd.get('skip_unchanged') and cmd.get('content') is not None:
+                unchanged = await loop.run_in_executor(
+                    pool, self.kube_client.is_unchanged_on_cluster,
+                    cmd['content'])
+                if unchanged:
+                    result['status'] = 'succeeded'
+                    result['unchanged'] = True
+                    result['duration'] = time.time() - start
+                    return result
+
+            while True:
+                result['attempts'] = result['attempts'] + 1
+                try:
+                    async with semaphore:
+                        await self._apply(cmd, loop, pool)
+                    break
+                except Exception as e:
+                    retry = len(result['retries'])
+                    if not is_transient(e) or self.max_retries <= retry:
+                        raise
+                    delay = backoff_delay(
+                        retry, base_delay=self.base_delay,
+                        max_delay=self.max_delay,
+                        retry_after=getattr(e, 'retry_after', None))
+                    print('!!!Transient error on %s, retrying in %.1fs: %s' % (
+                        cmd['file'], delay, e))
+                    result['retries'].append({'delay': delay, 'error': str(e)})
+                    await asyncio.sleep(delay)
+
+            if self.wait_ready:
+                await async_wait_for_conditions(
+                    cmd.get('wait') or [], self.kube_client.get_resource,
+                    executor=wait_pool, timeout=self.timeout)
+            else:
+                sleep_time = cmd.get('sleep', 10)
+                if sleep_time is None:
+                    sleep_time = 10
+                await asyncio.sleep(sleep_time)
+            result['status'] = 'succeeded'
+        except Exception as e:
+            result['status'] = 'failed'
+            result['error'] = str(e)
+        result['duration'] = time.time() - start
+        return result
+
+    async def _run_node(self, node, futures, semaphore, loop, pool,
+                        wait_pool):
+        for d in node.dependencies:
+            dependency = await futures[d]
+            if dependency['status'] != 'succeeded':
+                result = {
+                    'key': node.cmd.get('key'), 'name': node.cmd.get('name'),
+                    'file': node.cmd['file'], 'type': node.cmd.get('type'),
+                    'status': 'skipped', 'unchanged': False, 'attempts': 0,
+                    'retries': [], 'duration': 0.0,
+                    'error': 'Dependency failed: %s' % (d, )}
+                futures[node.key].set_result(result)
+                return result
+        result = await self._run_command(
+            node.cmd, semaphore, loop, pool, wait_pool)
+        futures[node.key].set_result(result)
+        return result
+
+    async def run(self, cmds: list):
+        """
+        Run deploy commands, yielding the result of each one as it finishes.
+
+        Args:
+            cmds (list): Deploy commands created by DeployPumpWood.
+        Yields:
+            dict: Result of each command with `key`, `name`, `file`, `type`,
+                `status` (succeeded, failed or skipped if a dependency
+                failed), `unchanged` (content already on cluster),
+                `attempts`, `retries` (delay and error of each
+                retry), `duration` and `error`.
+        """
+        graph = DeployGraph.from_deploy_commands(cmds)
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        futures = dict([
+            (key, loop.create_future()) for key in graph.nodes.keys()])
+        # Blocking applies run on the pool, at most max_concurrency at the
+        # same time. Readiness reads use their own pool, so waits never
+        # take the threads of the applies.
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as pool, \
+                ThreadPoolExecutor(
+                    max_workers=self.max_concurrency) as wait_pool:
+            await loop.run_in_executor(pool, self.kube_client.ensure_context)
+            tasks = [
+                loop.create_task(self._run_node(
+                    node, futures, semaphore, loop, pool, wait_pool))
+                for node in graph.nodes.values()]
+            for task in asyncio.as_completed(tasks):
+                result = await task
+                print('###%s: %s [%.1fs, %s attempts]' % (
+                    result['status'].capitalize(), result['file'],
+                    result['duration'], result['attempts']))
+                yield result
+
+    def run_sync(self, cmds: list) -> list:
+        """
+        Run deploy commands from synchronous code.
+
+        Args:
+            cmds (list): Deploy commands created by DeployPumpWood.
+        Returns:
+            list: Results of the commands in completion order.
+        """
+        async def collect():
+            return [r async for r in self.run(cmds)]
+        return asyncio.run(collect())
@@ -0,0 +1,187 @@
+"""Cache of cluster credentials and context setup."""
+import os
+import json
+import time
+import datetime
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.expanduser('~'), '.cache', 'pumpwood_deploy', 'kube_context.json')
+"""Default path of the context cache, overridden by PUMPWOOD_DEPLOY_CACHE
+environment variable."""
+
+_cache_lock = threading.Lock()
+"""Lock of the cache files shared by all ContextCache of the process."""
+
+
+def gke_context_name(cluster_name: str, zone: str, project: str) -> str:
+    """Return the kubeconfig context name created by gcloud for a cluster."""
+    return 'gke_{project}_{zone}_{cluster_name}'.format(
+        project=project, zone=zone, cluster_name=cluster_name)
+
+
+def parse_timestamp(timestamp: str) -> float:
+    """
+    Parse a Kubernetes RFC 3339 UTC timestamp.
+
+    Args:
+        timestamp (str): RFC 3339 timestamp (2021-01-01T10:00:00Z), with or
+            without fraction of seconds.
+    Returns:
+        float: Unix timestamp, None if timestamp can not be parsed.
+    """
+    if not timestamp:
+        return None
+    timestamp = timestamp.rstrip('Z').split('.')[0].split('+')[0]
+    try:
+        parsed = datetime.datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%S')
+    except ValueError:
+        return None
+    return (parsed - datetime.datetime(1970, 1, 1)).total_seconds()
+
+
+def parse_expiry(expiry: str) -> float:
+    """
+    Parse the token expiry of a kubeconfig auth-provider.
+
+    Args:
+        expiry (str): RFC 3339 timestamp, see parse_timestamp.
+    Returns:
+        float: Unix timestamp, None if expiry can not be parsed.
+    """
+    return parse_timestamp(expiry)
+
+
+def kubeconfig_context(config: dict) -> dict:
+    """
+    Return the current context of a kubeconfig.
+
+    Args:
+        config (dict): Kubeconfig, as returned by
+            `kubectl config view --minify -o json`.
+    Returns:
+        dict: `context` name, `namespace` and `token_expiry` (unix
+            timestamp, None if the token does not expire or is refreshed by
+            an exec credential plugin).
+    """
+    context_name = config.get('current-context')
+    namespace = None
+    for c in config.get('contexts') or []:
+        if c.get('name') == context_name:
+            namespace = (c.get('context') or {}).get('namespace')
+
+    token_expiry = None
+    for u in config.get('users') or []:
+        auth_provider = (u.get('user') or {}).get('auth-provider')
+        if auth_provider is not None:
+            token_expiry = parse_expiry(
+                (auth_provider.get('config') or {}).get('expiry'))
+    return {
+        'context': context_name, 'namespace': namespace or 'default',
+        'token_expiry': token_expiry}
+
+
+class ContextCache:
+    """
+    Cache of the cluster logins and namespaces already set up.
+
+    Entries are kept on a JSON file shared by every script or notebook of
+    the user and expire after `ttl` seconds. Changes are read-modify-write
+    of the file under a process lock and a file lock, so caches of many
+    threads and processes do not lose each other entries.
+    """
+
+    def __init__(self, path: str = None, ttl: float = 3600):
+        """
+        __init__.
+
+        Kwargs:
+            path (str): Path of the cache file, default
+                PUMPWOOD_DEPLOY_CACHE environment variable or
+                ~/.cache/pumpwood_deploy/kube_context.json.
+            ttl (float): Time in seconds an entry is valid.
+        """
+        self.path = path or os.environ.get(
+            'PUMPWOOD_DEPLOY_CACHE', DEFAULT_CACHE_PATH)
+        self.ttl = ttl
+
+    @contextmanager
+    def _locked(self):
+        dir_name = os.path.dirname(self.path)
+        if dir_name and not os.path.exists(dir_name):
+            os.makedirs(dir_name, exist_ok=True)
+        with _cache_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.path + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self) -> dict:
+        if not os.path.isfile(self.path):
+            return {}
+        try:
+            with open(self.path, 'r') as file:
+                return json.load(file)
+        except ValueError:
+            return {}
+
+    def _write(self, data: dict):
+        with tempfile.NamedTemporaryFile(
+                'w', dir=os.path.dirname(self.path) or '.',
+                prefix=os.path.basename(self.path) + '.', suffix='.tmp',
+                delete=False) as file:
+            json.dump(data, file, indent=2, sort_keys=True)
+        os.replace(file.name, self.path)
+
+    def get(self, key: str) -> dict:
+        """
+        Return a cache entry if it was not expired.
+
+        Args:
+            key (str): Entry key.
+        Returns:
+            dict: Cached entry, None if missing or expired.
+        """
+        with _cache_lock:
+            entry = self._read().get(key)
+        if entry is None:
+            return None
+        if self.ttl < time.time() - entry.get('checked_at', 0):
+            return None
+        return entry
+
+    def set(self, key: str, entry: dict):
+        """
+        Store a cache entry.
+
+        Args:
+            key (str): Entry key.
+            entry (dict): JSON serializable entry, `checked_at` is set to
+                current time.
+        """
+        entry = dict(entry)
+        entry['checked_at'] = time.time()
+        with self._locked():
+            data = self._read()
+            data[key] = entry
+            self._write(data)
+
+    def invalidate(self, key: str):
+        """Remove an entry from the cache."""
+        with self._locked():
+            data = self._read()
+            if data.pop(key, None) is not None:
+                self._write(data)
@@ -0,0 +1,427 @@
+"""Namespace-wide watch of Pods and Events correlated to deploy steps."""
+import time
+import threading
+from pumpwood_deploy.kubernets.credentials import parse_timestamp
+from pumpwood_deploy.manifests.model import load_documents
+
+
+POD_PHASES = ['scheduled', 'pulled', 'started', 'ready']
+"""Phases timed for each pod, in seconds since the pod was created."""
+
+IMAGE_PULL_REASONS = [
+    'ErrImagePull', 'ImagePullBackOff', 'InvalidImageName',
+    'ErrImageNeverPull']
+CRASHLOOP_REASONS = ['CrashLoopBackOff', 'RunContainerError']
+VOLUME_EVENT_REASONS = [
+    'FailedAttachVolume', 'FailedMount', 'FailedBinding',
+    'ProvisioningFailed']
+
+
+def event_stall_reason(reason: str, message: str) -> str:
+    """
+    Classify an Event as a cause of a stalled deploy.
+
+    Args:
+        reason (str): Reason of the Event (FailedMount, BackOff).
+        message (str): Message of the Event.
+    Returns:
+        str: `image pull`, `volume attach`, `crashloop` or `scheduling`,
+            None if the Event does not explain a stall.
+    """
+    message = (message or '').lower()
+    if reason in VOLUME_EVENT_REASONS:
+        return 'volume attach'
+    if reason == 'FailedScheduling':
+        return 'scheduling'
+    if reason in IMAGE_PULL_REASONS or (
+            reason in ['Failed', 'BackOff'] and 'pull' in message and
+            'image' in message):
+        return 'image pull'
+    if reason == 'BackOff' and 'restarting' in message:
+        return 'crashloop'
+    return None
+
+
+def container_stall_reason(reason: str) -> str:
+    """Classify the waiting reason of a container, see event_stall_reason."""
+    if reason in IMAGE_PULL_REASONS:
+        return 'image pull'
+    if reason in CRASHLOOP_REASONS:
+        return 'crashloop'
+    return None
+
+
+class EventMonitor:
+    """
+    Watch Pods and Events of the namespace during a deploy.
+
+    One watch is opened for Pods and one for Events of the whole namespace,
+    each on a background thread. Pods are correlated to the step being
+    deployed by the selectors of its Deployments, Events by the object they
+    involve. For each new pod the time it took to be scheduled, to pull its
+    images, to start its containers and to be ready is recorded.
+
+    Image pull errors, volume attach and mount failures and crash-looping
+    containers are reported as soon as they are seen. Pods that are not
+    ready after `stall_after` seconds are reported as stalled with the
+    phase they are stuck on.
+    """
+
+    def __init__(self, kube_client, stall_after: float = 30,
+                 watch_timeout: int = 10, emit=None):
+        """
+        __init__.
+
+        Args:
+            kube_client (Kubernets): Kubernets client.
+        Kwargs:
+            stall_after (float): Seconds a pod may take to be ready before
+                it is reported as stalled.
+            watch_timeout (int): Duration of each watch request, watches are
+                renewed until the monitor is stopped.
+            emit (callable): Function receiving a dict for each pod that is
+                ready (`type` pod) and each stall (`type` stall), default
+                prints them.
+        """
+        self.kube_client = kube_client
+        self.stall_after = stall_after
+        self.watch_timeout = watch_timeout
+        self.emit_function = emit
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._steps = {}
+        self._pods = {}
+        self._stalls = []
+        self.start_time = None
+
+    ###############
+    # Step tracking
+    def track(self, cmd: dict):
+        """
+        Correlate pods and events to a deploy step.
+
+        Args:
+            cmd (dict): Deploy command starting to run.
+        """
+        deployments = []
+        claims = []
+        for doc in load_documents(cmd.get('content') or ''):
+            name = doc.get('metadata', {}).get('name')
+            if doc.get('kind') == 'Deployment':
+                match_labels = doc.get('spec', {}).get(
+                    'selector', {}).get('matchLabels') or {}
+                if match_labels:
+                    deployments.append((name, match_labels))
+            elif doc.get('kind') == 'PersistentVolumeClaim':
+                claims.append(name)
+        with self._lock:
+            self._steps[cmd['file']] = {
+                'deployments': deployments, 'claims': claims,
+                'active': True}
+
+    def untrack(self, cmd: dict):
+        """Stop reporting stalls of a deploy step that finished."""
+        with self._lock:
+            step = self._steps.get(cmd['file'])
+            if step is not None:
+                step['active'] = False
+
+    def _owner(self, labels: dict):
+        for step_key, step in self._steps.items():
+            for name, match_labels in step['deployments']:
+                if all([labels.get(k) == v for k, v in match_labels.items()]):
+                    return step_key, 'Deployment/' + name
+        return None, None
+
+    ##########
+    # Emitting
+    def _emit(self, message: dict):
+        if self.emit_function is not None:
+            self.emit_function(message)
+        elif message['type'] == 'pod':
+            print('#####Pod %s (%s): %s' % (
+                message['pod'], message['resource'], ', '.join([
+                    '%s %.1fs' % (p, message['timings'][p])
+                    for p in POD_PHASES if p in message['timings']])))
+        else:
+            print('!!!%s %s (%s) [%.0fs]: %s - %s' % (
+                'Stalled' if message['stalled'] else 'Failing',
+                message['pod'], message['resource'], message['elapsed'],
+                message['category'], message['detail']))
+
+    def _report_stall(self, record: dict, category: str, detail: str,
+                      stalled: bool):
+        if record['reported'] == (category, stalled):
+            return
+        record['reported'] = (category, stalled)
+        message = {
+            'type': 'stall', 'step': record['step'],
+            'resource': record['resource'], 'pod': record['pod'],
+            'category': category, 'detail': detail, 'stalled': stalled,
+            'elapsed': time.time() - record['created']}
+        self._stalls.append(message)
+        self._emit(message)
+
+    #################
+    # Pod bookkeeping
+    def _pod_record(self, name: str) -> dict:
+        record = self._pods.get(name)
+        if record is None:
+            record = {
+                'pod': name, 'step': None, 'resource': None,
+                'created': time.time(), 'timings': {}, 'pulling': None,
+                'reason': None, 'unschedulable': None, 'volumes': False,
+                'restarts': 0, 'reported': None, 'deleted': False,
+                'ignored': False, 'claim': False}
+            self._pods[name] = record
+        return record
+
+    def _mark(self, record: dict, phase_name: str):
+        now = time.time() - record['created']
+        index = POD_PHASES.index(phase_name)
+        for previous in POD_PHASES[:index + 1]:
+            if previous not in record['timings']:
+                record['timings'][previous] = now
+        if phase_name == 'ready' and record['step'] is not None and \
+                not record['deleted']:
+            self._emit({
+                'type': 'pod', 'step': record['step'],
+                'resource': record['resource'], 'pod': record['pod'],
+                'timings': dict(record['timings'])})
+
+    def _on_pod(self, event: dict):
+        pod = event['object']
+        metadata = pod.get('metadata', {})
+        with self._lock:
+            record = self._pod_record(metadata['name'])
+            if event['type'] == 'DELETED':
+                record['deleted'] = True
+                return
+            if record['ignored']:
+                return
+            if record['step'] is None:
+                created = parse_timestamp(metadata.get('creationTimestamp'))
+                if created is not None and created < self.start_time - 2:
+                    # Pods of previous deploys are not timed
+                    record['ignored'] = True
+                    return
+                record['step'], record['resource'] = self._owner(
+                    metadata.get('labels') or {})
+
+            spec = pod.get('spec', {})
+            record['volumes'] = any([
+                'persistentVolumeClaim' in v or 'gcePersistentDisk' in v
+                for v in spec.get('volumes') or []])
+            status = pod.get('status', {})
+            conditions = dict([
+                (c.get('type'), c) for c in status.get('conditions') or []])
+            scheduled = conditions.get('PodScheduled', {})
+            if scheduled.get('status') == 'True':
+                self._mark(record, 'scheduled')
+            elif scheduled.get('reason') == 'Unschedulable':
+                record['unschedulable'] = scheduled.get('message')
+
+            container_statuses = status.get('containerStatuses') or []
+            record['restarts'] = sum([
+                s.get('restartCount', 0) for s in container_statuses])
+            for s in (status.get('initContainerStatuses') or []) + \
+                    container_statuses:
+                waiting = s.get('state', {}).get('waiting') or {}
+                category = container_stall_reason(waiting.get('reason'))
+                if category is not None:
+                    record['reason'] = (category, '%s: %s' % (
+                        waiting.get('reason'), waiting.get('message', '')))
+            if container_statuses and all([
+                    'running' in (s.get('state') or {})
+                    for s in container_statuses]):
+                self._mark(record, 'started')
+            if conditions.get('Ready', {}).get('status') == 'True' and \
+                    'ready' not in record['timings']:
+                record['reason'] = None
+                self._mark(record, 'ready')
+            elif record['reason'] is not None and record['step'] is not None:
+                self._report_stall(
+                    record, record['reason'][0], record['reason'][1],
+                    stalled=False)
+
+    def _on_event(self, event: dict):
+        if event['type'] == 'DELETED':
+            return
+        obj = event['object']
+        involved = obj.get('involvedObject') or {}
+        reason = obj.get('reason')
+        message = obj.get('message') or ''
+        category = event_stall_reason(reason, message)
+        with self._lock:
+            if involved.get('kind') == 'PersistentVolumeClaim':
+                if category is None:
+                    return
+                for step_key, step in self._steps.items():
+                    if step['active'] and involved.get('name') in \
+                            step['claims']:
+                        record = self._pod_record(
+                            'PersistentVolumeClaim/' + involved['name'])
+                        record['step'] = step_key
+                        record['resource'] = record['pod']
+                        record['claim'] = True
+                        self._report_stall(
+                            record, category, message, stalled=False)
+                return
+            if involved.get('kind') != 'Pod':
+                return
+
+            record = self._pod_record(involved.get('name'))
+            if record['ignored']:
+                return
+            if reason == 'Scheduled':
+                self._mark(record, 'scheduled')
+            elif reason == 'Pulling' and record['pulling'] is None:
+                record['pulling'] = (time.time(), message)
+            elif reason == 'Pulled':
+                self._mark(record, 'pulled')
+            elif reason == 'Started':
+                self._mark(record, 'started')
+
+            if category is not None and 'ready' not in record['timings']:
+                record['reason'] = (category, '%s: %s' % (reason, message))
+                # Scheduling may wait volumes or autoscaling, it is only
+                # reported if the pod stalls
+                if category != 'scheduling' and record['step'] is not None:
+                    self._report_stall(
+                        record, category, record['reason'][1],
+                        stalled=False)
+
+    @staticmethod
+    def diagnose(record: dict) -> tuple:
+        """
+        Return why a pod is not ready.
+
+        Args:
+            record (dict): Pod record of the monitor.
+        Returns:
+            tuple: Category (image pull, volume attach, crashloop,
+                scheduling, starting or readiness) and detail.
+        """
+        timings = record['timings']
+        if record['reason'] is not None:
+            return record['reason']
+        if 'scheduled' not in timings:
+            return 'scheduling', record['unschedulable'] or 'not scheduled'
+        if record['pulling'] is not None and 'pulled' not in timings:
+            return 'image pull', 'pulling for %.0fs: %s' % (
+                time.time() - record['pulling'][0], record['pulling'][1])
+        if 'started' not in timings and record['volumes']:
+            return 'volume attach', 'waiting volumes to attach and mount'
+        if record['restarts']:
+            return 'crashloop', '%s restarts' % (record['restarts'], )
+        if 'started' not in timings:
+            return 'starting', 'containers not started'
+        return 'readiness', 'containers started, readiness probe failing'
+
+    def _check_stalls(self):
+        while not self._stop.wait(1):
+            now = time.time()
+            with self._lock:
+                for record in list(self._pods.values()):
+                    step = self._steps.get(record['step'])
+                    if step is None or not step['active'] or \
+                            record['deleted'] or record['claim'] or \
+                            'ready' in record['timings'] or \
+                            now - record['created'] < self.stall_after:
+                        continue
+                    category, detail = self.diagnose(record)
+                    self._report_stall(record, category, detail, True)
+
+    def diagnose_step(self, cmd: dict) -> list:
+        """
+        Explain why the pods of a deploy step are not ready.
+
+        Args:
+            cmd (dict): Deploy command.
+        Returns:
+            list: One `pod (resource): category - detail` string for each
+                pod of the step that is not ready.
+        """
+        with self._lock:
+            records = [
+                r for r in self._pods.values()
+                if r['step'] == cmd['file'] and not r['deleted'] and
+                not r['claim'] and 'ready' not in r['timings']]
+            return [
+                '%s (%s): %s - %s' % ((r['pod'], r['resource']) +
+                                      tuple(self.diagnose(r)))
+                for r in records]
+
+    ##########
+    # Watches
+    def _watch_loop(self, kind: str, handler):
+        resource_version = None
+        while not self._stop.is_set():
+            try:
+                for event in self.kube_client.watch_resources(
+                        kind, resource_version=resource_version,
+                        timeout_seconds=self.watch_timeout):
+                    if self._stop.is_set():
+                        return
+                    if event.get('type') == 'ERROR':
+                        # Expired resource version, list again
+                        resource_version = None
+                        break
+                    resource_version = event['object'].get(
+                        'metadata', {}).get('resourceVersion')
+                    handler(event)
+            except Exception as e:
+                print('!!!Error watching %s: %s' % (kind, e))
+                resource_version = None
+                self._stop.wait(1)
+
+    def start(self):
+        """Start watching on background threads."""
+        self.start_time = time.time()
+        self.kube_client.ensure_context()
+        for target, args in [
+                (self._watch_loop, ('pods', self._on_pod)),
+                (self._watch_loop, ('events', self._on_event)),
+                (self._check_stalls, ())]:
+            thread = threading.Thread(target=target, args=args, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        """Stop watching, watches are closed when their request ends."""
+        self._stop.set()
+
+    def __enter__(self):
+        """__enter__."""
+        return self.start()
+
+    def __exit__(self, *args):
+        """__exit__."""
+        self.stop()
+
+    def report(self) -> dict:
+        """
+        Pod timings and stalls of the deploy.
+
+        Returns:
+            dict: `pods` with `pod`, `step`, `resource`, `timings` (seconds
+                since creation to each of POD_PHASES), `restarts` and
+                `diagnosis` (category and detail of pods not ready) and
+                `stalls` reported.
+        """
+        with self._lock:
+            pods = []
+            for r in self._pods.values():
+                if r['step'] is None or r['ignored'] or r['claim']:
+                    continue
+                pods.append({
+                    'pod': r['pod'], 'step': r['step'],
+                    'resource': r['resource'],
+                    'timings': dict(r['timings']),
+                    'restarts': r['restarts'],
+                    'diagnosis': (
+                        None if 'ready' in r['timings'] or r['deleted']
+                        else list(self.diagnose(r)))})
+            return {'pods': pods, 'stalls': list(self._stalls)}
@@ -0,0 +1,286 @@
+"""Dependency graph executor for deploy commands."""
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+STAGE_SECRETS = 0
+STAGE_DATABASE = 1
+STAGE_APPS = 2
+
+
+def command_stage(cmd: dict) -> int:
+    """
+    Return the deploy stage of a command.
+
+    Secrets, configmaps and volumes are deployed first, then the postgres
+    databases and at last the apps, workers, services and the batches with
+    all resources of a microservice.
+
+    Args:
+        cmd (dict): Deploy command created by DeployPumpWood.
+    Returns:
+        int: Stage of the command.
+    """
+    cmd_type = cmd.get('type')
+    if cmd_type in ['secrets', 'secrets_file', 'configmap', 'volume']:
+        return STAGE_SECRETS
+    if cmd_type == 'deploy' and cmd.get('name', '').endswith('__postgres'):
+        return STAGE_DATABASE
+    return STAGE_APPS
+
+
+class DeployNode:
+    """Node of the deploy graph."""
+
+    def __init__(self, key: str, cmd: dict, dependencies: list = None):
+        """
+        __init__.
+
+        Args:
+            key (str): Unique key of the node.
+            cmd (dict): Deploy command associated with the node.
+        Kwargs:
+            dependencies (list): Keys of the nodes that must finish before
+                this one starts.
+        """
+        self.key = key
+        self.cmd = cmd
+        self.dependencies = list(dependencies or [])
+        self.status = 'pending'
+        self.start = None
+        self.end = None
+        self.error = None
+
+    @property
+    def duration(self):
+        """Time in seconds spent running the node."""
+        if self.start is None or self.end is None:
+            return 0.0
+        return self.end - self.start
+
+    def to_dict(self):
+        """Return a dictionary with node status and timing."""
+        return {
+            'key': self.key, 'status': self.status,
+            'dependencies': self.dependencies, 'start': self.start,
+            'end': self.end, 'duration': self.duration,
+            'error': self.error}
+
+
+class DeployGraph:
+    """Directed acyclic graph of deploy commands."""
+
+    def __init__(self):
+        """__init__."""
+        self.nodes = OrderedDict()
+
+    def add_node(self, key: str, cmd: dict, dependencies: list = None):
+        """
+        Add a node to the graph.
+
+        Args:
+            key (str): Unique key of the node.
+            cmd (dict): Deploy command.
+        Kwargs:
+            dependencies (list): Keys of nodes that this node depends on,
+                they must be added before.
+        Returns:
+            DeployNode: The created node.
+        """
+        if key in self.nodes:
+            raise Exception('Node already in deploy graph: %s' % (key, ))
+        for d in dependencies or []:
+            if d not in self.nodes:
+                raise Exception(
+                    'Dependency [%s] of node [%s] not in deploy graph' % (
+                        d, key))
+        node = DeployNode(key=key, cmd=cmd, dependencies=dependencies)
+        self.nodes[key] = node
+        return node
+
+    @classmethod
+    def from_deploy_commands(cls, cmds: list,
+                             shared_microservices: tuple = (0, )):
+        """
+        Build the deploy graph from the commands of create_deploy_files.
+
+        Secrets, configmaps and volumes have no dependencies. Postgres
+        deployments depend on the secrets and volumes of their microservice,
+        apps and workers depend also on the postgres of their microservice.
+        Secrets of shared microservices (StandardMicroservices) are
+        dependencies of every postgres, app and worker.
+
+        Args:
+            cmds (list): List of deploy commands, each one with `type`,
+                `name` and `microservice` keys.
+        Kwargs:
+            shared_microservices (tuple): Index of the microservices that have
+                resources used by all other microservices.
+        Returns:
+            DeployGraph: Graph of the commands.
+        """
+        graph = cls()
+        keys_by_stage = {}
+        shared_keys = []
+        for c in sorted(cmds, key=command_stage):
+            stage = command_stage(c)
+            microservice = c.get('microservice')
+            key = c['file']
+
+            dependencies = []
+            if stage != STAGE_SECRETS and c.get('type') != 'services':
+                for s in range(stage):
+                    dependencies.extend(
+                        keys_by_stage.get((microservice, s), []))
+                dependencies.extend([
+                    k for k in shared_keys if k not in dependencies])
+
+            graph.add_node(key=key, cmd=c, dependencies=dependencies)
+            keys_by_stage.setdefault((microservice, stage), []).append(key)
+            if stage == STAGE_SECRETS and \
+                    microservice in shared_microservices:
+                shared_keys.append(key)
+        return graph
+
+    def dependents(self):
+        """Return a dictionary with the nodes that depend on each node."""
+        dependents = {key: [] for key in self.nodes.keys()}
+        for node in self.nodes.values():
+            for d in node.dependencies:
+                dependents[d].append(node.key)
+        return dependents
+
+    def critical_path(self):
+        """
+        Return the longest chain of the graph using node durations.
+
+        Returns:
+            dict: `time` with the sum of durations along the critical path and
+                `path` with the node keys.
+        """
+        longest = {}
+        previous = {}
+        # Nodes are added after their dependencies, insertion order is
+        # already topological.
+        for key, node in self.nodes.items():
+            best_dep = None
+            best_time = 0.0
+            for d in node.dependencies:
+                if longest[d] > best_time or best_dep is None:
+                    best_dep = d
+                    best_time = longest[d]
+            longest[key] = best_time + node.duration
+            previous[key] = best_dep
+
+        if len(longest) == 0:
+            return {'time': 0.0, 'path': []}
+
+        last_key = max(longest, key=longest.get)
+        path = []
+        key = last_key
+        while key is not None:
+            path.append(key)
+            key = previous[key]
+        path.reverse()
+        return {'time': longest[last_key], 'path': path}
+
+
+class DeployExecutor:
+    """Run a deploy graph concurrently respecting its dependencies."""
+
+    def __init__(self, run_function, max_workers: int = 4):
+        """
+        __init__.
+
+        Args:
+            run_function (callable): Function that receives a deploy command
+                and runs it. It must return 0 on success, other return
+                values or exceptions mark the node as failed.
+        Kwargs:
+            max_workers (int): Maximum number of commands running at the
+                same time.
+        """
+        if max_workers < 1:
+            raise Exception('max_workers must be greater than 0')
+        self.run_function = run_function
+        self.max_workers = max_workers
+
+    def _run_node(self, node: DeployNode):
+        node.start = time.time()
+        node.status = 'running'
+        try:
+            return_code = self.run_function(node.cmd)
+            if return_code not in [0, None]:
+                node.status = 'failed'
+                node.error = 'Return code: %s' % (return_code, )
+            else:
+                node.status = 'succeeded'
+        except Exception as e:
+            node.status = 'failed'
+            node.error = str(e)
+        node.end = time.time()
+        return node
+
+    def run(self, graph: DeployGraph):
+        """
+        Run all nodes of the graph.
+
+        Nodes start as soon as all their dependencies have succeeded, nodes
+        with failed dependencies are skipped.
+
+        Args:
+            graph (DeployGraph): Graph to be executed.
+        Returns:
+            dict: Report with `wall_time`, `critical_path_time`,
+                `critical_path`, `failed`, `skipped` and `nodes` timing.
+        """
+        dependents = graph.dependents()
+        remaining = {
+            key: len(node.dependencies)
+            for key, node in graph.nodes.items()}
+        ready = [key for key, n in remaining.items() if n == 0]
+
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            running = set()
+            while ready or running:
+                for key in ready:
+                    print('###Running: ' + key)
+                    running.add(pool.submit(self._run_node, graph.nodes[key]))
+                ready = []
+
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    node = future.result()
+                    if node.status != 'succeeded':
+                        print('!!!Failed: %s [%s]' % (node.key, node.error))
+                        self._skip_dependents(graph, dependents, node.key)
+                        continue
+                    print('###Finished: %s [%.1fs]' % (
+                        node.key, node.duration))
+                    for d in dependents[node.key]:
+                        remaining[d] = remaining[d] - 1
+                        if remaining[d] == 0 and \
+                                graph.nodes[d].status == 'pending':
+                            ready.append(d)
+        wall_time = time.time() - start
+
+        critical_path = graph.critical_path()
+        return {
+            'wall_time': wall_time,
+            'critical_path_time': critical_path['time'],
+            'critical_path': critical_path['path'],
+            'failed': [
+                k for k, n in graph.nodes.items() if n.status == 'failed'],
+            'skipped': [
+                k for k, n in graph.nodes.items() if n.status == 'skipped'],
+            'nodes': [n.to_dict() for n in graph.nodes.values()]}
+
+    def _skip_dependents(self, graph, dependents, key):
+        for d in dependents[key]:
+            node = graph.nodes[d]
+            if node.status == 'pending':
+                node.status = 'skipped'
+                node.error = 'Dependency failed: %s' % (key, )
+                self._skip_dependents(graph, dependents, d)
@@ -0,0 +1,554 @@
+"""
+In-memory stand-in of the Kubernetes API server.
+
+Used to run and benchmark deploys offline with KubernetesAPIClient:
+
+    with FakeKubernetesAPIServer() as server:
+        client = KubernetesAPIClient(server=server.url)
+        kube_client = Kubernets(..., api_client=client)
+
+It implements the subset of the API used by pumpwood_deploy: server-side
+apply (PATCH), create (POST), get, list with label selectors, delete, watch
+and dry-run. Deployments are marked as rolled out with Running pods (and
+their Scheduled, Pulled and Started Events) and PVCs as bound. As on a
+cluster, the Endpoints of a Service only have addresses while ready pods
+match its selector. Requests proxied to pods and services are answered by
+`proxy_function`.
+"""
+import re
+import json
+import time
+import uuid
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import yaml
+
+
+PATH_RE = re.compile(
+    r'^/(?:api/(?P<core>v1)|apis/(?P<group>[^/]+/[^/]+))'
+    r'(?:/namespaces/(?P<namespace>[^/]+))?'
+    r'/(?P<plural>[^/]+)(?:/(?P<name>[^/]+))?$')
+
+PROXY_RE = re.compile(
+    r'^/api/v1/namespaces/(?P<namespace>[^/]+)/(?P<plural>pods|services)'
+    r'/(?P<name>[^/:]+)(?::(?P<port>[^/]+))?/proxy(?P<path>/.*)?$')
+
+KINDS = {
+    'namespaces': 'Namespace', 'secrets': 'Secret',
+    'configmaps': 'ConfigMap', 'services': 'Service',
+    'endpoints': 'Endpoints', 'pods': 'Pod', 'events': 'Event',
+    'persistentvolumes': 'PersistentVolume',
+    'persistentvolumeclaims': 'PersistentVolumeClaim',
+    'deployments': 'Deployment', 'replicasets': 'ReplicaSet'}
+
+
+def _match_labels(obj: dict, label_selector: str) -> bool:
+    if not label_selector:
+        return True
+    labels = obj.get('metadata', {}).get('labels') or {}
+    for requirement in label_selector.split(','):
+        if '!=' in requirement:
+            key, value = requirement.split('!=')
+            if labels.get(key) == value:
+                return False
+        elif '=' in requirement:
+            key, value = requirement.replace('==', '=').split('=')
+            if labels.get(key) != value:
+                return False
+        elif requirement.startswith('!'):
+            if requirement[1:] in labels:
+                return False
+        elif requirement not in labels:
+            return False
+    return True
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeKubernetesAPIServer:
+    """In-memory Kubernetes API server stand-in."""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0,
+                 latency: float = 0, auto_ready: bool = True,
+                 throttle_every: int = 0, proxy_function=None):
+        """
+        __init__.
+
+        Kwargs:
+            host (str): Host to bind.
+            port (int): Port to bind, 0 to use a free port.
+            latency (float): Seconds added to every request, to simulate
+                API server latency.
+            auto_ready (bool): Mark Deployments as rolled out with ready
+                pods, PVCs as bound and keep the Endpoints of Services with
+                the addresses of their ready pods.
+            throttle_every (int): Answer every n-th write request with
+                429 Too Many Requests, to simulate API server throttling.
+                0 never throttles.
+            proxy_function (callable): Function receiving the pod or
+                service object, port and path of proxied requests and
+                returning the status code and body. Default answers 200.
+        """
+        self.latency = latency
+        self.auto_ready = auto_ready
+        self.throttle_every = throttle_every
+        self.proxy_function = proxy_function
+        self._n_writes = 0
+        self.objects = {}
+        self.requests = []
+        self._resource_version = 0
+        self._lock = threading.Condition()
+        self._events = []
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _handle(self):
+                server._handle(self)
+
+            do_GET = _handle
+            do_POST = _handle
+            do_PATCH = _handle
+            do_PUT = _handle
+            do_DELETE = _handle
+
+        self.httpd = _ThreadingHTTPServer((host, port), Handler)
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """Url of the server."""
+        host, port = self.httpd.server_address[:2]
+        return 'http://%s:%s' % (host, port)
+
+    def start(self):
+        """Start serving on a background thread."""
+        self._thread = threading.Thread(
+            target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop the server."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        """__enter__."""
+        return self.start()
+
+    def __exit__(self, *args):
+        """__exit__."""
+        self.stop()
+
+    ###########
+    # Store API
+    def put_object(self, obj: dict, event_type: str = None):
+        """
+        Store an object and notify watchers.
+
+        Args:
+            obj (dict): Object with apiVersion, kind and metadata.
+        Kwargs:
+            event_type (str): Watch event type, ADDED or MODIFIED if None.
+        Returns:
+            dict: Stored object.
+        """
+        with self._lock:
+            metadata = obj['metadata']
+            key = (obj['kind'], metadata.get('namespace'), metadata['name'])
+            if event_type is None:
+                event_type = 'MODIFIED' if key in self.objects else 'ADDED'
+            self._resource_version = self._resource_version + 1
+            metadata['resourceVersion'] = str(self._resource_version)
+            self.objects[key] = obj
+            self._events.append({
+                'type': event_type, 'object': obj,
+                'resourceVersion': self._resource_version})
+            self._lock.notify_all()
+        return obj
+
+    def put_event(self, kind: str, namespace: str, name: str, reason: str,
+                  message: str, event_type: str = 'Normal'):
+        """
+        Store an Event involving an object.
+
+        Args:
+            kind (str): Kind of the involved object.
+            namespace (str): Namespace of the involved object.
+            name (str): Name of the involved object.
+            reason (str): Reason of the Event (Pulled, FailedMount).
+            message (str): Message of the Event.
+        Kwargs:
+            event_type (str): Normal or Warning.
+        Returns:
+            dict: Stored Event.
+        """
+        now = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        return self.put_object({
+            'apiVersion': 'v1', 'kind': 'Event',
+            'metadata': {
+                'name': '%s.%s' % (name, uuid.uuid4().hex[:16]),
+                'namespace': namespace},
+            'involvedObject': {
+                'kind': kind, 'name': name, 'namespace': namespace},
+            'reason': reason, 'message': message, 'type': event_type,
+            'firstTimestamp': now, 'lastTimestamp': now, 'count': 1})
+
+    def get_object(self, kind: str, namespace: str, name: str):
+        """Return a stored object or None."""
+        return self.objects.get((kind, namespace, name))
+
+    def delete_object(self, kind: str, namespace: str, name: str):
+        """Delete a stored object and notify watchers."""
+        with self._lock:
+            obj = self.objects.pop((kind, namespace, name), None)
+            if obj is not None:
+                self._resource_version = self._resource_version + 1
+                self._events.append({
+                    'type': 'DELETED', 'object': obj,
+                    'resourceVersion': self._resource_version})
+                self._lock.notify_all()
+        return obj
+
+    ##########
+    # Handlers
+    def _handle(self, handler):
+        if self.latency:
+            time.sleep(self.latency)
+
+        parsed = urlparse(handler.path)
+        params = dict(
+            [(k, v[0]) for k, v in parse_qs(parsed.query).items()])
+        length = int(handler.headers.get('Content-Length') or 0)
+        body = handler.rfile.read(length) if length else b''
+        self.requests.append({
+            'method': handler.command, 'path': parsed.path,
+            'params': params})
+
+        proxy_match = PROXY_RE.match(parsed.path)
+        if proxy_match is not None:
+            return self._proxy(handler, proxy_match)
+
+        match = PATH_RE.match(parsed.path)
+        if match is None or match.group('plural') not in KINDS:
+            return self._send(handler, 404, self._status(
+                404, 'NotFound', 'Path not found: ' + parsed.path))
+        kind = KINDS[match.group('plural')]
+        namespace = match.group('namespace')
+        name = match.group('name')
+        api_version = match.group('core') or match.group('group')
+        dry_run = params.get('dryRun') == 'All'
+
+        if self.throttle_every and handler.command != 'GET':
+            with self._lock:
+                self._n_writes = self._n_writes + 1
+                throttle = self._n_writes % self.throttle_every == 0
+            if throttle:
+                return self._send(handler, 429, self._status(
+                    429, 'TooManyRequests', 'Too many requests'),
+                    headers={'Retry-After': '0'})
+
+        if handler.command == 'GET' and name is None:
+            if params.get('watch') == 'true':
+                return self._watch(handler, kind, namespace, params)
+            with self._lock:
+                objects = sorted(self.objects.items())
+            items = [
+                o for (k, n, _), o in objects
+                if k == kind and n == namespace and
+                _match_labels(o, params.get('labelSelector'))]
+            return self._send(handler, 200, {
+                'kind': kind + 'List', 'apiVersion': api_version,
+                'metadata': {'resourceVersion': str(self._resource_version)},
+                'items': items})
+
+        if handler.command == 'GET':
+            obj = self.get_object(kind, namespace, name)
+            if obj is None:
+                return self._send(handler, 404, self._status(
+                    404, 'NotFound', '%s "%s" not found' % (kind, name)))
+            return self._send(handler, 200, obj)
+
+        if handler.command == 'POST':
+            obj = json.loads(body)
+            name = obj['metadata']['name']
+            if self.get_object(kind, namespace, name) is not None:
+                return self._send(handler, 409, self._status(
+                    409, 'AlreadyExists',
+                    '%s "%s" already exists' % (kind, name)))
+            obj = self._new_object(obj, kind, api_version, namespace)
+            if not dry_run:
+                self._store(obj)
+            return self._send(handler, 201, obj)
+
+        if handler.command == 'PATCH':
+            manifest = yaml.safe_load(body)
+            current = self.get_object(kind, namespace, name)
+            if current is None:
+                obj = self._new_object(
+                    manifest, kind, api_version, namespace)
+                status = 201
+            else:
+                obj = self._merge(current, manifest)
+                status = 200
+            if not dry_run:
+                self._store(obj)
+            return self._send(handler, status, obj)
+
+        if handler.command == 'DELETE':
+            obj = self.get_object(kind, namespace, name)
+            if obj is None:
+                return self._send(handler, 404, self._status(
+                    404, 'NotFound', '%s "%s" not found' % (kind, name)))
+            if not dry_run:
+                self.delete_object(kind, namespace, name)
+                if kind == 'Deployment':
+                    self._delete_pods(obj)
+                if kind == 'Service':
+                    self.delete_object('Endpoints', namespace, name)
+                if kind in ['Deployment', 'Pod']:
+                    self._sync_endpoints(namespace)
+            return self._send(handler, 200, self._status(
+                200, 'Success', 'deleted'))
+
+        return self._send(handler, 405, self._status(
+            405, 'MethodNotAllowed', handler.command))
+
+    def _new_object(self, manifest, kind, api_version, namespace):
+        obj = json.loads(json.dumps(manifest))
+        obj['kind'] = kind
+        obj['apiVersion'] = api_version
+        metadata = obj.setdefault('metadata', {})
+        if namespace is not None:
+            metadata['namespace'] = namespace
+        metadata['uid'] = str(uuid.uuid4())
+        metadata['generation'] = 1
+        metadata['creationTimestamp'] = time.strftime(
+            '%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        return obj
+
+    def _merge(self, current, manifest):
+        obj = json.loads(json.dumps(current))
+        for key, value in manifest.items():
+            if key == 'metadata':
+                for m_key in ['labels', 'annotations']:
+                    if m_key in value:
+                        obj['metadata'][m_key] = value[m_key]
+            elif key not in ['status', 'kind', 'apiVersion']:
+                obj[key] = value
+        if obj.get('spec') != current.get('spec'):
+            obj['metadata']['generation'] = \
+                current['metadata'].get('generation', 1) + 1
+        return obj
+
+    def _store(self, obj):
+        if self.auto_ready:
+            self._set_ready(obj)
+        self.put_object(obj)
+        if self.auto_ready and obj['kind'] == 'Deployment':
+            self._create_pods(obj)
+        if self.auto_ready and obj['kind'] in ['Deployment', 'Service']:
+            self._sync_endpoints(obj['metadata'].get('namespace'))
+
+    def _sync_endpoints(self, namespace: str):
+        with self._lock:
+            objects = list(self.objects.values())
+        pods = [
+            o for o in objects
+            if o['kind'] == 'Pod' and
+            o['metadata'].get('namespace') == namespace and
+            any([c['type'] == 'Ready' and c['status'] == 'True'
+                 for c in o.get('status', {}).get('conditions', [])])]
+        for service in objects:
+            selector = service.get('spec', {}).get('selector')
+            if service['kind'] != 'Service' or not selector or \
+                    service['metadata'].get('namespace') != namespace:
+                continue
+            addresses = [
+                {'ip': p['status']['podIP'],
+                 'targetRef': {'kind': 'Pod', 'name': p['metadata']['name']}}
+                for p in pods
+                if all([(p['metadata'].get('labels') or {}).get(k) == v
+                        for k, v in selector.items()])]
+            subsets = [{'addresses': addresses}] if addresses else []
+            name = service['metadata']['name']
+            current = self.get_object('Endpoints', namespace, name)
+            if current is not None and current.get('subsets') == subsets:
+                continue
+            self.put_object({
+                'apiVersion': 'v1', 'kind': 'Endpoints',
+                'metadata': {'name': name, 'namespace': namespace},
+                'subsets': subsets})
+
+    def _owned_pods(self, deployment):
+        metadata = deployment['metadata']
+        with self._lock:
+            objects = list(self.objects.values())
+        return [
+            o for o in objects
+            if o['kind'] == 'Pod' and
+            o['metadata'].get('namespace') == metadata.get('namespace') and
+            o['metadata'].get('ownerReferences', [{}])[0].get('name') ==
+            metadata['name']]
+
+    def _delete_pods(self, deployment, keep_generation: str = None):
+        for pod in self._owned_pods(deployment):
+            annotations = pod['metadata'].get('annotations', {})
+            if annotations.get('generation') == keep_generation:
+                continue
+            self.delete_object(
+                'Pod', pod['metadata'].get('namespace'),
+                pod['metadata']['name'])
+
+    def _create_pods(self, deployment):
+        metadata = deployment['metadata']
+        generation = str(metadata['generation'])
+        if any([p['metadata']['annotations'].get('generation') == generation
+                for p in self._owned_pods(deployment)]):
+            return
+        self._delete_pods(deployment, keep_generation=generation)
+        template = deployment.get('spec', {}).get('template', {})
+        for i in range(deployment.get('spec', {}).get('replicas', 1)):
+            now = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+            self.put_object({
+                'apiVersion': 'v1', 'kind': 'Pod',
+                'metadata': {
+                    'name': '%s-%s-%s' % (metadata['name'], generation, i),
+                    'namespace': metadata.get('namespace'),
+                    'labels': dict(
+                        template.get('metadata', {}).get('labels') or {}),
+                    'annotations': {'generation': generation},
+                    'uid': str(uuid.uuid4()), 'creationTimestamp': now,
+                    'ownerReferences': [{
+                        'kind': 'Deployment', 'name': metadata['name']}]},
+                'spec': json.loads(json.dumps(template.get('spec', {}))),
+                'status': {
+                    'phase': 'Running', 'startTime': now,
+                    'podIP': '10.%s.%s.%s' % (
+                        self._resource_version // 65536 % 256,
+                        self._resource_version // 256 % 256,
+                        self._resource_version % 256),
+                    'conditions': [{
+                        'type': 'Ready', 'status': 'True',
+                        'lastTransitionTime': now}]}})
+            pod_name = '%s-%s-%s' % (metadata['name'], generation, i)
+            for reason, message in [
+                    ('Scheduled', 'Successfully assigned'),
+                    ('Pulled', 'Container image already present'),
+                    ('Started', 'Started container')]:
+                self.put_event(
+                    'Pod', metadata.get('namespace'), pod_name, reason,
+                    message)
+
+    def _proxy(self, handler, match):
+        kind = KINDS[match.group('plural')]
+        obj = self.get_object(kind, match.group('namespace'),
+                              match.group('name'))
+        if obj is None:
+            return self._send(handler, 404, self._status(
+                404, 'NotFound', '%s "%s" not found' % (
+                    kind, match.group('name'))))
+        status, body = 200, 'ok'
+        if self.proxy_function is not None:
+            status, body = self.proxy_function(
+                obj, match.group('port'), match.group('path') or '/')
+        data = body.encode() if isinstance(body, str) else body
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'text/plain')
+        handler.send_header('Content-Length', str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def _set_ready(self, obj):
+        kind = obj['kind']
+        if kind == 'Deployment':
+            replicas = obj.get('spec', {}).get('replicas', 1)
+            obj['status'] = {
+                'observedGeneration': obj['metadata']['generation'],
+                'replicas': replicas, 'updatedReplicas': replicas,
+                'readyReplicas': replicas, 'availableReplicas': replicas}
+        elif kind == 'PersistentVolumeClaim':
+            obj['status'] = {'phase': 'Bound'}
+        elif kind == 'PersistentVolume':
+            obj['status'] = {'phase': 'Bound'}
+
+    def _watch(self, handler, kind, namespace, params):
+        handler.send_response(200)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Transfer-Encoding', 'chunked')
+        handler.end_headers()
+
+        timeout = float(params.get('timeoutSeconds', 30))
+        label_selector = params.get('labelSelector')
+        position = 0
+        if params.get('resourceVersion'):
+            since = int(params['resourceVersion'])
+            position = len([
+                e for e in self._events if e['resourceVersion'] <= since])
+        else:
+            # Emulate initial ADDED events of current objects
+            with self._lock:
+                initial = b''.join([
+                    json.dumps({'type': 'ADDED', 'object': o}).encode() +
+                    b'\n' for (k, n, _), o in sorted(self.objects.items())
+                    if k == kind and n == namespace and
+                    _match_labels(o, label_selector)])
+                position = len(self._events)
+            if initial:
+                self._write_chunk(handler, initial)
+
+        end = time.time() + timeout
+        try:
+            while time.time() < end:
+                with self._lock:
+                    if position >= len(self._events):
+                        self._lock.wait(timeout=min(1, end - time.time()))
+                    events = self._events[position:]
+                    position = len(self._events)
+                lines = []
+                for e in events:
+                    o = e['object']
+                    if o['kind'] != kind or \
+                            o['metadata'].get('namespace') != namespace or \
+                            not _match_labels(o, label_selector):
+                        continue
+                    lines.append(json.dumps({
+                        'type': e['type'], 'object': o}).encode() + b'\n')
+                if lines:
+                    self._write_chunk(handler, b''.join(lines))
+            self._write_chunk(handler, b'')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    @staticmethod
+    def _write_chunk(handler, data: bytes):
+        handler.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        handler.wfile.flush()
+
+    @staticmethod
+    def _status(code, reason, message):
+        return {
+            'kind': 'Status', 'apiVersion': 'v1', 'code': code,
+            'reason': reason, 'message': message,
+            'status': 'Success' if code < 300 else 'Failure'}
+
+    @staticmethod
+    def _send(handler, status, body, headers: dict = None):
+        data = json.dumps(body).encode()
+        handler.send_response(status)
+        for key, value in (headers or {}).items():
+            handler.send_header(key, value)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
@@ -1,13 +1,46 @@
 """Interface with kubernets."""
 
+import os
+import json
+import time
+import threading
 import subprocess
+from pumpwood_deploy.kubernets.wait import wait_for_conditions
+from pumpwood_deploy.kubernets.api import KubernetesAPIClient
+from pumpwood_deploy.kubernets.timeline import phase
+from pumpwood_deploy.manifests.hashing import CONTENT_HASH_ANNOTATION
+from pumpwood_deploy.kubernets.credentials import (
+    ContextCache, gke_context_name, kubeconfig_context)
+from pumpwood_deploy.manifests.model import load_documents
+
+
+def script_command(path: str) -> list:
+    """
+    Return the command that runs a deploy script.
+
+    Scripts without shebang are run with sh. They are not rewritten: a
+    script open for writing while other threads fork fails to run with
+    text file busy.
+
+    Args:
+        path (str): Path of the deploy script.
+    Returns:
+        list: Command arguments.
+    """
+    with open(path, 'rb') as file:
+        if file.read(2) == b'#!':
+            return [path]
+    return ['/bin/sh', path]
 
 
 class Kubernets:
     """Class to auxiliate kubernets interface."""
 
     def __init__(self, cluster_name: str, zone: str, project: str,
-                 namespace: str = "default"):
+                 namespace: str = "default",
+                 api_client: KubernetesAPIClient = None,
+                 context_cache: ContextCache = None, lazy: bool = True,
+                 kubeconfig: str = None):
         """
         __init__.
 
@@ -16,51 +49,469 @@ class Kubernets:
             zone (str): Zone location of the cluster.
             project (str): Google project name:
             temp_deploy_path (str): Path to keep temp deploy files.
+
+        Kwargs:
+            namespace (str): Namespace of the deploy.
+            api_client (KubernetesAPIClient): If set, resources are applied
+                and read directly on the API server using the client pooled
+                connections instead of gcloud/kubectl processes. Commands
+                without manifest content fall back to the shell scripts.
+                The client is not changed, a copy on `namespace` sharing
+                its connections is used.
+            context_cache (ContextCache): Cache of the logins and namespaces
+                already set up, default ContextCache().
+            lazy (bool): Set up cluster credentials and namespace only on
+                the first command sent to the cluster, if False they are set
+                up on object creation.
+            kubeconfig (str): Path of the kubeconfig used by gcloud, kubectl
+                and the deploy scripts, default the user kubeconfig. Each
+                Kubernets object that deploys at the same time on a different
+                cluster must have its own kubeconfig, since they set the
+                current context.
         """
-        cmd = "gcloud container clusters get-credentials {cluster_name} " + \
-            " --zone {zone} --project {project}"
-        cmd_formated = cmd.format(
-            cluster_name=cluster_name, zone=zone, project=project)
+        self.cluster_name = cluster_name
+        self.zone = zone
+        self.project = project
+        self.namespace = namespace
+        self.api_client = None
+        if api_client is not None:
+            # Clients may be shared by many namespaces of a cluster
+            self.api_client = api_client.for_namespace(namespace)
+        self.context_cache = context_cache or ContextCache()
+        self._context_ready = False
+        self._context_lock = threading.Lock()
+        self.kubeconfig = kubeconfig
+        self.env = None
+        if kubeconfig is not None:
+            self.env = dict(os.environ, KUBECONFIG=kubeconfig)
+        if not lazy:
+            self.ensure_context()
 
-        print('## Loging to kubernets cluster')
+    def current_context(self) -> dict:
+        """
+        Return kubectl current context.
+
+        Returns:
+            dict: `context`, `namespace` and `token_expiry`, see
+                kubeconfig_context. None if kubectl has no current context.
+        """
         process = subprocess.Popen(
-            cmd_formated.split(), stdout=subprocess.PIPE)
+            ['kubectl', 'config', 'view', '--minify', '-o', 'json'],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=self.env)
         output, error = process.communicate()
+        if process.returncode != 0:
+            return None
+        try:
+            return kubeconfig_context(json.loads(output))
+        except ValueError:
+            return None
+
+    def ensure_context(self, force: bool = False):
+        """
+        Log in to the cluster and create the namespace if needed.
+
+        gcloud login is done only if kubectl current context is not the
+        cluster or its token is expired, the namespace is created only if
+        it is not on the context cache. Set up is done once for each object
+        and is thread safe.
+
+        Kwargs:
+            force (bool): Ignore the cache, log in and create the namespace.
+        """
+        with self._context_lock:
+            if self._context_ready and not force:
+                return
+            if self.api_client is not None:
+                print('## Creating namespace')
+                self.api_client.ensure_namespace()
+            else:
+                self._setup_kubectl_context(force=force)
+            self._context_ready = True
+
+    def _setup_kubectl_context(self, force: bool = False):
+        context_name = gke_context_name(
+            cluster_name=self.cluster_name, zone=self.zone,
+            project=self.project)
+        cache_key = context_name + '/' + self.namespace
+        if self.kubeconfig is not None:
+            cache_key = os.path.abspath(self.kubeconfig) + ':' + cache_key
+        cached = None if force else self.context_cache.get(cache_key)
+
+        current = self.current_context()
+        token_valid = current is not None and (
+            current['token_expiry'] is None or
+            time.time() + 60 < current['token_expiry'])
+        if force or current is None or not token_valid or \
+                current['context'] != context_name:
+            cmd = "gcloud container clusters get-credentials " + \
+                "{cluster_name} --zone {zone} --project {project}"
+            cmd_formated = cmd.format(
+                cluster_name=self.cluster_name, zone=self.zone,
+                project=self.project)
+
+            print('## Loging to kubernets cluster')
+            process = subprocess.Popen(
+                cmd_formated.split(), stdout=subprocess.PIPE, env=self.env)
+            output, error = process.communicate()
+            current = self.current_context()
+            cached = None
+
+        if cached is None:
+            print('## Creating namespace')
+            cmd = "kubectl create namespace {namespace}"
+            cmd_formated = cmd.format(namespace=self.namespace)
+            process = subprocess.Popen(
+                cmd_formated.split(), stdout=subprocess.PIPE, env=self.env)
+            output, error = process.communicate()
+
+        if current is None or current['namespace'] != self.namespace:
+            print('## Setting new namespace [{namespace}] as default'.format(
+                namespace=self.namespace))
+            cmd = "kubectl config set-context --current " + \
+                "--namespace={namespace}"
+            cmd_formated = cmd.format(namespace=self.namespace)
+            process = subprocess.Popen(
+                cmd_formated.split(), stdout=subprocess.PIPE, env=self.env)
+            output, error = process.communicate()
+
+        if cached is None:
+            self.context_cache.set(cache_key, {
+                'context': context_name, 'namespace': self.namespace})
 
-        print('## Creating namespace')
-        cmd = "kubectl create namespace {namespace}"
-        cmd_formated = cmd.format(namespace=namespace)
+    def get_resource(self, kind: str, name: str):
+        """
+        Get a resource from the cluster.
+
+        Args:
+            kind (str): Kind of the resource (kubectl resource type).
+            name (str): Name of the resource.
+        Returns:
+            dict: Resource as returned by the cluster, None if it does not
+                exist.
+        """
+        self.ensure_context()
+        if self.api_client is not None:
+            with phase('api'):
+                return self.api_client.get(kind=kind, name=name)
+
+        cmd = "kubectl get {kind} {name} --namespace={namespace} -o json"
+        cmd_formated = cmd.format(
+            kind=kind, name=name, namespace=self.namespace)
+        with phase('subprocess'):
+            process = subprocess.Popen(
+                cmd_formated.split(), stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, env=self.env)
+            output, error = process.communicate()
+        if process.returncode != 0:
+            if b'NotFound' in error:
+                return None
+            raise Exception('Error getting %s/%s: %s' % (
+                kind, name, error.decode()))
+        return json.loads(output)
+
+    def list_resources(self, kind: str, label_selector: str = None) -> list:
+        """
+        List the resources of a kind on the namespace.
+
+        Args:
+            kind (str): Kind of the resource (kubectl resource type).
+        Kwargs:
+            label_selector (str): Label selector (key=value,key2=value2).
+        Returns:
+            list: Resources as returned by the cluster.
+        """
+        self.ensure_context()
+        if self.api_client is not None:
+            with phase('api'):
+                return self.api_client.list(
+                    kind=kind, label_selector=label_selector)
+
+        cmd = "kubectl get {kind} --namespace={namespace} -o json"
+        cmd_formated = cmd.format(kind=kind, namespace=self.namespace)
+        if label_selector is not None:
+            cmd_formated = cmd_formated + ' --selector=' + label_selector
+        with phase('subprocess'):
+            process = subprocess.Popen(
+                cmd_formated.split(), stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, env=self.env)
+            output, error = process.communicate()
+        if process.returncode != 0:
+            raise Exception('Error listing %s: %s' % (kind, error.decode()))
+        return json.loads(output).get('items') or []
+
+    def watch_resources(self, kind: str, resource_version: str = None,
+                        timeout_seconds: int = 30):
+        """
+        Watch changes on all resources of a kind on the namespace.
+
+        The watch ends after `timeout_seconds`, watch again passing the
+        resourceVersion of the last object received to continue.
+
+        Args:
+            kind (str): Kind of the resource (kubectl resource type).
+        Kwargs:
+            resource_version (str): Start watching after this version, with
+                kubectl current objects are always received first.
+            timeout_seconds (int): Duration of the watch.
+        Yields:
+            dict: Watch events with `type` (ADDED, MODIFIED, DELETED) and
+                `object`.
+        """
+        self.ensure_context()
+        if self.api_client is not None:
+            for event in self.api_client.watch(
+                    kind=kind, resource_version=resource_version,
+                    timeout_seconds=timeout_seconds):
+                yield event
+            return
+
+        cmd = (
+            "kubectl get {kind} --namespace={namespace} --watch "
+            "--output-watch-events -o json --request-timeout={timeout}s")
+        cmd_formated = cmd.format(
+            kind=kind, namespace=self.namespace, timeout=timeout_seconds)
         process = subprocess.Popen(
-            cmd_formated.split(), stdout=subprocess.PIPE)
-        output, error = process.communicate()
+            cmd_formated.split(), stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, env=self.env)
+        try:
+            # kubectl writes one indented JSON object for each event
+            buffer = []
+            for line in process.stdout:
+                buffer.append(line.decode())
+                if line.rstrip() == b'}':
+                    yield json.loads(''.join(buffer))
+                    buffer = []
+        finally:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
 
-        print('## Setting new namespace [{namespace}] as default'.format(
-            namespace=namespace))
-        cmd = "kubectl config set-context --current --namespace={namespace}"
-        cmd_formated = cmd.format(namespace=namespace)
+    def dry_run_apply(self, document: dict,
+                      field_manager: str = 'pumpwood-deploy') -> dict:
+        """
+        Server-side apply a manifest document with dry-run.
+
+        Args:
+            document (dict): Parsed manifest document.
+        Kwargs:
+            field_manager (str): Field manager of the apply, used when
+                calling kubectl.
+        Returns:
+            dict: Object as it would be persisted by the API server.
+        """
+        self.ensure_context()
+        if self.api_client is not None:
+            with phase('api'):
+                return self.api_client.apply(
+                    document, dry_run=True, force_conflicts=True)
+
+        cmd = [
+            'kubectl', 'apply', '--server-side', '--force-conflicts',
+            '--field-manager=' + field_manager, '--dry-run=server',
+            '--namespace=' + self.namespace, '-o', 'json', '-f', '-']
+        with phase('subprocess'):
+            process = subprocess.Popen(
+                cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, env=self.env)
+            output, error = process.communicate(
+                json.dumps(document).encode())
+        if process.returncode != 0:
+            raise Exception('Error on dry-run of %s/%s: %s' % (
+                document.get('kind'),
+                document.get('metadata', {}).get('name'), error.decode()))
+        return json.loads(output)
+
+    def apply_document(self, document: dict,
+                       field_manager: str = 'pumpwood-deploy') -> dict:
+        """
+        Server-side apply a manifest document.
+
+        Args:
+            document (dict): Parsed manifest document.
+        Kwargs:
+            field_manager (str): Field manager of the apply, used when
+                calling kubectl.
+        Returns:
+            dict: Applied object.
+        """
+        self.ensure_context()
+        if self.api_client is not None:
+            with phase('api'):
+                return self.api_client.apply(document, force_conflicts=True)
+
+        cmd = [
+            'kubectl', 'apply', '--server-side', '--force-conflicts',
+            '--field-manager=' + field_manager,
+            '--namespace=' + self.namespace, '-o', 'json', '-f', '-']
+        with phase('subprocess'):
+            process = subprocess.Popen(
+                cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, env=self.env)
+            output, error = process.communicate(
+                json.dumps(document).encode())
+        if process.returncode != 0:
+            raise Exception('Error applying %s/%s: %s' % (
+                document.get('kind'),
+                document.get('metadata', {}).get('name'), error.decode()))
+        return json.loads(output)
+
+    def delete_resource(self, kind: str, name: str) -> bool:
+        """
+        Delete a resource from the namespace.
+
+        Args:
+            kind (str): Kind of the resource (kubectl resource type).
+            name (str): Name of the resource.
+        Returns:
+            bool: False if the resource did not exist.
+        """
+        self.ensure_context()
+        if self.api_client is not None:
+            with phase('api'):
+                return self.api_client.delete(kind=kind, name=name)
+
+        cmd = "kubectl delete {kind} {name} --namespace={namespace}"
+        cmd_formated = cmd.format(
+            kind=kind, name=name, namespace=self.namespace)
+        with phase('subprocess'):
+            process = subprocess.Popen(
+                cmd_formated.split(), stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, env=self.env)
+            output, error = process.communicate()
+        if process.returncode != 0:
+            if b'NotFound' in error:
+                return False
+            raise Exception('Error deleting %s/%s: %s' % (
+                kind, name, error.decode()))
+        return True
+
+    def proxy_get(self, kind: str, name: str, path: str,
+                  port=None) -> tuple:
+        """
+        GET a path of a pod or service through the API server proxy.
+
+        Args:
+            kind (str): pods or services.
+            name (str): Name of the pod or service.
+            path (str): Path of the request.
+        Kwargs:
+            port (int|str): Port of the pod or service.
+        Returns:
+            tuple: Status code and body of the response. With kubectl the
+                status code is 200 on success and 500 on errors.
+        """
+        self.ensure_context()
+        if self.api_client is not None:
+            return self.api_client.proxy_get(
+                kind=kind, name=name, path=path, port=port)
+
+        target = name if port is None else '%s:%s' % (name, port)
+        raw_path = '/api/v1/namespaces/%s/%s/%s/proxy/%s' % (
+            self.namespace, kind, target, path.lstrip('/'))
         process = subprocess.Popen(
-            cmd_formated.split(), stdout=subprocess.PIPE)
+            ['kubectl', 'get', '--raw', raw_path],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=self.env)
         output, error = process.communicate()
+        if process.returncode != 0:
+            return 500, error.decode()
+        return 200, output.decode()
+
+    def is_unchanged_on_cluster(self, content: str) -> bool:
+        """
+        Check if the resources of a manifest are deployed with same content.
+
+        Compares the content hash annotation stamped on each document of the
+        manifest with the one of the resource on the cluster.
+
+        Args:
+            content (str): YAML manifest stamped with content hashes.
+        Returns:
+            bool: True if all resources exist with the same content hash.
+        """
+        for doc in load_documents(content):
+            metadata = doc.get('metadata', {})
+            expected = (metadata.get('annotations') or {}).get(
+                CONTENT_HASH_ANNOTATION)
+            if expected is None:
+                return False
+            live = self.get_resource(doc['kind'].lower(), metadata['name'])
+            if live is None:
+                return False
+            live_annotations = live.get('metadata', {}).get(
+                'annotations') or {}
+            if live_annotations.get(CONTENT_HASH_ANNOTATION) != expected:
+                return False
+        return True
+
+    def run_deploy_command(self, cmd: dict, wait_ready: bool = False,
+                           timeout: float = 600):
+        """
+        Run one deploy command.
 
-    def run_deploy_commmands(self, cmds):
-        """Deploy comands."""
+        Args:
+            cmd (dict): Deploy command created by DeployPumpWood.
+        Kwargs:
+            wait_ready (bool): If True, instead of sleeping after the command
+                wait until the readiness conditions of the command (`wait`
+                key) are met.
+            timeout (float): Timeout for the readiness conditions.
+        Returns:
+            int: Return code of the command.
+        Raises:
+            WaitTimeoutError: If resources are not ready before timeout.
+        """
+        self.ensure_context()
+        if cmd.get('skip_unchanged') and cmd.get('content') is not None:
+            if self.is_unchanged_on_cluster(cmd['content']):
+                print('###Unchanged on cluster: ' + cmd['file'])
+                return 0
+
+        if cmd['command'] == 'create':
+            raise Exception('Not implemented')
+        elif self.api_client is not None and cmd.get('content') is not None:
+            print('###Applying: ' + cmd['file'])
+            with phase('api'):
+                self.api_client.apply_manifest(
+                    cmd['content'],
+                    force_conflicts=cmd.get('force_conflicts', True))
+            return_code = 0
+        elif cmd['command'] == 'run':
+            print('###Running file: ' + cmd['file'])
+            with phase('subprocess'):
+                return_code = subprocess.call(
+                    script_command(cmd['file']), env=self.env)
+        else:
+            raise Exception('Command not implemented: %s' % (
+                cmd['command'],))
+
+        if return_code != 0:
+            return return_code
+        if wait_ready:
+            conditions = cmd.get('wait') or []
+            print('#####Waiting for: ' + ', '.join(
+                [str(c) for c in conditions]))
+            with phase('wait'):
+                wait_for_conditions(
+                    conditions, self.get_resource, timeout=timeout)
+        else:
+            sleep_time = cmd.get('sleep', 10)
+            if sleep_time is None:
+                sleep_time = 10
+            print('#####Slepping for %s seconds after' % (sleep_time, ))
+            with phase('sleep'):
+                time.sleep(sleep_time)
+        return return_code
+
+    def run_deploy_commmands(self, cmds, wait_ready: bool = False,
+                             timeout: float = 600):
+        """
+        Deploy comands.
+
+        Args:
+            cmds (list): List of deploy commands.
+        Kwargs:
+            wait_ready (bool): Wait readiness conditions instead of sleeping.
+            timeout (float): Timeout for the readiness conditions.
+        """
         for c in cmds:
-            if c['command'] == 'create':
-                raise Exception('Not implemented')
-            elif c['command'] == 'run':
-                sleep_time = c.get('sleep', 10)
-                if sleep_time is None:
-                    sleep_time = 10
-                print('###Running file: ' + c['file'])
-                print('#####Slepping for %s seconds after' % (sleep_time, ))
-                with open(c['file'], 'r') as file:
-                    file_cmd = file.read()
-                # Colocando o shebangs no inicio do arquivo
-                with open(c['file'], 'w') as file:
-                    file.write(
-                        "#!/bin/sh\n" + file_cmd + "\nsleep %s" % (
-                            sleep_time, ))
-                subprocess.call(c['file'])
-            else:
-                raise Exception('Command not implemented: %s' % (
-                    c['command'],))
+            self.run_deploy_command(c, wait_ready=wait_ready, timeout=timeout)
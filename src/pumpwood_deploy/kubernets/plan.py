@@ -0,0 +1,190 @@
+"""Deploy plan using server-side dry-run."""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pumpwood_deploy.manifests.hashing import (
+    CONTENT_HASH_ANNOTATION, document_key)
+from pumpwood_deploy.manifests.labels import STACK_LABEL, label_value
+
+
+VOLATILE_METADATA = [
+    'resourceVersion', 'generation', 'managedFields', 'uid',
+    'creationTimestamp', 'selfLink']
+"""Metadata set by the API server, not considered on diffs."""
+
+
+def object_changes(live: dict, desired: dict, max_depth: int = 3) -> list:
+    """
+    Return the fields that differ between two objects.
+
+    Status and server managed metadata are ignored.
+
+    Args:
+        live (dict): Object on the cluster.
+        desired (dict): Object returned by the server-side dry-run.
+    Kwargs:
+        max_depth (int): Depth of the reported field paths, differences
+            deeper than it are reported on the parent field.
+    Returns:
+        list: Sorted dotted paths of the changed fields (spec.template,
+            data.key.json).
+    """
+    def clean(obj):
+        obj = dict(obj or {})
+        obj.pop('status', None)
+        metadata = dict(obj.get('metadata') or {})
+        for key in VOLATILE_METADATA:
+            metadata.pop(key, None)
+        obj['metadata'] = metadata
+        return obj
+
+    def diff(a, b, path, depth):
+        if a == b:
+            return []
+        if not isinstance(a, dict) or not isinstance(b, dict) or \
+                depth == max_depth:
+            return [path]
+        changes = []
+        for key in sorted(set(a.keys()) | set(b.keys())):
+            changes.extend(diff(
+                a.get(key), b.get(key),
+                key if path == '' else path + '.' + key, depth + 1))
+        return changes
+
+    return diff(clean(live), clean(desired), '', 0)
+
+
+class DeployPlanner:
+    """
+    Plan the changes of a deploy without applying them.
+
+    Each document is applied with server-side dry-run and compared with the
+    object on the cluster, all requests are made concurrently. Objects on
+    the cluster with the content hash annotation of pumpwood deploys and
+    the stack label of the planned stack that are not on the rendered
+    documents are reported as orphaned, objects of other stacks (also
+    cluster-scoped ones as PersistentVolumes) and canaries are not.
+    """
+
+    def __init__(self, kube_client, max_workers: int = 20):
+        """
+        __init__.
+
+        Args:
+            kube_client (Kubernets): Kubernets client.
+        Kwargs:
+            max_workers (int): Maximum number of concurrent requests.
+        """
+        self.kube_client = kube_client
+        self.max_workers = max_workers
+
+    def _plan_document(self, document: dict, resource: str):
+        key = document_key(document)
+        start = time.time()
+        result = {
+            'key': key, 'kind': document.get('kind'),
+            'name': document.get('metadata', {}).get('name'),
+            'resource': resource, 'action': None, 'changes': [],
+            'latency': None, 'error': None}
+        try:
+            live = self.kube_client.get_resource(
+                document['kind'].lower(), result['name'])
+            desired = self.kube_client.dry_run_apply(document)
+            if live is None:
+                result['action'] = 'create'
+            else:
+                result['changes'] = object_changes(live, desired)
+                result['action'] = (
+                    'update' if result['changes'] else 'unchanged')
+        except Exception as e:
+            result['action'] = 'error'
+            result['error'] = str(e)
+        result['latency'] = time.time() - start
+        return result
+
+    def _orphaned(self, kind: str, keys: set, stack: str):
+        start = time.time()
+        orphaned = []
+        selector = '%s=%s' % (STACK_LABEL, label_value(stack))
+        objects = self.kube_client.list_resources(
+            kind.lower(), label_selector=selector)
+        for obj in objects:
+            metadata = obj.get('metadata', {})
+            annotations = metadata.get('annotations') or {}
+            if CONTENT_HASH_ANNOTATION not in annotations:
+                continue
+            if kind == 'Deployment' and \
+                    metadata.get('name', '').endswith('-canary'):
+                continue
+            key = kind + '/' + metadata.get('name')
+            if key not in keys:
+                orphaned.append({
+                    'key': key, 'kind': kind, 'name': metadata.get('name'),
+                    'resource': None, 'action': 'orphaned', 'changes': [],
+                    'latency': time.time() - start, 'error': None})
+        return orphaned
+
+    def plan(self, documents: list, stack: str) -> dict:
+        """
+        Plan the deploy of manifest documents.
+
+        Args:
+            documents (list): List of tuples with the parsed manifest
+                document and the name of the resource that rendered it.
+            stack (str): Name of the stack, value of its STACK_LABEL, only
+                its objects are reported as orphaned.
+        Returns:
+            dict: `resources` with `key`, `kind`, `name`, `resource`,
+                `action` (create, update, unchanged, orphaned or error),
+                `changes` (changed fields of updates), `latency` and
+                `error`; `summary` with the number of resources by action
+                and `wall_time`.
+        """
+        self.kube_client.ensure_context()
+        start = time.time()
+        keys = set([document_key(doc) for doc, _ in documents])
+        kinds = sorted(set([doc['kind'] for doc, _ in documents]))
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            document_futures = [
+                pool.submit(self._plan_document, doc, resource)
+                for doc, resource in documents]
+            orphaned_futures = [
+                pool.submit(self._orphaned, kind, keys, stack)
+                for kind in kinds]
+            results = [f.result() for f in document_futures]
+            for f in orphaned_futures:
+                results.extend(f.result())
+
+        summary = {}
+        for r in results:
+            summary[r['action']] = summary.get(r['action'], 0) + 1
+        return {
+            'resources': results, 'summary': summary,
+            'wall_time': time.time() - start}
+
+
+def plan_summary(plan: dict) -> str:
+    """
+    Text summary of a plan.
+
+    Args:
+        plan (dict): Plan returned by DeployPlanner.plan.
+    Returns:
+        str: One line for each resource that is not unchanged and the
+            number of resources by action.
+    """
+    lines = ['###Deploy plan: %s [%.1fs]' % (
+        ', '.join([
+            '%s %s' % (n, action)
+            for action, n in sorted(plan['summary'].items())]),
+        plan['wall_time'])]
+    for r in plan['resources']:
+        if r['action'] == 'unchanged':
+            continue
+        detail = ''
+        if r['changes']:
+            detail = ' (' + ', '.join(r['changes']) + ')'
+        elif r['error']:
+            detail = ' (' + r['error'] + ')'
+        lines.append('  %-9s %6.3fs %s%s' % (
+            r['action'], r['latency'], r['key'], detail))
+    return '\n'.join(lines)
@@ -0,0 +1,130 @@
+"""Prune resources of a stack that are not rendered anymore."""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pumpwood_deploy.manifests.hashing import document_key
+from pumpwood_deploy.manifests.labels import (
+    STACK_LABEL, MICROSERVICE_LABEL, COMPONENT_LABEL, label_value)
+from pumpwood_deploy.kubernets.rollout import is_canary
+
+
+PRUNE_KINDS = ['Secret', 'ConfigMap', 'Deployment', 'Service']
+"""Kinds pruned by default.
+
+PersistentVolumeClaim and PersistentVolume are not pruned unless asked,
+deleting them may delete the disks of the databases.
+"""
+
+
+class ResourcePruner:
+    """
+    Delete resources labeled with a stack that were not rendered.
+
+    Objects of each kind are listed in bulk with the stack label selector,
+    one request per kind, concurrently. Objects whose Kind/name is not on
+    the rendered documents are pruned. Canary Deployments are never
+    pruned, they are removed by the canary rollout.
+    """
+
+    def __init__(self, kube_client, max_workers: int = 10):
+        """
+        __init__.
+
+        Args:
+            kube_client (Kubernets): Kubernets client.
+        Kwargs:
+            max_workers (int): Maximum number of concurrent requests.
+        """
+        self.kube_client = kube_client
+        self.max_workers = max_workers
+
+    def _list_kind(self, kind: str, stack: str):
+        selector = '%s=%s' % (STACK_LABEL, label_value(stack))
+        return self.kube_client.list_resources(
+            kind.lower(), label_selector=selector)
+
+    def _delete(self, resource: dict, dry_run: bool):
+        start = time.time()
+        try:
+            if not dry_run:
+                self.kube_client.delete_resource(
+                    resource['kind'].lower(), resource['name'])
+            resource['action'] = 'would prune' if dry_run else 'pruned'
+        except Exception as e:
+            resource['action'] = 'error'
+            resource['error'] = str(e)
+        resource['latency'] = time.time() - start
+        return resource
+
+    def prune(self, documents: list, stack: str, kinds: list = None,
+              dry_run: bool = True) -> dict:
+        """
+        Prune the stack resources that are not on the rendered documents.
+
+        Args:
+            documents (list): Parsed manifest documents rendered for the
+                stack.
+            stack (str): Name of the stack, value of its STACK_LABEL.
+        Kwargs:
+            kinds (list): Kinds to prune, default PRUNE_KINDS.
+            dry_run (bool): Only report the resources that would be pruned.
+        Returns:
+            dict: `resources` with `key`, `kind`, `name`, `microservice`,
+                `component`, `action` (would prune, pruned or error),
+                `latency` and `error`; `kept` number of labeled resources
+                still rendered, `dry_run` and `wall_time`.
+        """
+        self.kube_client.ensure_context()
+        start = time.time()
+        kinds = kinds or PRUNE_KINDS
+        keys = set([document_key(doc) for doc in documents])
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            listed = list(pool.map(
+                lambda kind: self._list_kind(kind, stack), kinds))
+
+            kept = 0
+            to_prune = []
+            for kind, objects in zip(kinds, listed):
+                for obj in objects:
+                    metadata = obj.get('metadata', {})
+                    labels = metadata.get('labels') or {}
+                    key = kind + '/' + metadata.get('name')
+                    if key in keys:
+                        kept = kept + 1
+                        continue
+                    if kind == 'Deployment' and is_canary(obj):
+                        continue
+                    to_prune.append({
+                        'key': key, 'kind': kind,
+                        'name': metadata.get('name'),
+                        'microservice': labels.get(MICROSERVICE_LABEL),
+                        'component': labels.get(COMPONENT_LABEL),
+                        'action': None, 'latency': None, 'error': None})
+            resources = list(pool.map(
+                lambda r: self._delete(r, dry_run), to_prune))
+
+        return {
+            'resources': resources, 'kept': kept, 'dry_run': dry_run,
+            'wall_time': time.time() - start}
+
+
+def prune_summary(prune_report: dict) -> str:
+    """
+    Text summary of a prune.
+
+    Args:
+        prune_report (dict): Report returned by ResourcePruner.prune.
+    Returns:
+        str: One line for each pruned resource.
+    """
+    resources = prune_report['resources']
+    lines = ['###Prune%s: %s to prune, %s kept [%.1fs]' % (
+        ' (dry-run)' if prune_report['dry_run'] else '', len(resources),
+        prune_report['kept'], prune_report['wall_time'])]
+    for r in resources:
+        detail = ''
+        if r['error']:
+            detail = ' (' + r['error'] + ')'
+        lines.append('  %-11s %s [%s/%s]%s' % (
+            r['action'], r['key'], r['microservice'], r['component'],
+            detail))
+    return '\n'.join(lines)
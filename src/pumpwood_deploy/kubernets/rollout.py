@@ -0,0 +1,331 @@
+"""Health-gated canary rollout of app Deployments."""
+import json
+import math
+import time
+import requests
+from pumpwood_deploy.kubernets.wait import (
+    DeploymentRollout, wait_for_conditions)
+from pumpwood_deploy.manifests.model import load_documents
+
+
+CANARY_LABEL = 'pumpwood.io/track'
+"""Label added to canary pods and to the selector of canary Deployments."""
+
+
+class CanaryFailedError(Exception):
+    """Canary did not pass the health gate and was rolled back."""
+
+    def __init__(self, message: str, report: dict = None):
+        """
+        __init__.
+
+        Args:
+            message (str): Error message.
+        Kwargs:
+            report (dict): Canary report, see CanaryRollout.run_canary.
+        """
+        super(CanaryFailedError, self).__init__(message)
+        self.report = report or {}
+
+
+def percentile(values: list, q: float) -> float:
+    """
+    Return the nearest-rank percentile of a list of values.
+
+    Args:
+        values (list): Values.
+        q (float): Percentile between 0 and 100.
+    Returns:
+        float: Percentile, None if values is empty.
+    """
+    if len(values) == 0:
+        return None
+    ordered = sorted(values)
+    rank = int(math.ceil(q / 100.0 * len(ordered)))
+    return ordered[max(rank, 1) - 1]
+
+
+class HealthGate:
+    """Latency and error thresholds of health-check probes."""
+
+    def __init__(self, p95_threshold: float = 1.0,
+                 max_error_rate: float = 0.0, n_requests: int = 20,
+                 interval: float = 0.2, warmup: int = 2):
+        """
+        __init__.
+
+        Kwargs:
+            p95_threshold (float): Maximum p95 latency in seconds of the
+                successful probes.
+            max_error_rate (float): Maximum fraction of failed probes (non
+                2xx status or request errors).
+            n_requests (int): Number of probes.
+            interval (float): Seconds between probes.
+            warmup (int): Probes made before measuring, to not account
+                lazy initialization of the app.
+        """
+        self.p95_threshold = p95_threshold
+        self.max_error_rate = max_error_rate
+        self.n_requests = n_requests
+        self.interval = interval
+        self.warmup = warmup
+
+    def measure(self, probe_function) -> dict:
+        """
+        Probe and check the results against the thresholds.
+
+        Args:
+            probe_function (callable): Function without arguments returning
+                the status code of a health-check request.
+        Returns:
+            dict: `passed`, `p50`, `p95`, `error_rate`, `n_requests` and
+                `errors` (up to 5 error messages).
+        """
+        for i in range(self.warmup):
+            try:
+                probe_function()
+            except Exception:
+                pass
+
+        latencies = []
+        errors = []
+        for i in range(self.n_requests):
+            start = time.time()
+            try:
+                status_code = probe_function()
+                if 200 <= status_code < 300:
+                    latencies.append(time.time() - start)
+                else:
+                    errors.append('Status code: %s' % (status_code, ))
+            except Exception as e:
+                errors.append(str(e))
+            if i != self.n_requests - 1:
+                time.sleep(self.interval)
+
+        error_rate = len(errors) / float(max(self.n_requests, 1))
+        p95 = percentile(latencies, 95)
+        passed = error_rate <= self.max_error_rate and (
+            p95 is not None and p95 <= self.p95_threshold)
+        return {
+            'passed': passed, 'p50': percentile(latencies, 50), 'p95': p95,
+            'error_rate': error_rate, 'n_requests': self.n_requests,
+            'errors': errors[:5]}
+
+
+def health_check(document: dict) -> tuple:
+    """
+    Return the readiness probe http path and port of a Deployment.
+
+    Args:
+        document (dict): Deployment manifest.
+    Returns:
+        tuple: Path and port of the first container with an httpGet
+            readinessProbe, None if there is none.
+    """
+    containers = document.get('spec', {}).get('template', {}).get(
+        'spec', {}).get('containers') or []
+    for c in containers:
+        http_get = (c.get('readinessProbe') or {}).get('httpGet')
+        if http_get and http_get.get('path'):
+            return http_get['path'], http_get.get('port')
+    return None
+
+
+def canary_document(document: dict) -> dict:
+    """
+    Create the canary of a Deployment.
+
+    The canary has one replica, its name ends with `-canary` and it keeps
+    the pod labels of the Deployment, so its Services send part of the
+    traffic to it. The CANARY_LABEL is added to its pods and selector only,
+    so canary pods are told apart from the stable ones without changing
+    the selector of the Deployment, which is immutable. Canary pods are
+    owned by the canary ReplicaSet, the Deployment does not adopt them.
+
+    Args:
+        document (dict): Deployment manifest.
+    Returns:
+        dict: Canary Deployment manifest.
+    """
+    canary = json.loads(json.dumps(document))
+    canary['metadata']['name'] = document['metadata']['name'] + '-canary'
+    spec = canary.setdefault('spec', {})
+    spec['replicas'] = 1
+    spec.setdefault('selector', {}).setdefault(
+        'matchLabels', {})[CANARY_LABEL] = 'canary'
+    spec.setdefault('template', {}).setdefault('metadata', {}).setdefault(
+        'labels', {})[CANARY_LABEL] = 'canary'
+    return canary
+
+
+def is_canary(document: dict) -> bool:
+    """
+    Check if a Deployment is a canary created by canary_document.
+
+    The CANARY_LABEL is set on the pod template and selector of canaries,
+    not on their metadata, which is copied from the stable Deployment.
+
+    Args:
+        document (dict): Deployment manifest or object from the cluster.
+    Returns:
+        bool: True if the pods are labeled as canary or the name ends with
+            `-canary`.
+    """
+    labels = document.get('spec', {}).get('template', {}).get(
+        'metadata', {}).get('labels') or {}
+    if labels.get(CANARY_LABEL) == 'canary':
+        return True
+    return document.get('metadata', {}).get('name', '').endswith('-canary')
+
+
+class CanaryRollout:
+    """
+    Progressive rollout of app Deployments gated by health-checks.
+
+    Before a manifest with app Deployments (Deployments with an httpGet
+    readinessProbe, as pumpwood-auth-app or pumpwood-datalake-app) is
+    applied, a one replica canary of each Deployment is deployed and its
+    health-check path is probed through the API server proxy, and the
+    gateway health url if set. If all probes pass the HealthGate the
+    manifest is applied and the canaries removed, if not the canaries are
+    removed and the manifest is not applied, leaving the current version
+    serving.
+    """
+
+    def __init__(self, kube_client, gate: HealthGate = None,
+                 gateway_url: str = None, timeout: float = 300):
+        """
+        __init__.
+
+        Args:
+            kube_client (Kubernets): Kubernets client.
+        Kwargs:
+            gate (HealthGate): Thresholds of the probes, default
+                HealthGate().
+            gateway_url (str): Full url of the gateway health check, probed
+                with the canaries running, None to not probe.
+            timeout (float): Timeout of the canary rollout.
+        """
+        self.kube_client = kube_client
+        self.gate = gate or HealthGate()
+        self.gateway_url = gateway_url
+        self.timeout = timeout
+
+    @staticmethod
+    def app_deployments(content: str) -> list:
+        """Return the Deployments of a manifest with http health-checks."""
+        return [
+            doc for doc in load_documents(content)
+            if doc.get('kind') == 'Deployment' and
+            health_check(doc) is not None]
+
+    def _canary_pod(self, canary: dict) -> dict:
+        match_labels = canary['spec']['selector']['matchLabels']
+        selector = ','.join([
+            '%s=%s' % (k, v) for k, v in sorted(match_labels.items())])
+        pods = [
+            p for p in self.kube_client.list_resources(
+                'pods', label_selector=selector)
+            if p.get('status', {}).get('phase') == 'Running' and
+            p['metadata'].get('deletionTimestamp') is None]
+        if len(pods) == 0:
+            raise Exception(
+                'No running pod for canary ' + canary['metadata']['name'])
+        return pods[0]
+
+    def run_canary(self, document: dict) -> dict:
+        """
+        Deploy the canary of a Deployment and probe its health.
+
+        The canary is kept running, it must be removed with
+        `remove_canary`.
+
+        Args:
+            document (dict): Deployment manifest.
+        Returns:
+            dict: `deployment`, `canary`, `passed`, `pod` and `error` and
+                the probes results (see HealthGate.measure) on `health` and
+                `gateway`.
+        """
+        canary = canary_document(document)
+        canary_name = canary['metadata']['name']
+        path, port = health_check(document)
+        report = {
+            'deployment': document['metadata']['name'],
+            'canary': canary_name, 'passed': False, 'pod': None,
+            'health': None, 'gateway': None, 'error': None}
+        try:
+            print('#####Deploying canary: ' + canary_name)
+            self.kube_client.apply_document(canary)
+            wait_for_conditions(
+                [DeploymentRollout(canary_name)],
+                self.kube_client.get_resource, timeout=self.timeout)
+            pod_name = self._canary_pod(canary)['metadata']['name']
+            report['pod'] = pod_name
+
+            def probe():
+                return self.kube_client.proxy_get(
+                    'pods', pod_name, path, port=port)[0]
+            report['health'] = self.gate.measure(probe)
+            report['passed'] = report['health']['passed']
+
+            if self.gateway_url is not None:
+                def probe_gateway():
+                    return requests.get(
+                        self.gateway_url, timeout=10).status_code
+                report['gateway'] = self.gate.measure(probe_gateway)
+                report['passed'] = \
+                    report['passed'] and report['gateway']['passed']
+        except Exception as e:
+            report['error'] = str(e)
+
+        for key in ['health', 'gateway']:
+            if report[key] is not None:
+                print('#####Canary %s %s: p95 %s, errors %.0f%%' % (
+                    canary_name, key,
+                    '-' if report[key]['p95'] is None else
+                    '%.3fs' % report[key]['p95'],
+                    100 * report[key]['error_rate']))
+        return report
+
+    def remove_canary(self, document: dict):
+        """Delete the canary of a Deployment."""
+        name = document['metadata']['name'] + '-canary'
+        print('#####Removing canary: ' + name)
+        self.kube_client.delete_resource('deployment', name)
+
+    def rollout(self, content: str, apply_function) -> list:
+        """
+        Rollout a manifest gated by the health of canaries.
+
+        Args:
+            content (str): YAML manifest to be deployed.
+            apply_function (callable): Function without arguments that
+                applies the manifest, called only if all canaries pass.
+        Returns:
+            list: Canary reports.
+        Raises:
+            CanaryFailedError: If a canary did not pass the health gate,
+                the manifest is not applied.
+        """
+        documents = self.app_deployments(content)
+        reports = []
+        try:
+            for doc in documents:
+                report = self.run_canary(doc)
+                reports.append(report)
+                if not report['passed']:
+                    raise CanaryFailedError(
+                        'Canary %s failed health gate, rolled back: %s' % (
+                            report['canary'],
+                            report['error'] or json.dumps(
+                                dict([(k, report[k]) for k in [
+                                    'health', 'gateway']]))),
+                        report=report)
+            return_code = apply_function()
+        finally:
+            for doc in documents:
+                self.remove_canary(doc)
+        if return_code not in [0, None]:
+            raise Exception('Return code: %s' % (return_code, ))
+        return reports
@@ -0,0 +1,209 @@
+"""Timing instrumentation of deploy steps."""
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+_current = threading.local()
+
+
+class StepTiming:
+    """Timing of one deploy step."""
+
+    def __init__(self, key: str, name: str = None, step_type: str = None):
+        """
+        __init__.
+
+        Args:
+            key (str): Unique key of the step.
+        Kwargs:
+            name (str): Name of the resource deployed by the step.
+            step_type (str): Type of the resource.
+        """
+        self.key = key
+        self.name = name
+        self.step_type = step_type
+        self.start = None
+        self.end = None
+        self.status = None
+        self.phases = {}
+        self.counters = {}
+
+    @property
+    def duration(self):
+        """Time in seconds spent on the step."""
+        if self.start is None or self.end is None:
+            return 0.0
+        return self.end - self.start
+
+    def add_phase(self, phase_name: str, seconds: float):
+        """Add time spent on a phase (subprocess, api, wait, sleep)."""
+        self.phases[phase_name] = self.phases.get(phase_name, 0.0) + seconds
+
+    def count(self, counter_name: str, n: int = 1):
+        """Increment a counter of the step (retries, polls)."""
+        self.counters[counter_name] = self.counters.get(counter_name, 0) + n
+
+    def to_dict(self, origin: float = 0.0):
+        """
+        Return the step timing as a dictionary.
+
+        Kwargs:
+            origin (float): Time subtracted from start and end.
+        """
+        return {
+            'key': self.key, 'name': self.name, 'type': self.step_type,
+            'status': self.status,
+            'start': None if self.start is None else self.start - origin,
+            'end': None if self.end is None else self.end - origin,
+            'duration': self.duration,
+            'phases': self.phases, 'counters': self.counters}
+
+
+@contextmanager
+def phase(phase_name: str):
+    """
+    Measure the time of a phase of the current step.
+
+    The step is the one started with DeployTimeline.step on the current
+    thread. Nested phases are accounted only on the outer phase, so waiting
+    time that polls the cluster is not counted again as api or subprocess
+    time. Outside a step nothing is recorded.
+
+    Args:
+        phase_name (str): Name of the phase (subprocess, api, wait, sleep).
+    """
+    step = getattr(_current, 'step', None)
+    depth = getattr(_current, 'depth', 0)
+    _current.depth = depth + 1
+    start = time.time()
+    try:
+        yield
+    finally:
+        _current.depth = depth
+        if step is not None and depth == 0:
+            step.add_phase(phase_name, time.time() - start)
+
+
+def count(counter_name: str, n: int = 1):
+    """Increment a counter of the current step, if any."""
+    step = getattr(_current, 'step', None)
+    if step is not None:
+        step.count(counter_name, n)
+
+
+class DeployTimeline:
+    """Timeline of all steps of a deploy."""
+
+    def __init__(self):
+        """__init__."""
+        self.start = time.time()
+        self.end = None
+        self.steps = []
+        self.critical_path = []
+        self.critical_path_time = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def step(self, key: str, name: str = None, step_type: str = None):
+        """
+        Time a deploy step run on the current thread.
+
+        Args:
+            key (str): Unique key of the step.
+        Kwargs:
+            name (str): Name of the resource.
+            step_type (str): Type of the resource.
+        Yields:
+            StepTiming: Timing of the step, set its `status`.
+        """
+        step = StepTiming(key=key, name=name, step_type=step_type)
+        with self._lock:
+            self.steps.append(step)
+        previous = getattr(_current, 'step', None)
+        _current.step = step
+        step.start = time.time()
+        try:
+            yield step
+        except Exception:
+            step.status = 'failed'
+            raise
+        finally:
+            step.end = time.time()
+            _current.step = previous
+
+    def finish(self, critical_path: list = None,
+               critical_path_time: float = None):
+        """
+        Finish the timeline.
+
+        Kwargs:
+            critical_path (list): Keys of the steps on the critical path, if
+                None steps are considered sequential.
+            critical_path_time (float): Time of the critical path.
+        """
+        self.end = time.time()
+        if critical_path is None:
+            critical_path = [s.key for s in self.steps]
+            critical_path_time = sum([s.duration for s in self.steps])
+        self.critical_path = critical_path
+        self.critical_path_time = critical_path_time
+
+    def to_dict(self):
+        """Return the timeline as a JSON serializable dictionary."""
+        phases = {}
+        for s in self.steps:
+            for k, v in s.phases.items():
+                phases[k] = phases.get(k, 0.0) + v
+        end = self.end or time.time()
+        return {
+            'wall_time': end - self.start,
+            'critical_path_time': self.critical_path_time,
+            'critical_path': self.critical_path,
+            'phases_total': phases,
+            'steps': [s.to_dict(origin=self.start) for s in self.steps]}
+
+    def save(self, path: str):
+        """Write the timeline as JSON."""
+        dir_name = os.path.dirname(path)
+        if dir_name and not os.path.exists(dir_name):
+            os.makedirs(dir_name)
+        with open(path, 'w') as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+    def summary(self, n_slowest: int = 10) -> str:
+        """
+        Text summary with the slowest steps and critical path.
+
+        Kwargs:
+            n_slowest (int): Number of slowest steps to list.
+        Returns:
+            str: Summary text.
+        """
+        data = self.to_dict()
+        lines = ['###Deploy timeline: wall time %.1fs' % (data['wall_time'], )]
+        lines.append('#####Total time by phase:')
+        for k, v in sorted(data['phases_total'].items(),
+                           key=lambda x: -x[1]):
+            lines.append('  %-12s %8.1fs' % (k, v))
+
+        lines.append('#####Slowest steps:')
+        slowest = sorted(self.steps, key=lambda s: -s.duration)[:n_slowest]
+        for s in slowest:
+            phases = ', '.join([
+                '%s %.1fs' % (k, v) for k, v in sorted(s.phases.items())])
+            counters = ', '.join([
+                '%s %s' % (k, v) for k, v in sorted(s.counters.items())])
+            lines.append('  %8.1fs %-8s %s [%s]%s' % (
+                s.duration, s.status, s.key, phases,
+                ' (' + counters + ')' if counters else ''))
+
+        if data['critical_path_time'] is not None:
+            lines.append('#####Critical path [%.1fs]:' % (
+                data['critical_path_time'], ))
+            durations = dict([(s.key, s.duration) for s in self.steps])
+            for key in self.critical_path:
+                lines.append('  %8.1fs %s' % (durations.get(key, 0.0), key))
+        return '\n'.join(lines)
@@ -0,0 +1,274 @@
+"""Readiness conditions for deployed resources."""
+import time
+import asyncio
+from pumpwood_deploy.kubernets.timeline import count
+from pumpwood_deploy.manifests.model import load_documents
+
+
+class WaitTimeoutError(Exception):
+    """Raised when a resource does not become ready before timeout."""
+
+    pass
+
+
+class WaitCondition:
+    """
+    Base readiness condition.
+
+    Subclasses set the kubectl `kind` of the resource to be checked and
+    implement `is_ready` over the resource returned by the cluster.
+    """
+
+    kind = None
+
+    def __init__(self, name: str):
+        """
+        __init__.
+
+        Args:
+            name (str): Name of the resource on the cluster.
+        """
+        self.name = name
+
+    def is_ready(self, obj: dict) -> bool:
+        """
+        Check if resource is ready.
+
+        Args:
+            obj (dict): Resource returned by the cluster, None if it does
+                not exist.
+        Returns:
+            bool: True if resource is ready.
+        """
+        raise NotImplementedError()
+
+    def __repr__(self):
+        """__repr__."""
+        return '{cls}({kind}/{name})'.format(
+            cls=self.__class__.__name__, kind=self.kind, name=self.name)
+
+
+class SecretExists(WaitCondition):
+    """Secret is ready when it exists."""
+
+    kind = 'secret'
+
+    def is_ready(self, obj: dict) -> bool:
+        """Secret exists."""
+        return obj is not None
+
+
+class ConfigMapExists(WaitCondition):
+    """ConfigMap is ready when it exists."""
+
+    kind = 'configmap'
+
+    def is_ready(self, obj: dict) -> bool:
+        """ConfigMap exists."""
+        return obj is not None
+
+
+class PVCBound(WaitCondition):
+    """PersistentVolumeClaim is ready when bound to a volume."""
+
+    kind = 'persistentvolumeclaim'
+
+    def is_ready(self, obj: dict) -> bool:
+        """PVC has phase Bound."""
+        if obj is None:
+            return False
+        return obj.get('status', {}).get('phase') == 'Bound'
+
+
+class DeploymentRollout(WaitCondition):
+    """
+    Deployment is ready when the rollout is complete.
+
+    Uses the same checks as `kubectl rollout status`: the controller has
+    observed the last generation and all replicas are updated and available.
+    """
+
+    kind = 'deployment'
+
+    def is_ready(self, obj: dict) -> bool:
+        """Deployment rollout is complete."""
+        if obj is None:
+            return False
+        metadata = obj.get('metadata', {})
+        spec = obj.get('spec', {})
+        status = obj.get('status', {})
+
+        generation = metadata.get('generation', 0)
+        if status.get('observedGeneration', 0) < generation:
+            return False
+        replicas = spec.get('replicas', 1)
+        if status.get('updatedReplicas', 0) < replicas:
+            return False
+        if status.get('replicas', 0) > status.get('updatedReplicas', 0):
+            return False
+        return status.get('availableReplicas', 0) >= replicas
+
+
+class ServiceExists(WaitCondition):
+    """
+    Service is ready when it exists.
+
+    Services are deployed before the Deployments of their pods, so their
+    endpoints are not waited.
+    """
+
+    kind = 'service'
+
+    def is_ready(self, obj: dict) -> bool:
+        """Service exists."""
+        return obj is not None
+
+
+def conditions_from_manifest(content: str) -> list:
+    """
+    Create the readiness conditions of a YAML manifest.
+
+    Secrets and ConfigMaps must exist, PersistentVolumeClaims must be bound,
+    Deployments must complete rollout and Services must exist. Other kinds
+    (PersistentVolume) have no conditions.
+
+    Args:
+        content (str): YAML manifest, may have more than one document.
+    Returns:
+        list: List of WaitCondition.
+    """
+    conditions = []
+    for doc in load_documents(content):
+        kind = doc.get('kind')
+        name = doc.get('metadata', {}).get('name')
+        if kind == 'Secret':
+            conditions.append(SecretExists(name))
+        elif kind == 'ConfigMap':
+            conditions.append(ConfigMapExists(name))
+        elif kind == 'PersistentVolumeClaim':
+            conditions.append(PVCBound(name))
+        elif kind == 'Deployment':
+            conditions.append(DeploymentRollout(name))
+        elif kind == 'Service':
+            conditions.append(ServiceExists(name))
+    return conditions
+
+
+def resource_conditions(resource: dict) -> list:
+    """
+    Return the readiness conditions of a resource dict.
+
+    A resource may declare its own conditions with a `wait` key (a list of
+    WaitCondition, empty list or None to not wait). If not declared the
+    conditions are inferred from the resource type and content.
+
+    Args:
+        resource (dict): Resource returned by create_deployment_file.
+    Returns:
+        list: List of WaitCondition.
+    """
+    if 'wait' in resource:
+        return list(resource['wait'] or [])
+
+    if resource['type'] == 'secrets_file':
+        return [SecretExists(resource['name'])]
+    if resource['type'] == 'configmap':
+        return [ConfigMapExists(resource['name'])]
+    return conditions_from_manifest(resource['content'])
+
+
+def wait_for_conditions(conditions: list, get_function,
+                        timeout: float = 600, initial_delay: float = 0.5,
+                        max_delay: float = 10, backoff: float = 2):
+    """
+    Poll the cluster until all conditions are ready.
+
+    Polling interval starts at `initial_delay` and is multiplied by `backoff`
+    after each not ready check, up to `max_delay`.
+
+    Args:
+        conditions (list): List of WaitCondition.
+        get_function (callable): Function receiving kind and name, returning
+            the resource as a dict or None if it does not exist.
+    Kwargs:
+        timeout (float): Maximum time in seconds to wait.
+        initial_delay (float): First polling interval.
+        max_delay (float): Maximum polling interval.
+        backoff (float): Multiplier of the polling interval.
+    Returns:
+        float: Time in seconds waited.
+    Raises:
+        WaitTimeoutError: If conditions are not ready before timeout.
+    """
+    start = time.time()
+    pending = list(conditions)
+    delay = initial_delay
+    while True:
+        count('polls', len(pending))
+        pending = [
+            c for c in pending
+            if not c.is_ready(get_function(c.kind, c.name))]
+        if len(pending) == 0:
+            return time.time() - start
+
+        elapsed = time.time() - start
+        if timeout <= elapsed:
+            raise WaitTimeoutError(
+                'Resources not ready after %.0fs: %s' % (
+                    elapsed, ', '.join([str(c) for c in pending])))
+        count('retries')
+        time.sleep(min(delay, timeout - elapsed))
+        delay = min(delay * backoff, max_delay)
+
+
+async def async_wait_for_conditions(conditions: list, get_function,
+                                    executor=None, timeout: float = 600,
+                                    initial_delay: float = 0.5,
+                                    max_delay: float = 10,
+                                    backoff: float = 2):
+    """
+    Poll the cluster until all conditions are ready, on an event loop.
+
+    Same polling as wait_for_conditions, but the intervals are awaited, so
+    no thread is held while waiting. Only the reads of the resources run on
+    `executor`.
+
+    Args:
+        conditions (list): List of WaitCondition.
+        get_function (callable): Blocking function receiving kind and name,
+            returning the resource as a dict or None if it does not exist.
+    Kwargs:
+        executor (concurrent.futures.Executor): Executor of the reads,
+            default the loop default executor.
+        timeout (float): Maximum time in seconds to wait.
+        initial_delay (float): First polling interval.
+        max_delay (float): Maximum polling interval.
+        backoff (float): Multiplier of the polling interval.
+    Returns:
+        float: Time in seconds waited.
+    Raises:
+        WaitTimeoutError: If conditions are not ready before timeout.
+    """
+    loop = asyncio.get_running_loop()
+    start = time.time()
+    pending = list(conditions)
+    delay = initial_delay
+    while True:
+        count('polls', len(pending))
+        ready = []
+        for c in pending:
+            obj = await loop.run_in_executor(
+                executor, get_function, c.kind, c.name)
+            ready.append(c.is_ready(obj))
+        pending = [c for c, r in zip(pending, ready) if not r]
+        if len(pending) == 0:
+            return time.time() - start
+
+        elapsed = time.time() - start
+        if timeout <= elapsed:
+            raise WaitTimeoutError(
+                'Resources not ready after %.0fs: %s' % (
+                    elapsed, ', '.join([str(c) for c in pending])))
+        count('retries')
+        await asyncio.sleep(min(delay, timeout - elapsed))
+        delay = min(delay * backoff, max_delay)
@@ -0,0 +1,224 @@
+"""
+In-memory render bundle of a deploy.
+
+DeployPumpWood.render returns a RenderBundle with the deploy steps of the
+stack in deploy order, each with its manifest, the kinds and names of its
+resources, its deploy script and the steps it depends on. Nothing is
+written to disk until the bundle is written:
+
+    bundle = deploy.render()
+    for r in bundle.resources():
+        print(r['path'], r['kinds'], r['size'], r['depends_on'])
+    bundle.write('/tmp/outputs')
+
+Paths of the bundle are relative to the output directory, so renders of
+many stacks on the same process do not share any state.
+"""
+import os
+import stat
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pumpwood_deploy.kubernets.executor import DeployGraph
+from pumpwood_deploy.manifests.schema import (
+    SchemaValidator, DEFAULT_KUBERNETES_VERSION)
+
+
+DEPLOY_OUTPUT = 'deploy_output'
+SERVICES_OUTPUT = 'services_output'
+
+
+class RenderBundle:
+    """Ordered deploy steps of a rendered stack."""
+
+    def __init__(self, namespace: str):
+        """
+        __init__.
+
+        Args:
+            namespace (str): Namespace of the deploy, set on the scripts.
+        """
+        self.namespace = namespace
+        self.output_path = None
+        self._steps = {SERVICES_OUTPUT: [], DEPLOY_OUTPUT: []}
+
+    def add_step(self, group: str, name: str, content: str,
+                 script_template: str, manifests: list = None,
+                 script_context: dict = None, **cmd) -> dict:
+        """
+        Add a deploy step to the bundle.
+
+        Steps of each group are numbered in the order they are added, the
+        number is the prefix of their file names.
+
+        Args:
+            group (str): DEPLOY_OUTPUT or SERVICES_OUTPUT.
+            name (str): Name of the step, used on file names.
+            content (str): YAML manifest applied by the step.
+            script_template (str): Template of the deploy script, formatted
+                with `file` (manifest path relative to the script),
+                `namespace` and `script_context`. Scripts start with a
+                shebang, so they are never rewritten before running.
+        Kwargs:
+            manifests (list): Manifest objects of the step, used to set the
+                `kinds` of the step.
+            script_context (dict): Extra variables of the script template.
+            **cmd: Other keys of the deploy command (type, sleep, wait,
+                microservice, key, hash, ...).
+        Returns:
+            dict: Deploy command of the step, see DeployPumpWood.
+                create_deploy_files. `file` is the script path relative to
+                the output directory until the bundle is written.
+        """
+        steps = self._steps[group]
+        file_name = '{counter}__{name}'.format(
+            counter=len(steps), name=name)
+        resource_file = 'resources/' + file_name + '.yml'
+        path = group + '/' + file_name + '.sh'
+        step = dict(cmd)
+        step.update({
+            'command': 'run', 'file': path, 'name': name,
+            'content': content, 'path': path,
+            'resource_path': group + '/' + resource_file,
+            'script': '#!/bin/sh\n' + script_template.format(
+                file=resource_file, namespace=self.namespace,
+                **(script_context or {})),
+            'kinds': [m.kind for m in manifests or []],
+            'depends_on': []})
+        steps.append(step)
+        return step
+
+    @property
+    def service_cmds(self) -> list:
+        """Steps of the services."""
+        return self._steps[SERVICES_OUTPUT]
+
+    @property
+    def microservice_cmds(self) -> list:
+        """Steps of the secrets, volumes and deployments."""
+        return self._steps[DEPLOY_OUTPUT]
+
+    @property
+    def steps(self) -> list:
+        """All steps, services first as on deploy_cluster."""
+        return self.service_cmds + self.microservice_cmds
+
+    def resolve_dependencies(self):
+        """
+        Set `depends_on` of each step with the paths of its dependencies.
+
+        Dependencies follow the deploy graph of deploy_cluster, see
+        DeployGraph.from_deploy_commands.
+        """
+        steps = dict([(s['path'], s) for s in self.steps])
+        graph = DeployGraph.from_deploy_commands([
+            dict(s, file=s['path']) for s in self.steps])
+        for node in graph.nodes.values():
+            steps[node.key]['depends_on'] = list(node.dependencies)
+        return self
+
+    def resources(self) -> list:
+        """
+        Summary of the steps of the bundle.
+
+        Returns:
+            list: Dicts with `path`, `resource_path`, `type`, `name`,
+                `kinds`, `keys` (Kind/name of the resources), `size` (bytes
+                of the manifest) and `depends_on`, in deploy order.
+        """
+        return [{
+            'path': s['path'], 'resource_path': s['resource_path'],
+            'type': s['type'], 'name': s['name'], 'kinds': s['kinds'],
+            'keys': s['key'].split(',') if s.get('key') else [],
+            'size': len(s['content'].encode()),
+            'depends_on': s['depends_on']} for s in self.steps]
+
+    def validate(self, kubernetes_version: str = DEFAULT_KUBERNETES_VERSION,
+                 max_workers: int = None) -> list:
+        """
+        Validate the manifests of all steps against Kubernetes schemas.
+
+        The templates of the steps are validated as the microservices
+        rendered them, before they are parsed, so duplicated fields are
+        found and lines are the ones of the template. Ownership labels and
+        patches are not validated. Templates are validated at the same time
+        on a thread pool, nothing is sent to the cluster, see
+        SchemaValidator.
+
+        Kwargs:
+            kubernetes_version (str): Target Kubernetes minor version.
+            max_workers (int): Number of steps validated at the same time,
+                default the pool default.
+        Returns:
+            list: Validation errors in deploy order, `file` of the errors is
+                the template of the resource (Microservice/resource name),
+                or the `resource_path` of steps without `templates`. Empty
+                if all manifests are valid.
+        """
+        validator = SchemaValidator(kubernetes_version=kubernetes_version)
+        templates = []
+        for s in self.steps:
+            templates.extend(
+                s.get('templates') or [(s['resource_path'], s['content'])])
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = pool.map(
+                validator.validate, [t[1] for t in templates],
+                [t[0] for t in templates])
+            return [error for errors in results for error in errors]
+
+    def files(self) -> list:
+        """
+        Files of the bundle.
+
+        Returns:
+            list: Tuples of path relative to the output directory, content
+                as bytes and if the file is executable.
+        """
+        files = []
+        for s in self.steps:
+            files.append((s['resource_path'], s['content'].encode(), False))
+            files.append((s['path'], s['script'].encode(), True))
+        return files
+
+    def write(self, output_path: str):
+        """
+        Write manifests and deploy scripts on the output directory.
+
+        Previous deploy_output and services_output directories are removed.
+        The `file` of each step is set to the absolute path of its script.
+
+        Args:
+            output_path (str): Output directory.
+        Returns:
+            RenderBundle: self.
+        """
+        output_path = os.path.abspath(output_path)
+        for group in [DEPLOY_OUTPUT, SERVICES_OUTPUT]:
+            group_path = os.path.join(output_path, group)
+            if os.path.exists(group_path):
+                shutil.rmtree(group_path)
+            os.makedirs(os.path.join(group_path, 'resources'))
+
+        print('###Writing %s deploy files on: %s' % (
+            2 * len(self.steps), output_path))
+        for path, content, executable in self.files():
+            file_path = os.path.join(output_path, path)
+            with open(file_path, 'wb') as file:
+                file.write(content)
+            if executable:
+                os.chmod(file_path, stat.S_IRWXU)
+
+        for s in self.steps:
+            s['file'] = os.path.join(output_path, s['path'])
+        self.output_path = output_path
+        return self
+
+    def commands(self) -> dict:
+        """
+        Deploy commands of the bundle.
+
+        Returns:
+            dict: `service_cmds` and `microservice_cmds`.
+        """
+        return {
+            'service_cmds': self.service_cmds,
+            'microservice_cmds': self.microservice_cmds}
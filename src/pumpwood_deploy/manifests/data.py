@@ -0,0 +1,102 @@
+"""Secret and ConfigMap manifests rendered from files."""
+import os
+import base64
+import yaml
+
+
+def secret_manifest(name: str, files: dict) -> str:
+    """
+    Render an Opaque Secret manifest.
+
+    Args:
+        name (str): Name of the secret.
+        files (dict): Secret key to its content as bytes.
+    Returns:
+        str: YAML manifest of the Secret with base64 encoded data.
+    """
+    data = dict([
+        (key, base64.b64encode(value).decode())
+        for key, value in sorted(files.items())])
+    return yaml.safe_dump({
+        'apiVersion': 'v1', 'kind': 'Secret',
+        'metadata': {'name': name}, 'type': 'Opaque',
+        'data': data}, default_flow_style=False, sort_keys=False)
+
+
+def configmap_manifest(name: str, files: dict) -> str:
+    """
+    Render a ConfigMap manifest.
+
+    As `kubectl create configmap --from-file`, UTF-8 content is set on
+    `data` and other content is base64 encoded on `binaryData`.
+
+    Args:
+        name (str): Name of the configmap.
+        files (dict): ConfigMap key to its content as bytes or str.
+    Returns:
+        str: YAML manifest of the ConfigMap.
+    """
+    data = {}
+    binary_data = {}
+    for key, value in sorted(files.items()):
+        if isinstance(value, str):
+            data[key] = value
+            continue
+        try:
+            data[key] = value.decode('utf-8')
+        except UnicodeDecodeError:
+            binary_data[key] = base64.b64encode(value).decode()
+
+    manifest = {
+        'apiVersion': 'v1', 'kind': 'ConfigMap',
+        'metadata': {'name': name}}
+    if data:
+        manifest['data'] = data
+    if binary_data:
+        manifest['binaryData'] = binary_data
+    return yaml.safe_dump(
+        manifest, default_flow_style=False, sort_keys=False)
+
+
+def render_data_resource(resource: dict) -> dict:
+    """
+    Render secrets_file and configmap resources as manifests.
+
+    secrets_file resources become a Secret with the file at `path` under its
+    base name, configmap resources a ConfigMap with `content` or the file at
+    `file_path` under `keyname` or `file_name`, the same keys used by
+    kubectl create. Rendered resources have type `secrets`, so they are
+    applied as any other manifest instead of delete and create. Other
+    resources are returned unchanged.
+
+    Args:
+        resource (dict): Resource dict returned by create_deployment_file.
+    Returns:
+        dict: Resource with manifest `content`, `skip_unchanged` set to
+            True and `source_type` with the original type. The `sleep` and,
+            if declared, `wait` keys of the resource are kept.
+    """
+    if resource['type'] == 'secrets_file':
+        with open(resource['path'], 'rb') as file:
+            files = {os.path.basename(resource['path']): file.read()}
+        content = secret_manifest(resource['name'], files)
+    elif resource['type'] == 'configmap':
+        if 'content' in resource:
+            value = resource['content']
+        else:
+            with open(resource['file_path'], 'rb') as file:
+                value = file.read()
+        keyname = resource.get('keyname') or resource['file_name']
+        content = configmap_manifest(resource['name'], {keyname: value})
+    else:
+        return resource
+
+    rendered = {
+        'type': 'secrets', 'name': resource['name'], 'content': content,
+        'sleep': resource.get('sleep'), 'skip_unchanged': True,
+        'source_type': resource['type']}
+    # Declared conditions (even None, to not wait) must not be replaced by
+    # the ones inferred from the manifest
+    if 'wait' in resource:
+        rendered['wait'] = resource['wait']
+    return rendered
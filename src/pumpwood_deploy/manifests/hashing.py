@@ -0,0 +1,83 @@
+"""Content hashes of rendered manifests."""
+import json
+import hashlib
+from pumpwood_deploy.manifests.model import load_documents, dump_manifests
+
+
+CONTENT_HASH_ANNOTATION = 'pumpwood.io/content-hash'
+
+
+def document_hash(document: dict) -> str:
+    """
+    Return the SHA-256 of a manifest document.
+
+    The document is serialized as JSON with sorted keys, so formatting,
+    comments and key order of the YAML templates do not change the hash. The
+    content hash annotation itself is not considered.
+
+    Args:
+        document (dict): Parsed manifest document.
+    Returns:
+        str: Hex SHA-256 hash.
+    """
+    annotations = document.get('metadata', {}).get('annotations') or {}
+    if CONTENT_HASH_ANNOTATION in annotations:
+        document = json.loads(json.dumps(document))
+        del document['metadata']['annotations'][CONTENT_HASH_ANNOTATION]
+        if len(document['metadata']['annotations']) == 0:
+            del document['metadata']['annotations']
+    normalized = json.dumps(
+        document, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+def content_hash(content) -> str:
+    """
+    Return the SHA-256 of a manifest or raw content.
+
+    Args:
+        content (str|bytes): YAML manifest with one or more documents, or
+            bytes of a file.
+    Returns:
+        str: Hex SHA-256 hash.
+    """
+    if isinstance(content, bytes):
+        return hashlib.sha256(content).hexdigest()
+    hashes = [document_hash(doc) for doc in load_documents(content)]
+    return hashlib.sha256(','.join(hashes).encode()).hexdigest()
+
+
+def document_key(document: dict) -> str:
+    """Return the identity of a document as Kind/name."""
+    return '{kind}/{name}'.format(
+        kind=document.get('kind'),
+        name=document.get('metadata', {}).get('name'))
+
+
+def fingerprint_manifests(resource: dict, manifests: list) -> dict:
+    """
+    Fingerprint a manifest resource from its parsed documents.
+
+    The documents are stamped in memory with their content hash annotation
+    and serialized once as the resource `content`.
+
+    Args:
+        resource (dict): Resource dict.
+        manifests (list): Manifest objects of the resource, changed in
+            place.
+    Returns:
+        dict: Copy of the resource with `key`, `hash`, stamped `content` and
+            `manifests`.
+    """
+    resource = dict(resource)
+    hashes = []
+    for m in manifests:
+        hash_value = document_hash(m.document)
+        hashes.append(hash_value)
+        m.add_annotations({CONTENT_HASH_ANNOTATION: hash_value})
+    resource['key'] = ','.join([m.key for m in manifests])
+    resource['hash'] = hashlib.sha256(','.join(hashes).encode()).hexdigest()
+    resource['content'] = dump_manifests(manifests)
+    resource['manifests'] = manifests
+    return resource
+
@@ -0,0 +1,43 @@
+"""Ownership labels of rendered resources."""
+import re
+
+
+STACK_LABEL = 'pumpwood.io/stack'
+MICROSERVICE_LABEL = 'pumpwood.io/microservice'
+COMPONENT_LABEL = 'pumpwood.io/component'
+
+
+def label_value(value: str) -> str:
+    """
+    Make a string a valid label value.
+
+    Label values have at most 63 characters of alphanumerics, `-`, `_` and
+    `.`, starting and ending with an alphanumeric.
+
+    Args:
+        value (str): Value.
+    Returns:
+        str: Valid label value.
+    """
+    value = re.sub(r'[^A-Za-z0-9._-]', '-', str(value))[:63]
+    return value.strip('-_.')
+
+
+def owner_labels(stack: str, microservice: str, component: str) -> dict:
+    """
+    Return the ownership labels of a resource.
+
+    Args:
+        stack (str): Name of the stack (DeployPumpWood stack_name).
+        microservice (str): Class of the microservice that rendered the
+            resource (PumpwoodModels).
+        component (str): Name of the resource on the microservice
+            (pumpwood_model_app__deploy).
+    Returns:
+        dict: Labels.
+    """
+    return {
+        STACK_LABEL: label_value(stack),
+        MICROSERVICE_LABEL: label_value(microservice),
+        COMPONENT_LABEL: label_value(component)}
+
@@ -0,0 +1,313 @@
+"""
+Manifest object model.
+
+Rendered templates are parsed once into dict trees wrapped by a light class
+for their kind. Cross-cutting changes (labels, annotations, resources,
+affinity) are made in memory on the wrappers and the manifest is
+serialized once at the end:
+
+    manifests = load_manifests(content)
+    for m in manifests:
+        m.add_labels({'team': 'data'})
+        if m.kind == 'Deployment':
+            m.set_resources(requests={'cpu': '100m'})
+    content = dump_manifests(manifests)
+
+YAML is parsed and emitted with libyaml when PyYAML was built with it.
+"""
+import yaml
+
+try:
+    from yaml import CSafeLoader as _Loader, CSafeDumper as _Dumper
+except ImportError:
+    from yaml import SafeLoader as _Loader, SafeDumper as _Dumper
+
+
+def load_documents(content: str) -> list:
+    """
+    Parse the documents of a YAML manifest.
+
+    Args:
+        content (str): YAML manifest, may have more than one document.
+    Returns:
+        list: Parsed documents, empty documents are skipped.
+    """
+    return [doc for doc in yaml.load_all(content, Loader=_Loader) if doc]
+
+
+def dump_documents(documents: list) -> str:
+    """
+    Serialize manifest documents as YAML.
+
+    Args:
+        documents (list): Documents as dicts.
+    Returns:
+        str: YAML manifest, keys keep the order of the documents.
+    """
+    return yaml.dump_all(
+        documents, Dumper=_Dumper, default_flow_style=False,
+        sort_keys=False)
+
+
+class Manifest:
+    """Wrapper of a manifest document of any kind."""
+
+    __slots__ = ('document', )
+
+    def __init__(self, document: dict):
+        """
+        __init__.
+
+        Args:
+            document (dict): Parsed manifest document, changed in place.
+        """
+        self.document = document
+
+    @property
+    def metadata(self) -> dict:
+        """Metadata of the document."""
+        return self.document.setdefault('metadata', {})
+
+    @property
+    def kind(self) -> str:
+        """Kind of the resource."""
+        return self.document.get('kind')
+
+    @property
+    def name(self) -> str:
+        """Name of the resource."""
+        return self.metadata.get('name')
+
+    @property
+    def key(self) -> str:
+        """Identity of the resource as Kind/name."""
+        return '{kind}/{name}'.format(kind=self.kind, name=self.name)
+
+    @property
+    def labels(self) -> dict:
+        """Labels of the resource, created if missing."""
+        metadata = self.metadata
+        if not metadata.get('labels'):
+            metadata['labels'] = {}
+        return metadata['labels']
+
+    @property
+    def annotations(self) -> dict:
+        """Annotations of the resource, created if missing."""
+        metadata = self.metadata
+        if not metadata.get('annotations'):
+            metadata['annotations'] = {}
+        return metadata['annotations']
+
+    def add_labels(self, labels: dict):
+        """Add labels to the resource metadata."""
+        self.labels.update(labels)
+        return self
+
+    def add_annotations(self, annotations: dict):
+        """Add annotations to the resource metadata."""
+        self.annotations.update(annotations)
+        return self
+
+    def __repr__(self):
+        """__repr__."""
+        return '{cls}({key})'.format(
+            cls=self.__class__.__name__, key=self.key)
+
+
+class Deployment(Manifest):
+    """Deployment manifest."""
+
+    __slots__ = ()
+
+    @property
+    def pod_template(self) -> dict:
+        """Pod template of the Deployment."""
+        return self.document.setdefault('spec', {}).setdefault(
+            'template', {})
+
+    @property
+    def pod_spec(self) -> dict:
+        """Pod spec of the Deployment."""
+        return self.pod_template.setdefault('spec', {})
+
+    @property
+    def match_labels(self) -> dict:
+        """Selector match labels of the Deployment."""
+        return self.document.get('spec', {}).get(
+            'selector', {}).get('matchLabels') or {}
+
+    def containers(self, init: bool = False) -> list:
+        """
+        Return the containers of the pod template.
+
+        Kwargs:
+            init (bool): Also return init containers.
+        Returns:
+            list: Container dicts, changes are made on the manifest.
+        """
+        containers = list(self.pod_spec.get('containers') or [])
+        if init:
+            containers = \
+                list(self.pod_spec.get('initContainers') or []) + containers
+        return containers
+
+    def images(self) -> list:
+        """Images of the containers and init containers."""
+        return [c['image'] for c in self.containers(init=True)
+                if c.get('image')]
+
+    def add_pod_labels(self, labels: dict):
+        """
+        Add labels to the pod template.
+
+        Changing pod labels restarts the pods, labels of the selector must
+        not be changed.
+        """
+        metadata = self.pod_template.setdefault('metadata', {})
+        if not metadata.get('labels'):
+            metadata['labels'] = {}
+        metadata['labels'].update(labels)
+        return self
+
+    def add_pod_annotations(self, annotations: dict):
+        """Add annotations to the pod template, restarts the pods."""
+        metadata = self.pod_template.setdefault('metadata', {})
+        if not metadata.get('annotations'):
+            metadata['annotations'] = {}
+        metadata['annotations'].update(annotations)
+        return self
+
+    def set_resources(self, requests: dict = None, limits: dict = None,
+                      containers: list = None):
+        """
+        Set resource requests and limits of containers.
+
+        Kwargs:
+            requests (dict): Requests to set (cpu, memory).
+            limits (dict): Limits to set.
+            containers (list): Names of the containers, default all.
+        """
+        for c in self.containers():
+            if containers is not None and c.get('name') not in containers:
+                continue
+            resources = c.get('resources') or {}
+            if requests:
+                resources.setdefault('requests', {}).update(requests)
+            if limits:
+                resources.setdefault('limits', {}).update(limits)
+            c['resources'] = resources
+        return self
+
+    def set_affinity(self, affinity: dict):
+        """Set the affinity of the pods."""
+        self.pod_spec['affinity'] = affinity
+        return self
+
+    def set_node_selector(self, node_selector: dict):
+        """Set the node selector of the pods."""
+        self.pod_spec['nodeSelector'] = node_selector
+        return self
+
+    def set_replicas(self, replicas: int):
+        """Set the number of replicas."""
+        self.document.setdefault('spec', {})['replicas'] = replicas
+        return self
+
+
+class Service(Manifest):
+    """Service manifest."""
+
+    __slots__ = ()
+
+    @property
+    def selector(self) -> dict:
+        """Pod selector of the service, empty for services without it."""
+        return self.document.get('spec', {}).get('selector') or {}
+
+    @property
+    def ports(self) -> list:
+        """Ports of the service."""
+        return self.document.get('spec', {}).get('ports') or []
+
+
+class Secret(Manifest):
+    """Secret manifest."""
+
+    __slots__ = ()
+
+    @property
+    def data(self) -> dict:
+        """Base64 encoded data of the secret."""
+        return self.document.setdefault('data', {})
+
+
+class ConfigMap(Manifest):
+    """ConfigMap manifest."""
+
+    __slots__ = ()
+
+    @property
+    def data(self) -> dict:
+        """Data of the configmap."""
+        return self.document.setdefault('data', {})
+
+
+class PersistentVolume(Manifest):
+    """PersistentVolume manifest."""
+
+    __slots__ = ()
+
+    @property
+    def capacity(self) -> str:
+        """Storage capacity of the volume."""
+        return self.document.get('spec', {}).get(
+            'capacity', {}).get('storage')
+
+
+class PersistentVolumeClaim(Manifest):
+    """PersistentVolumeClaim manifest."""
+
+    __slots__ = ()
+
+    @property
+    def storage_request(self) -> str:
+        """Requested storage of the claim."""
+        return self.document.get('spec', {}).get('resources', {}).get(
+            'requests', {}).get('storage')
+
+
+MANIFEST_CLASSES = {
+    'Deployment': Deployment, 'Service': Service, 'Secret': Secret,
+    'ConfigMap': ConfigMap, 'PersistentVolume': PersistentVolume,
+    'PersistentVolumeClaim': PersistentVolumeClaim}
+"""Wrapper class of each kind, other kinds use Manifest."""
+
+
+def wrap(document: dict) -> Manifest:
+    """Wrap a document with the class of its kind."""
+    return MANIFEST_CLASSES.get(document.get('kind'), Manifest)(document)
+
+
+def load_manifests(content: str) -> list:
+    """
+    Parse a YAML manifest into wrapped documents.
+
+    Args:
+        content (str): YAML manifest, may have more than one document.
+    Returns:
+        list: Manifest objects.
+    """
+    return [wrap(doc) for doc in load_documents(content)]
+
+
+def dump_manifests(manifests: list) -> str:
+    """
+    Serialize wrapped documents as one YAML manifest.
+
+    Args:
+        manifests (list): Manifest objects.
+    Returns:
+        str: YAML manifest.
+    """
+    return dump_documents([m.document for m in manifests])
@@ -0,0 +1,301 @@
+"""
+Offline validation of rendered manifests.
+
+Documents are checked against the Kubernetes OpenAPI definitions bundled on
+manifests/schemas for the target Kubernetes version, before anything is
+sent to the cluster. Unknown fields, wrong types, invalid enum values,
+missing required fields and duplicated keys are reported with the line of
+the manifest where they are:
+
+    validator = SchemaValidator(kubernetes_version='1.27')
+    for error in validator.validate(content, file='resources/0__app.yml'):
+        print(format_error(error))
+
+Validation runs over the YAML node tree, so lines are exact and a quoted
+'8000' is told apart from 8000 as kubectl does. Only the kinds deployed by
+pumpwood-deploy are bundled, documents of other kinds are not checked.
+"""
+import os
+import json
+import threading
+import yaml
+
+try:
+    from yaml import CSafeLoader as _Loader
+except ImportError:
+    from yaml import SafeLoader as _Loader
+
+
+SCHEMAS_PATH = os.path.join(os.path.dirname(__file__), 'schemas')
+DEFAULT_KUBERNETES_VERSION = '1.27'
+
+_YAML_TYPES = {
+    'tag:yaml.org,2002:str': 'string',
+    'tag:yaml.org,2002:int': 'integer',
+    'tag:yaml.org,2002:float': 'number',
+    'tag:yaml.org,2002:bool': 'boolean',
+    'tag:yaml.org,2002:null': 'null',
+    'tag:yaml.org,2002:timestamp': 'string',
+    'tag:yaml.org,2002:binary': 'string'}
+_FORMAT_TYPES = {
+    'int-or-string': ['integer', 'string'],
+    'quantity': ['integer', 'number', 'string']}
+
+_schemas = {}
+_schemas_lock = threading.Lock()
+
+
+class ManifestValidationError(Exception):
+    """Rendered manifests are not valid for the target Kubernetes."""
+
+    def __init__(self, errors: list):
+        """
+        __init__.
+
+        Args:
+            errors (list): Validation errors, see SchemaValidator.validate.
+        """
+        super(ManifestValidationError, self).__init__(
+            '%s invalid manifest fields:\n%s' % (
+                len(errors), '\n'.join([format_error(e) for e in errors])))
+        self.errors = errors
+
+    def __reduce__(self):
+        """Pickle with the errors, raised on render process pools."""
+        return (ManifestValidationError, (self.errors, ))
+
+
+def load_schema(kubernetes_version: str = DEFAULT_KUBERNETES_VERSION
+                ) -> dict:
+    """
+    Load the bundled OpenAPI definitions of a Kubernetes version.
+
+    Schemas are read once for each version.
+
+    Kwargs:
+        kubernetes_version (str): Kubernetes minor version, as `1.27`.
+    Returns:
+        dict: OpenAPI document with `definitions`.
+    """
+    with _schemas_lock:
+        if kubernetes_version not in _schemas:
+            path = os.path.join(
+                SCHEMAS_PATH, 'kubernetes-%s.json' % kubernetes_version)
+            if not os.path.isfile(path):
+                available = sorted([
+                    f[len('kubernetes-'):-len('.json')]
+                    for f in os.listdir(SCHEMAS_PATH)
+                    if f.startswith('kubernetes-')])
+                raise Exception(
+                    'Schema of Kubernetes %s not bundled, use one of %s' % (
+                        kubernetes_version, available))
+            with open(path, 'r') as file:
+                _schemas[kubernetes_version] = json.load(file)
+        return _schemas[kubernetes_version]
+
+
+def format_error(error: dict) -> str:
+    """
+    Format a validation error as `file:line: Kind/name path: message`.
+
+    Args:
+        error (dict): Validation error, see SchemaValidator.validate.
+    Returns:
+        str: One line description of the error.
+    """
+    location = error['file'] or '<manifest>'
+    if error['line'] is not None:
+        location += ':%s' % error['line']
+    parts = [location + ':']
+    if error['kind'] is not None:
+        parts.append('%s/%s' % (error['kind'], error['name']))
+    if error['path']:
+        parts.append(error['path'])
+    if len(parts) != 1:
+        parts[-1] += ':'
+    return ' '.join(parts + [error['message']])
+
+
+def parse_error(error: yaml.YAMLError, file: str = None) -> dict:
+    """
+    Return the validation error of a YAML syntax error.
+
+    Args:
+        error (yaml.YAMLError): Error raised parsing the manifest.
+    Kwargs:
+        file (str): File of the manifest, set on the error.
+    Returns:
+        dict: Validation error, see SchemaValidator.validate.
+    """
+    mark = getattr(error, 'problem_mark', None)
+    return {
+        'file': file, 'line': mark.line + 1 if mark is not None else None,
+        'kind': None, 'name': None, 'path': '',
+        'message': 'invalid YAML: %s' % (
+            getattr(error, 'problem', None) or error, )}
+
+
+def _node_type(node) -> str:
+    if isinstance(node, yaml.MappingNode):
+        return 'object'
+    if isinstance(node, yaml.SequenceNode):
+        return 'array'
+    return _YAML_TYPES.get(node.tag, node.tag)
+
+
+def _scalar(node, key: str):
+    for key_node, value_node in node.value:
+        if key_node.value == key and isinstance(value_node, yaml.ScalarNode):
+            return value_node.value
+    return None
+
+
+class SchemaValidator:
+    """Validate manifests against the OpenAPI definitions of Kubernetes."""
+
+    def __init__(self,
+                 kubernetes_version: str = DEFAULT_KUBERNETES_VERSION):
+        """
+        __init__.
+
+        Kwargs:
+            kubernetes_version (str): Target Kubernetes minor version, a
+                schema must be bundled for it, see load_schema.
+        """
+        self.kubernetes_version = kubernetes_version
+        self.definitions = load_schema(kubernetes_version)['definitions']
+        self.kinds = {}
+        for name, definition in self.definitions.items():
+            for gvk in definition.get('x-kubernetes-group-version-kind', []):
+                api_version = gvk['version']
+                if gvk['group']:
+                    api_version = gvk['group'] + '/' + api_version
+                self.kinds[(api_version, gvk['kind'])] = name
+
+    def _resolve(self, schema: dict) -> dict:
+        while '$ref' in schema:
+            schema = self.definitions[schema['$ref'].split('/')[-1]]
+        return schema
+
+    def _check(self, node, schema: dict, path: str, errors: list):
+        schema = self._resolve(schema)
+        node_type = _node_type(node)
+        if node_type == 'null':
+            # Null fields are the same as missing ones
+            return
+
+        expected = _FORMAT_TYPES.get(schema.get('format'))
+        if expected is None:
+            expected = [schema.get('type', node_type)]
+        if node_type not in expected:
+            errors.append((node, path, 'expected %s, got %s %r' % (
+                ' or '.join(expected), node_type,
+                node.value if node_type not in ['object', 'array']
+                else node_type)))
+            return
+
+        if node_type == 'object':
+            self._check_object(node, schema, path, errors)
+        elif node_type == 'array':
+            items = schema.get('items')
+            if items is not None:
+                for index, item in enumerate(node.value):
+                    self._check(
+                        item, items, '%s[%s]' % (path, index), errors)
+        elif 'enum' in schema and node.value not in schema['enum']:
+            errors.append((node, path, 'unsupported value %r, use one of '
+                           '%s' % (node.value, schema['enum'])))
+
+    def _check_object(self, node, schema: dict, path: str, errors: list):
+        properties = schema.get('properties')
+        additional = schema.get('additionalProperties')
+        present = set()
+        seen = set()
+        for key_node, value_node in node.value:
+            key = key_node.value
+            key_path = path + '.' + key if path else key
+            if key in seen:
+                errors.append((key_node, key_path, 'duplicated field'))
+                continue
+            seen.add(key)
+            if _node_type(value_node) != 'null':
+                present.add(key)
+            if properties is not None and key in properties:
+                self._check(value_node, properties[key], key_path, errors)
+            elif additional is not None:
+                self._check(value_node, additional, key_path, errors)
+            elif properties is not None:
+                errors.append((key_node, key_path, 'unknown field'))
+        for key in schema.get('required', []):
+            if key not in present:
+                errors.append((node, path, 'missing required field %r' % (
+                    key, )))
+
+    def validate_document(self, node, file: str = None) -> list:
+        """
+        Validate a composed YAML document.
+
+        Args:
+            node (yaml.Node): Root node of the document.
+        Kwargs:
+            file (str): File of the document, set on the errors.
+        Returns:
+            list: Validation errors, see validate.
+        """
+        def error(error_node, path, message):
+            return {
+                'file': file, 'line': error_node.start_mark.line + 1,
+                'kind': kind, 'name': name, 'path': path,
+                'message': message}
+
+        kind = name = None
+        if not isinstance(node, yaml.MappingNode):
+            return [error(node, '', 'document is not an object')]
+        kind = _scalar(node, 'kind')
+        api_version = _scalar(node, 'apiVersion')
+        for key_node, value_node in node.value:
+            if key_node.value == 'metadata' and \
+                    isinstance(value_node, yaml.MappingNode):
+                name = _scalar(value_node, 'name')
+        if kind is None or api_version is None:
+            return [error(node, '', 'apiVersion and kind are required')]
+
+        definition = self.kinds.get((api_version, kind))
+        if definition is None:
+            served = sorted([a for a, k in self.kinds if k == kind])
+            if len(served) == 0:
+                return []
+            return [error(node, 'apiVersion', (
+                '%s is not served on %s by Kubernetes %s, use %s') % (
+                    kind, api_version, self.kubernetes_version,
+                    ' or '.join(served)))]
+
+        errors = []
+        self._check(node, {'$ref': definition}, '', errors)
+        errors.sort(key=lambda e: e[0].start_mark.line)
+        return [error(n, path, message) for n, path, message in errors]
+
+    def validate(self, content: str, file: str = None) -> list:
+        """
+        Validate all documents of a YAML manifest.
+
+        Args:
+            content (str): YAML manifest, may have more than one document.
+        Kwargs:
+            file (str): File of the manifest, set on the errors.
+        Returns:
+            list: Errors as dicts with `file`, `line` (1-based line of the
+                field on the manifest), `kind` and `name` of the resource,
+                `path` of the field and `message`. Empty if the manifest is
+                valid.
+        """
+        try:
+            documents = list(yaml.compose_all(content, Loader=_Loader))
+        except yaml.YAMLError as e:
+            return [parse_error(e, file=file)]
+
+        errors = []
+        for node in documents:
+            if node is not None and _node_type(node) != 'null':
+                errors.extend(self.validate_document(node, file=file))
+        return errors
@@ -1,7 +1,6 @@
 """load_balancer.py."""
 import os
 import ipaddress
-from jinja2 import Template
 from typing import List
 from pumpwood_deploy.microservices.api_gateway.resources.yml_resources import (
     external_service, internal_service,
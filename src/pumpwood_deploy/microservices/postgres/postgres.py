@@ -1,32 +1,130 @@
 """Postgres deploy fuctions."""
-import os
-import subprocess
+import base64
+import threading
+from pumpwood_deploy.certificates.generate import (
+    self_signed_key_crt, DEFAULT_KEY_TYPE)
 
 
-def create_ssl_key_ssl_crt():
-    """Create SSL key and Certificate for Postgres connections."""
-    dir_temp_path = 'temp/'
-    if not os.path.exists(dir_temp_path):
-        os.makedirs(dir_temp_path)
+def create_ssl_key_ssl_crt(key_type: str = DEFAULT_KEY_TYPE,
+                           store=None, microservice: str = None,
+                           namespace: str = 'default') -> dict:
+    """
+    Create SSL key and Certificate for Postgres connections.
 
-    key_path = dir_temp_path + 'server.key'
-    cert_path = dir_temp_path + 'server.crt'
+    Key and certificate are generated in process, without temporary files,
+    and the function may be called from many threads.
 
-    bash_cmd_text = """openssl req -new -x509 -days 365 -nodes -text """ +\
-                    """-out {out} -keyout {keyout} -subj """ +\
-                    """/CN=pumpwood.murabei.com"""
-    bash_cmd_1 = bash_cmd_text.format(
-        keyout=key_path, out=cert_path)
+    Kwargs:
+        key_type (str): Key type, `rsa-2048` (default), `rsa-4096` or
+            `ecdsa-p256`, see certificates.generate.KEY_TYPES.
+        store (CertificateStore): If set, the certificate of `microservice`
+            on `namespace` is taken from the store (issued by its CA and
+            reused until close to expire) instead of a new self-signed one.
+        microservice (str): Name of the microservice on the store.
+        namespace (str): Namespace on the store.
+    Returns:
+        dict: `ssl_key` and `ssl_crt` as PEM strings.
+    """
+    if store is not None:
+        certificates = store.certificate(
+            microservice=microservice, namespace=namespace)
+        return {
+            'ssl_key': certificates['ssl_key'],
+            'ssl_crt': certificates['ssl_crt']}
+    return self_signed_key_crt(
+        common_name='pumpwood.murabei.com', key_type=key_type, days=365)
 
-    process = subprocess.Popen(bash_cmd_1.split(), stdout=subprocess.PIPE)
-    output, error = process.communicate()
 
-    with open(key_path, 'r') as file:
-        ssl_key = file.read()
+class PostgresCertificates:
+    """
+    Postgres SSL key and certificate of a microservice.
 
-    with open(cert_path, 'r') as file:
-        ssl_crt = file.read()
+    Certificates are created on first use (by create_deployment_file) and
+    kept for the next ones, so microservice objects are built without any
+    key generation and microservices that are not rendered never create
+    them. Thread safe.
+    """
 
-    os.remove(key_path)
-    os.remove(cert_path)
-    return {'ssl_key': ssl_key, 'ssl_crt': ssl_crt}
+    def __init__(self, microservice: str, key_type: str = DEFAULT_KEY_TYPE):
+        """
+        __init__.
+
+        Args:
+            microservice (str): Name of the microservice, key of the
+                certificate on certificate stores.
+        Kwargs:
+            key_type (str): Key type of self-signed certificates.
+        """
+        self.microservice = microservice
+        self.key_type = key_type
+        self.store = None
+        self.namespace = 'default'
+        self._certificates = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        """Drop the lock when pickled to render on process pools."""
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        """Recreate the lock."""
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def use_store(self, store, namespace: str):
+        """
+        Take the certificates from a certificate store.
+
+        Args:
+            store (CertificateStore): Certificate store.
+            namespace (str): Namespace of the deploy.
+        """
+        with self._lock:
+            self.store = store
+            self.namespace = namespace
+            self._certificates = None
+
+    def get(self) -> dict:
+        """
+        Return the certificates, creating them on first call.
+
+        Returns:
+            dict: `ssl_key` and `ssl_crt` as base64 encoded PEM, as set on
+                the secrets.
+        """
+        with self._lock:
+            if self._certificates is None:
+                certificates = create_ssl_key_ssl_crt(
+                    key_type=self.key_type, store=self.store,
+                    microservice=self.microservice,
+                    namespace=self.namespace)
+                self._certificates = dict([
+                    (key, base64.b64encode(value.encode()).decode())
+                    for key, value in certificates.items()])
+            return self._certificates
+
+    @property
+    def ssl_key(self) -> str:
+        """Base64 encoded PEM key."""
+        return self.get()['ssl_key']
+
+    @property
+    def ssl_crt(self) -> str:
+        """Base64 encoded PEM certificate."""
+        return self.get()['ssl_crt']
+
+
+def use_certificate_store(microservice, store, namespace: str):
+    """
+    Set the postgres certificates of a microservice from a store.
+
+    Args:
+        microservice: Microservice object with postgres certificates
+            (`_postgres_certificates` attribute).
+        store (CertificateStore): Certificate store.
+        namespace (str): Namespace of the deploy.
+    """
+    microservice._postgres_certificates.use_store(
+        store=store, namespace=namespace)
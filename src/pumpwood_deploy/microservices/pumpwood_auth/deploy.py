@@ -2,11 +2,11 @@
 import os
 import base64
 from pumpwood_deploy.microservices.postgres.postgres import \
-    create_ssl_key_ssl_crt
-from jinja2 import Template
+    PostgresCertificates
+from pumpwood_deploy.templates import render_template
 from .resources.yml__resources import (
     auth_admin_static, app_deployment, deployment_postgres, secrets,
-    services__load_balancer, volume_postgres, test_postgres)
+    volume_postgres, test_postgres)
 
 
 class PumpWoodAuthMicroservice:
@@ -48,7 +48,6 @@ class PumpWoodAuthMicroservice:
             raise Exception(
                 "When working with test database, disk is not used.")
 
-        postgres_certificates = create_ssl_key_ssl_crt()
         self._secret_key = base64.b64encode(secret_key.encode()).decode()
         self._db_password = base64.b64encode(db_password.encode()).decode()
         self._microservice_password = base64.b64encode(
@@ -59,10 +58,8 @@ class PumpWoodAuthMicroservice:
         self._email_host_password = base64.b64encode(
             email_host_password.encode()).decode()
 
-        self._ssl_crt = base64.b64encode(
-            postgres_certificates['ssl_crt'].encode()).decode()
-        self._ssl_key = base64.b64encode(
-            postgres_certificates['ssl_key'].encode()).decode()
+        self._postgres_certificates = PostgresCertificates(
+            microservice=type(self).__name__)
 
         self.postgres_public_ip = postgres_public_ip
         self.firewall_ips = firewall_ips
@@ -88,8 +85,8 @@ class PumpWoodAuthMicroservice:
             microservice_password=self._microservice_password,
             email_host_user=self._email_host_user,
             email_host_password=self._email_host_password,
-            ssl_key=self._ssl_key,
-            ssl_crt=self._ssl_crt,
+            ssl_key=self._postgres_certificates.ssl_key,
+            ssl_crt=self._postgres_certificates.ssl_crt,
             secret_key=self._secret_key)
 
         deployment_auth_app_text_f = app_deployment.format(
@@ -133,9 +130,9 @@ class PumpWoodAuthMicroservice:
              'content': deployment_auth_admin_static_f, 'sleep': 10}])
 
         if self.firewall_ips is not None and self.postgres_public_ip:
-            services__load_balancer_template = Template(
-                services__load_balancer)
-            svcs__load_balancer_text = services__load_balancer_template.render(
+            svcs__load_balancer_text = render_template(
+                '.resources.yml__resources', 'services__load_balancer',
+                package=__package__,
                 postgres_public_ip=self.postgres_public_ip,
                 firewall_ips=self.firewall_ips)
 
@@ -70,10 +70,6 @@ spec:
       imagePullSecrets:
         - name: dockercfg
       volumes:
-      - name: secrets
-        secret:
-          secretName: pumpwood-auth
-      volumes:
       - name: bucket-key
         secret:
           secretName: bucket-key
@@ -3,12 +3,11 @@
 import os
 import base64
 from pumpwood_deploy.microservices.postgres.postgres import \
-    create_ssl_key_ssl_crt
-from jinja2 import Template
+    PostgresCertificates
+from pumpwood_deploy.templates import render_template
 from .resources.yml__resources import (
-    app_deployment, worker_deployment, deployment_postgres,
-    secrets, services__load_balancer, volume_postgres,
-    test_postgres)
+    app_deployment, worker_deployment, deployment_postgres, secrets,
+    volume_postgres, test_postgres)
 
 
 class PumpWoodDatalakeMicroservice:
@@ -63,15 +62,12 @@ class PumpWoodDatalakeMicroservice:
             raise Exception(
                 "When working with test database, disk is not used.")
 
-        postgres_certificates = create_ssl_key_ssl_crt()
         self._db_password = base64.b64encode(db_password.encode()).decode()
         self._microservice_password = base64.b64encode(
             microservice_password.encode()).decode()
 
-        self._ssl_crt = base64.b64encode(
-            postgres_certificates['ssl_crt'].encode()).decode()
-        self._ssl_key = base64.b64encode(
-            postgres_certificates['ssl_key'].encode()).decode()
+        self._postgres_certificates = PostgresCertificates(
+            microservice=type(self).__name__)
 
         self.postgres_public_ip = postgres_public_ip
         self.firewall_ips = firewall_ips
@@ -99,8 +95,8 @@ class PumpWoodDatalakeMicroservice:
         secrets_text_formated = secrets.format(
             db_password=self._db_password,
             microservice_password=self._microservice_password,
-            ssl_key=self._ssl_key,
-            ssl_crt=self._ssl_crt)
+            ssl_key=self._postgres_certificates.ssl_key,
+            ssl_crt=self._postgres_certificates.ssl_crt)
         volume_postgres_text_formated = volume_postgres.format(
             disk_size=self.disk_size, disk_name=self.disk_name)
 
@@ -149,9 +145,9 @@ class PumpWoodDatalakeMicroservice:
              'content': worker_deployment_text_frmted, 'sleep': 0}])
 
         if self.firewall_ips is not None and self.postgres_public_ip:
-            services__load_balancer_template = Template(
-                services__load_balancer)
-            svcs__load_balancer_text = services__load_balancer_template.render(
+            svcs__load_balancer_text = render_template(
+                '.resources.yml__resources', 'services__load_balancer',
+                package=__package__,
                 postgres_public_ip=self.postgres_public_ip,
                 firewall_ips=self.firewall_ips)
             list_return.append({
@@ -2,11 +2,11 @@
 import os
 import base64
 from pumpwood_deploy.microservices.postgres.postgres import \
-    create_ssl_key_ssl_crt
-from jinja2 import Template
+    PostgresCertificates
+from pumpwood_deploy.templates import render_template
 from .resources.yml__resources import (
-    app_deployment, deployment_postgres, secrets, services__load_balancer,
-    volume_postgres, test_postgres, decision_model_yml)
+    app_deployment, deployment_postgres, secrets, volume_postgres,
+    test_postgres, decision_model_yml)
 
 
 class PumpWoodDescisionMicroservice:
@@ -57,15 +57,12 @@ class PumpWoodDescisionMicroservice:
             raise Exception(
                 "When working with test database, disk is not used.")
 
-        postgres_certificates = create_ssl_key_ssl_crt()
         self._db_password = base64.b64encode(db_password.encode()).decode()
         self._microservice_password = base64.b64encode(
             microservice_password.encode()).decode()
 
-        self._ssl_crt = base64.b64encode(
-            postgres_certificates['ssl_crt'].encode()).decode()
-        self._ssl_key = base64.b64encode(
-            postgres_certificates['ssl_key'].encode()).decode()
+        self._postgres_certificates = PostgresCertificates(
+            microservice=type(self).__name__)
 
         self.postgres_public_ip = postgres_public_ip
         self.firewall_ips = firewall_ips
@@ -89,8 +86,8 @@ class PumpWoodDescisionMicroservice:
         secrets_text_formated = secrets.format(
             db_password=self._db_password,
             microservice_password=self._microservice_password,
-            ssl_key=self._ssl_key,
-            ssl_crt=self._ssl_crt)
+            ssl_key=self._postgres_certificates.ssl_key,
+            ssl_crt=self._postgres_certificates.ssl_crt)
         volume_postgres_text_formated = volume_postgres.format(
             disk_size=self.disk_size, disk_name=self.disk_name)
 
@@ -136,9 +133,9 @@ class PumpWoodDescisionMicroservice:
 
         if self.firewall_ips is not None and \
            self.postgres_public_ip is not None:
-            services__load_balancer_template = Template(
-                services__load_balancer)
-            svcs__load_balancer_text = services__load_balancer_template.render(
+            svcs__load_balancer_text = render_template(
+                '.resources.yml__resources', 'services__load_balancer',
+                package=__package__,
                 postgres_public_ip=self.postgres_public_ip,
                 firewall_ips=self.firewall_ips)
             list_return.append({
@@ -2,13 +2,12 @@
 import os
 import base64
 from typing import List
-from jinja2 import Template
+from pumpwood_deploy.templates import render_template
 from pumpwood_deploy.microservices.postgres.postgres import \
-    create_ssl_key_ssl_crt
+    PostgresCertificates
 from .resources.resources_yml import (
-    app_deployment, worker_dataloader, deployment_postgres,
-    worker_rawdata, secrets, services__load_balancer,
-    volume_postgres, test_postgres)
+    app_deployment, worker_dataloader, deployment_postgres, worker_rawdata,
+    secrets, volume_postgres, test_postgres)
 
 
 class PumpWoodPredictionMicroservice:
@@ -58,15 +57,12 @@ class PumpWoodPredictionMicroservice:
             raise Exception(
                 "When working with test database, disk is not used.")
 
-        postgres_certificates = create_ssl_key_ssl_crt()
         self._db_password = base64.b64encode(db_password.encode()).decode()
         self._microservice_password = base64.b64encode(
             microservice_password.encode()).decode()
 
-        self._ssl_crt = base64.b64encode(
-            postgres_certificates['ssl_crt'].encode()).decode()
-        self._ssl_key = base64.b64encode(
-            postgres_certificates['ssl_key'].encode()).decode()
+        self._postgres_certificates = PostgresCertificates(
+            microservice=type(self).__name__)
 
         self.postgres_public_ip = postgres_public_ip
         self.firewall_ips = firewall_ips
@@ -92,8 +88,8 @@ class PumpWoodPredictionMicroservice:
         secrets_text_formated = secrets.format(
             db_password=self._db_password,
             microservice_password=self._microservice_password,
-            ssl_key=self._ssl_key,
-            ssl_crt=self._ssl_crt)
+            ssl_key=self._postgres_certificates.ssl_key,
+            ssl_crt=self._postgres_certificates.ssl_crt)
 
         volume_postgres_text_formated = volume_postgres.format(
             disk_size=self.disk_size,
@@ -145,9 +141,9 @@ class PumpWoodPredictionMicroservice:
         ])
 
         if self.firewall_ips and self.postgres_public_ip:
-            services__load_balancer_template = Template(
-                services__load_balancer)
-            svcs__load_balancer_text = services__load_balancer_template.render(
+            svcs__load_balancer_text = render_template(
+                '.resources.resources_yml', 'services__load_balancer',
+                package=__package__,
                 postgres_public_ip=self.postgres_public_ip,
                 firewall_ips=self.firewall_ips)
             list_return.append({
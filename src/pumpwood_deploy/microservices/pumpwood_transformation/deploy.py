@@ -1,14 +1,14 @@
 """PumpWood DataLake Microservice Deploy."""
 import os
 import base64
-from jinja2 import Template
+from pumpwood_deploy.templates import render_template
 from pumpwood_deploy.microservices.postgres.postgres import \
-    create_ssl_key_ssl_crt
+    PostgresCertificates
 from typing import List
 from .resources.resources_yml import (
-    deployment_postgres, secrets, services__load_balancer,
-    transformation_deployment, transformation_worker_estimation,
-    transformation_worker_prediction, volume_postgres, test_postgres)
+    deployment_postgres, secrets, transformation_deployment,
+    transformation_worker_estimation, transformation_worker_prediction,
+    volume_postgres, test_postgres)
 
 
 class PumpWoodTransformationMicroservice:
@@ -58,15 +58,12 @@ class PumpWoodTransformationMicroservice:
             raise Exception(
                 "When working with test database, disk is not used.")
 
-        postgres_certificates = create_ssl_key_ssl_crt()
         self._db_password = base64.b64encode(db_password.encode()).decode()
         self._microservice_password = base64.b64encode(
             microservice_password.encode()).decode()
 
-        self._ssl_crt = base64.b64encode(
-            postgres_certificates['ssl_crt'].encode()).decode()
-        self._ssl_key = base64.b64encode(
-            postgres_certificates['ssl_key'].encode()).decode()
+        self._postgres_certificates = PostgresCertificates(
+            microservice=type(self).__name__)
 
         self.postgres_public_ip = postgres_public_ip
         self.firewall_ips = firewall_ips
@@ -90,8 +87,8 @@ class PumpWoodTransformationMicroservice:
         secrets_text_formated = secrets.format(
             db_password=self._db_password,
             microservice_password=self._microservice_password,
-            ssl_key=self._ssl_key,
-            ssl_crt=self._ssl_crt)
+            ssl_key=self._postgres_certificates.ssl_key,
+            ssl_crt=self._postgres_certificates.ssl_crt)
 
         volume_postgres_text_formated = volume_postgres.format(
             disk_size=self.disk_size,
@@ -149,12 +146,11 @@ class PumpWoodTransformationMicroservice:
         ])
 
         if self.firewall_ips and self.postgres_public_ip:
-            services__load_balancer_template = Template(
-                services__load_balancer)
-            svcs__load_balancer_text = services__load_balancer_template.render(
+            svcs__load_balancer_text = render_template(
+                '.resources.resources_yml', 'services__load_balancer',
+                package=__package__,
                 postgres_public_ip=self.postgres_public_ip,
-                firewall_ips=self.firewall_ips
-            )
+                firewall_ips=self.firewall_ips)
             list_return.append({
                 'type': 'services',
                 'name': 'pumpwood_transformation__services_loadbalancer',
@@ -0,0 +1,107 @@
+"""Shared Jinja2 environment of the resources templates."""
+import os
+import importlib
+import threading
+from importlib.util import resolve_name
+from jinja2 import (
+    BaseLoader, Environment, FileSystemBytecodeCache, TemplateNotFound)
+
+
+DEFAULT_BYTECODE_CACHE_PATH = os.path.join(
+    os.path.expanduser('~'), '.cache', 'pumpwood_deploy', 'jinja2')
+"""Default directory of the compiled templates, overridden by
+PUMPWOOD_DEPLOY_TEMPLATE_CACHE environment variable. Set it to an empty
+string to not cache compiled templates on disk."""
+
+
+class ResourceModuleLoader(BaseLoader):
+    """
+    Load templates from string attributes of resources modules.
+
+    Template names are `<module>:<attribute>`, as
+    `pumpwood_deploy.microservices.pumpwood_datalake.resources.
+    yml__resources:services__load_balancer`. Modules are not reloaded, so
+    templates are always up to date once compiled.
+    """
+
+    def get_source(self, environment, template):
+        """Return the source of a template."""
+        module_name, _, attribute = template.partition(':')
+        try:
+            module = importlib.import_module(module_name)
+            source = getattr(module, attribute)
+        except (ImportError, AttributeError):
+            raise TemplateNotFound(template)
+        if not isinstance(source, str):
+            raise TemplateNotFound(template)
+        return source, None, lambda: True
+
+
+_environment = None
+_environment_lock = threading.Lock()
+
+
+def get_environment() -> Environment:
+    """
+    Return the package Jinja2 environment, creating it on first call.
+
+    Templates are compiled once for each process and kept in the
+    environment cache. Compiled bytecode is also stored on
+    DEFAULT_BYTECODE_CACHE_PATH, so new processes do not compile them again.
+
+    Returns:
+        Environment: Shared environment.
+    """
+    global _environment
+    with _environment_lock:
+        if _environment is None:
+            cache_path = os.environ.get(
+                'PUMPWOOD_DEPLOY_TEMPLATE_CACHE',
+                DEFAULT_BYTECODE_CACHE_PATH)
+            bytecode_cache = None
+            if cache_path:
+                try:
+                    os.makedirs(cache_path, exist_ok=True)
+                    bytecode_cache = FileSystemBytecodeCache(cache_path)
+                except OSError:
+                    bytecode_cache = None
+            _environment = Environment(
+                loader=ResourceModuleLoader(), auto_reload=False,
+                cache_size=-1, bytecode_cache=bytecode_cache)
+        return _environment
+
+
+def template_name(module: str, attribute: str, package: str = None) -> str:
+    """
+    Return the name of a template on the package environment.
+
+    Args:
+        module (str): Module of the template, relative names (starting with
+            a dot) are resolved against `package`.
+        attribute (str): Name of the template string on the module.
+    Kwargs:
+        package (str): Package of relative modules, usually `__package__`
+            of the caller.
+    Returns:
+        str: Template name.
+    """
+    return resolve_name(module, package) + ':' + attribute
+
+
+def render_template(module: str, attribute: str, package: str = None,
+                    **context) -> str:
+    """
+    Render a resources template with the package environment.
+
+    Args:
+        module (str): Module of the template, see template_name.
+        attribute (str): Name of the template string on the module.
+    Kwargs:
+        package (str): Package of relative modules.
+        **context: Template variables.
+    Returns:
+        str: Rendered template.
+    """
+    template = get_environment().get_template(
+        template_name(module, attribute, package=package))
+    return template.render(**context)
@@ -0,0 +1,81 @@
+"""Fixtures of pumpwood_deploy tests."""
+import os
+import sys
+import json
+import pytest
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from pumpwood_deploy.deploy import DeployPumpWood  # noqa: E402
+from pumpwood_deploy.certificates.store import (  # noqa: E402
+    CertificateStore)
+from pumpwood_deploy.kubernets.api import KubernetesAPIClient  # noqa: E402
+from pumpwood_deploy.kubernets.fake_api import (  # noqa: E402
+    FakeKubernetesAPIServer)
+from pumpwood_deploy.kubernets.kubernets import Kubernets  # noqa: E402
+from pumpwood_deploy.microservices.pumpwood_auth.deploy import (  # noqa
+    PumpWoodAuthMicroservice)
+from pumpwood_deploy.models.deploy import PumpwoodModels  # noqa: E402
+
+
+@pytest.fixture
+def api_server():
+    """In-memory Kubernetes API server."""
+    with FakeKubernetesAPIServer() as server:
+        yield server
+
+
+@pytest.fixture
+def api_client(api_server):
+    """API client of the in-memory server."""
+    return KubernetesAPIClient(server=api_server.url, token='token')
+
+
+@pytest.fixture
+def kube_client(api_client):
+    """Kubernets client using the in-memory server."""
+    return Kubernets(
+        cluster_name='cluster', zone='zone', project='project',
+        api_client=api_client)
+
+
+@pytest.fixture
+def make_stack(tmp_path, api_client):
+    """
+    Return a function that creates a stack deployed with api_client.
+
+    The stack has the standard microservices, auth and one PumpwoodModels
+    for each model type, other keyword arguments are DeployPumpWood
+    arguments. Stacks created by the same test share the output path, so
+    they share deploy state and journal, and the certificate store, so
+    they render the same database secrets.
+    """
+    bucket_key_path = str(tmp_path / 'key.json')
+    with open(bucket_key_path, 'w') as file:
+        json.dump({}, file)
+    certificate_store = CertificateStore(path=str(tmp_path / 'certificates'))
+
+    def make(model_types=('model-a', 'model-b'), **kwargs):
+        deploy_kwargs = {
+            'cluster_name': 'cluster', 'cluster_zone': 'zone',
+            'cluster_project': 'project', 'api_client': api_client,
+            'output_path': str(tmp_path / 'outputs'),
+            'certificate_store': certificate_store}
+        deploy_kwargs.update(kwargs)
+        deploy = DeployPumpWood(
+            bucket_key_path=bucket_key_path, model_user_password='password',
+            rabbitmq_secret='rabbitmq', hash_salt='salt',
+            kong_db_disk_name='kong-db', kong_db_disk_size='10Gi',
+            **deploy_kwargs)
+        deploy.add_microservice(PumpWoodAuthMicroservice(
+            secret_key='secret', db_password='password',
+            microservice_password='password', bucket_name='bucket',
+            version_app='1', version_static='1', disk_name='auth-db',
+            disk_size='10Gi', email_host_user='user',
+            email_host_password='password'))
+        for model_type in model_types:
+            deploy.add_microservice(PumpwoodModels(
+                model_type=model_type, version='1', bucket_name='bucket'))
+        return deploy
+    return make
@@ -0,0 +1,60 @@
+"""Tests of the Kubernetes API server client."""
+import os
+import stat
+import time
+import base64
+import threading
+import yaml
+from concurrent.futures import ThreadPoolExecutor
+from pumpwood_deploy.kubernets.api import KubernetesAPIClient
+
+
+def b64(text: str) -> str:
+    return base64.b64encode(text.encode()).decode()
+
+
+def test_kubeconfig_data_files_are_private_and_removed(tmp_path):
+    """Embedded certificates are user only files removed on close."""
+    kubeconfig = {
+        'current-context': 'context',
+        'contexts': [{'name': 'context', 'context': {
+            'cluster': 'cluster', 'user': 'user'}}],
+        'clusters': [{'name': 'cluster', 'cluster': {
+            'server': 'https://127.0.0.1:6443',
+            'certificate-authority-data': b64('ca')}}],
+        'users': [{'name': 'user', 'user': {
+            'client-certificate-data': b64('certificate'),
+            'client-key-data': b64('key')}}]}
+    path = str(tmp_path / 'kubeconfig')
+    with open(path, 'w') as file:
+        yaml.safe_dump(kubeconfig, file)
+
+    client = KubernetesAPIClient.from_kubeconfig(path=path)
+    files = [client.session.verify] + list(client.session.cert)
+    assert [open(f).read() for f in files] == ['ca', 'certificate', 'key']
+    for f in files:
+        assert stat.S_IMODE(os.stat(f).st_mode) == 0o600
+    directory = os.path.dirname(files[0])
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+
+    client.close()
+    assert not os.path.exists(directory)
+
+
+def test_expired_token_is_refreshed_once(api_server):
+    """Threads sharing the client run the credential plugin once."""
+    calls = []
+    lock = threading.Lock()
+
+    def token_function():
+        with lock:
+            calls.append(True)
+        time.sleep(0.1)
+        return 'token-%s' % len(calls), time.time() + 3600
+
+    client = KubernetesAPIClient(
+        server=api_server.url, token_function=token_function)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        headers = list(pool.map(lambda i: client._headers(), range(8)))
+    assert len(calls) == 1
+    assert headers == [{'Authorization': 'Bearer token-1'}] * 8
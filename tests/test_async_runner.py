@@ -0,0 +1,36 @@
+"""Tests of the asyncio deploy runner."""
+from pumpwood_deploy.kubernets.async_runner import AsyncDeployRunner
+from pumpwood_deploy.kubernets.wait import DeploymentRollout, SecretExists
+
+
+SECRET = """apiVersion: v1
+kind: Secret
+metadata:
+  name: {name}
+data:
+  key: dmFsdWU=
+"""
+
+
+def secret_cmd(name: str, wait: list) -> dict:
+    return {
+        'file': name + '.sh', 'key': name, 'name': name, 'type': 'secrets',
+        'microservice': 1, 'command': 'run', 'wait': wait,
+        'content': SECRET.format(name=name)}
+
+
+def test_pending_wait_does_not_block_applies(kube_client):
+    """A rollout that is never ready does not hold the only apply thread."""
+    cmds = [secret_cmd('slow', [DeploymentRollout('never')])] + [
+        secret_cmd('secret-%s' % i, [SecretExists('secret-%s' % i)])
+        for i in range(3)]
+    runner = AsyncDeployRunner(
+        kube_client, max_concurrency=1, wait_ready=True, timeout=1.5)
+    results = runner.run_sync(cmds)
+
+    assert [r['name'] for r in results][-1] == 'slow'
+    assert results[-1]['status'] == 'failed'
+    assert 'never' in results[-1]['error']
+    fast = results[:-1]
+    assert [r['status'] for r in fast] == ['succeeded'] * 3
+    assert max([r['duration'] for r in fast]) < 1.0
@@ -0,0 +1,64 @@
+"""Tests of the TLS certificate generation and store."""
+import os
+import json
+import pickle
+import stat
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from pumpwood_deploy.certificates.store import CertificateStore
+from pumpwood_deploy.microservices.postgres.postgres import (
+    create_ssl_key_ssl_crt)
+
+
+def load_key(pem: str):
+    return serialization.load_pem_private_key(pem.encode(), password=None)
+
+
+def test_default_keys_are_rsa(tmp_path):
+    """Keys are RSA 2048 as openssl created, ECDSA only if asked."""
+    key = load_key(create_ssl_key_ssl_crt()['ssl_key'])
+    assert isinstance(key, rsa.RSAPrivateKey) and key.key_size == 2048
+    store = CertificateStore(path=str(tmp_path / 'certificates'))
+    key = load_key(store.certificate('auth', 'default')['ssl_key'])
+    assert isinstance(key, rsa.RSAPrivateKey) and key.key_size == 2048
+    key = load_key(create_ssl_key_ssl_crt(key_type='ecdsa-p256')['ssl_key'])
+    assert isinstance(key, ec.EllipticCurvePrivateKey)
+
+
+def test_store_reuses_certificates(tmp_path):
+    """Stores on the same path return the same certificate."""
+    path = str(tmp_path / 'certificates')
+    first = CertificateStore(path=path).certificate('auth', 'default')
+    second = CertificateStore(path=path).certificate('auth', 'default')
+    assert first == second
+    other = CertificateStore(path=path).certificate('auth', 'other')
+    assert other['ssl_crt'] != first['ssl_crt']
+    assert other['ca_crt'] == first['ca_crt']
+
+
+def test_concurrent_writes_are_atomic(tmp_path):
+    """Writers of the same entry do not share a temp file."""
+    path = str(tmp_path / 'certificates' / 'default' / 'auth.json')
+    stores = [
+        CertificateStore(path=str(tmp_path / 'certificates'))
+        for i in range(8)]
+
+    def write(i):
+        for j in range(50):
+            stores[i]._write(path, {'writer': i, 'n': j})
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(write, range(8)))
+
+    with open(path, 'r') as file:
+        assert json.load(file)['n'] == 49
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert os.listdir(os.path.dirname(path)) == ['auth.json']
+
+
+def test_store_is_picklable(tmp_path):
+    """Stores are sent to process pools and read the same certificates."""
+    store = CertificateStore(path=str(tmp_path / 'certificates'))
+    certificate = store.certificate('auth', 'default')
+    copy = pickle.loads(pickle.dumps(store))
+    assert copy.certificate('auth', 'default') == certificate
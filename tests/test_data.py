@@ -0,0 +1,36 @@
+"""Tests of the Secret and ConfigMap manifests rendered from files."""
+from pumpwood_deploy.kubernets.wait import (
+    SecretExists, ConfigMapExists, resource_conditions)
+from pumpwood_deploy.manifests.data import render_data_resource
+from pumpwood_deploy.manifests.model import load_documents
+
+
+def test_rendered_secret_file(tmp_path):
+    """secrets_file resources are Secret manifests keyed by file name."""
+    path = tmp_path / 'key.json'
+    path.write_text('{}')
+    resource = render_data_resource({
+        'type': 'secrets_file', 'name': 'bucket-key', 'path': str(path),
+        'sleep': 5})
+    [secret] = load_documents(resource['content'])
+    assert secret['kind'] == 'Secret'
+    assert secret['data'] == {'key.json': 'e30='}
+    assert resource['type'] == 'secrets' and resource['sleep'] == 5
+    assert [type(c) for c in resource_conditions(resource)] == [
+        SecretExists]
+
+
+def test_declared_wait_is_kept():
+    """Conditions declared by the resource are not inferred again."""
+    condition = ConfigMapExists('other')
+    resource = render_data_resource({
+        'type': 'configmap', 'name': 'config', 'file_name': 'config.txt',
+        'content': 'value', 'wait': [condition]})
+    [configmap] = load_documents(resource['content'])
+    assert configmap['data'] == {'config.txt': 'value'}
+    assert resource_conditions(resource) == [condition]
+
+    resource = render_data_resource({
+        'type': 'configmap', 'name': 'config', 'file_name': 'config.txt',
+        'content': 'value', 'wait': None})
+    assert resource_conditions(resource) == []
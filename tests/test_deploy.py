@@ -0,0 +1,184 @@
+"""Tests of DeployPumpWood deploys against the fake API server."""
+from pumpwood_deploy.kubernets.executor import (
+    command_stage, STAGE_DATABASE)
+from pumpwood_deploy.kubernets.prune import PRUNE_KINDS
+from pumpwood_deploy.kubernets.rollout import CANARY_LABEL
+from pumpwood_deploy.history.journal import DeployJournal
+from pumpwood_deploy.manifests.labels import STACK_LABEL
+from pumpwood_deploy.manifests.model import load_documents
+
+
+WRITE_METHODS = ['POST', 'PATCH', 'PUT', 'DELETE']
+
+
+def deploy(stack, **kwargs):
+    return stack.deploy_cluster(
+        max_workers=4, wait_ready=True, timeout=30, write_files=False,
+        **kwargs)
+
+
+def writes(api_server) -> list:
+    return [
+        r for r in api_server.requests if r['method'] in WRITE_METHODS]
+
+
+def record_commands(monkeypatch, stack, fail: str = None) -> list:
+    """Record the commands run by a stack, failing the `fail` file."""
+    ran = []
+    run_deploy_command = stack.kube_client.run_deploy_command
+
+    def run(cmd, **kwargs):
+        ran.append(cmd['file'])
+        if cmd['file'] == fail:
+            raise Exception('Connection reset by peer')
+        return run_deploy_command(cmd, **kwargs)
+    monkeypatch.setattr(stack.kube_client, 'run_deploy_command', run)
+    return ran
+
+
+def object_key(key: tuple) -> str:
+    return key[0] + '/' + key[2]
+
+
+def test_incremental_redeploy_is_noop(make_stack, api_server):
+    """Redeploying an unchanged stack sends no write to the cluster."""
+    report = deploy(make_stack(), incremental=True)
+    assert report['failed'] == [] and len(report['nodes']) != 0
+
+    n_writes = len(writes(api_server))
+    report = deploy(make_stack(), incremental=True)
+    assert report['nodes'] == [] and report['failed'] == []
+    assert len(writes(api_server)) == n_writes
+
+
+def test_incremental_redeploy_applies_changes_only(
+        make_stack, api_server, monkeypatch):
+    """Only the commands of a new microservice run on the next deploy."""
+    deploy(make_stack(), incremental=True)
+
+    stack = make_stack(model_types=('model-a', 'model-b', 'model-c'))
+    ran = record_commands(monkeypatch, stack)
+    report = deploy(stack, incremental=True)
+    assert report['failed'] == []
+    assert len(ran) != 0
+    assert all(['model-c' in f for f in ran]), ran
+
+
+def test_resume_runs_only_unfinished_steps(
+        make_stack, api_server, monkeypatch):
+    """
+    A resumed deploy runs only the failed and skipped steps.
+
+    After it the journal has every step as completed.
+    """
+    stack = make_stack()
+    cmds = stack.create_deploy_files(write_files=False)
+    all_cmds = cmds['service_cmds'] + cmds['microservice_cmds']
+    failed = [
+        c['file'] for c in cmds['microservice_cmds']
+        if command_stage(c) == STAGE_DATABASE and c['microservice'] != 0][0]
+    record_commands(monkeypatch, stack, fail=failed)
+    report = deploy(stack)
+    assert report['failed'] == [failed] and len(report['skipped']) != 0
+    not_run = set(report['failed'] + report['skipped'])
+
+    stack = make_stack()
+    ran = record_commands(monkeypatch, stack)
+    report = deploy(stack, resume=True)
+    assert report['failed'] == [] and report['skipped'] == []
+    assert set(ran) == not_run and len(ran) == len(not_run)
+
+    journal = DeployJournal(path=stack.journal_path_template.format(
+        output_path=stack.output_path, namespace=stack.namespace))
+    assert journal.completed_steps() == dict([
+        (c['key'], c['hash']) for c in all_cmds])
+
+
+def test_prune_removes_only_stack_resources_not_rendered(
+        make_stack, api_server):
+    """
+    Prune deletes the stack resources not rendered anymore.
+
+    Resources of other stacks, unlabeled resources, canaries and volumes
+    are kept, and dry-run deletes nothing.
+    """
+    deploy(make_stack(stack_name='stack'))
+    canary_template = {'metadata': {'labels': {
+        'app': 'model-b', CANARY_LABEL: 'canary'}}}
+    foreign = [
+        {'apiVersion': 'v1', 'kind': 'Secret', 'metadata': {
+            'name': 'model-b-other', 'namespace': 'default',
+            'labels': {STACK_LABEL: 'other'}}},
+        {'apiVersion': 'v1', 'kind': 'ConfigMap', 'metadata': {
+            'name': 'model-b-manual', 'namespace': 'default'}},
+        {'apiVersion': 'apps/v1', 'kind': 'Deployment', 'metadata': {
+            'name': 'pumpwood-model--model-b--app-canary',
+            'namespace': 'default', 'labels': {STACK_LABEL: 'stack'}}},
+        {'apiVersion': 'apps/v1', 'kind': 'Deployment', 'metadata': {
+            'name': 'model-b-track', 'namespace': 'default',
+            'labels': {STACK_LABEL: 'stack'}},
+         'spec': {'template': canary_template}},
+        {'apiVersion': 'v1', 'kind': 'PersistentVolumeClaim', 'metadata': {
+            'name': 'model-b-volume', 'namespace': 'default',
+            'labels': {STACK_LABEL: 'stack'}}}]
+    for obj in foreign:
+        api_server.put_object(obj)
+    foreign_keys = set([
+        obj['kind'] + '/' + obj['metadata']['name'] for obj in foreign])
+    expected = set([
+        object_key(k) for k in api_server.objects
+        if k[0] in PRUNE_KINDS and 'model-b' in k[2]]) - foreign_keys
+    assert len(expected) != 0
+
+    stack = make_stack(model_types=('model-a', ), stack_name='stack')
+    before = dict(api_server.objects)
+    report = stack.prune(dry_run=True)
+    assert set([r['key'] for r in report['resources']]) == expected
+    assert set([r['action'] for r in report['resources']]) == set([
+        'would prune'])
+    assert set(api_server.objects) == set(before)
+
+    report = stack.prune(dry_run=False)
+    assert set([r['key'] for r in report['resources']]) == expected
+    remaining = set([object_key(k) for k in api_server.objects])
+    assert not remaining & expected
+    assert foreign_keys <= remaining
+    assert [k for k in remaining if 'model-a' in k]
+
+
+def test_plan_orphans_only_stack_resources(make_stack, api_server):
+    """Plan reports as orphaned only resources of the planned stack."""
+    deploy(make_stack(stack_name='stack'))
+    deploy(make_stack(
+        model_types=('model-c', ), stack_name='other',
+        namespace='default'))
+
+    stack = make_stack(model_types=('model-a', ), stack_name='stack')
+    plan = stack.plan()
+    orphaned = [
+        r['key'] for r in plan['resources'] if r['action'] == 'orphaned']
+    assert len(orphaned) != 0
+    assert all(['model-b' in k for k in orphaned]), orphaned
+
+
+def test_batch_deploy_applies_one_step_per_microservice(
+        make_stack, api_server):
+    """Batch mode applies the resources of a microservice in one step."""
+    stack = make_stack()
+    bundle = stack.render(batch=True)
+    batches = [s for s in bundle.steps if s['type'] == 'batch']
+    assert len(batches) == len(stack.microsservices_to_deploy)
+    assert all([len(s['kinds']) > 1 for s in batches])
+
+    n_requests = len(api_server.requests)
+    report = deploy(stack, batch=True)
+    assert report['failed'] == []
+    applied = [
+        r for r in api_server.requests[n_requests:]
+        if r['method'] == 'PATCH']
+    n_documents = sum([len(s['kinds']) for s in bundle.steps])
+    assert len(applied) == n_documents
+    objects = set([(k[0], k[2]) for k in api_server.objects])
+    for s in batches:
+        for doc in load_documents(s['content']):
+            assert (doc['kind'], doc['metadata']['name']) in objects
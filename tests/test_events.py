@@ -0,0 +1,61 @@
+"""Tests of the pod and event monitor of deploys."""
+import time
+import datetime
+from pumpwood_deploy.kubernets.credentials import parse_timestamp
+from pumpwood_deploy.kubernets.events import EventMonitor
+
+
+DEPLOYMENT = """apiVersion: apps/v1
+kind: Deployment
+metadata:
+  name: app
+spec:
+  selector:
+    matchLabels:
+      app: app
+"""
+
+
+def rfc3339(timestamp: float) -> str:
+    return datetime.datetime.fromtimestamp(
+        timestamp, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def pod_event(name: str, created: float, waiting: str = None) -> dict:
+    state = {'running': {}}
+    if waiting is not None:
+        state = {'waiting': {'reason': waiting, 'message': 'pull failed'}}
+    return {'type': 'MODIFIED', 'object': {
+        'metadata': {
+            'name': name, 'labels': {'app': 'app'},
+            'creationTimestamp': rfc3339(created)},
+        'status': {
+            'conditions': [{'type': 'PodScheduled', 'status': 'True'}],
+            'containerStatuses': [{'state': state}]}}}
+
+
+def test_parse_timestamp():
+    """Timestamps with fraction of seconds or offsets are parsed as UTC."""
+    assert parse_timestamp('1970-01-02T00:00:00Z') == 86400
+    assert parse_timestamp('1970-01-02T00:00:00.5Z') == 86400
+    assert parse_timestamp('1970-01-02T00:00:00+00:00') == 86400
+    assert parse_timestamp('') is None
+    assert parse_timestamp('yesterday') is None
+
+
+def test_pods_of_previous_deploys_are_ignored():
+    """Only pods created after start are correlated and reported."""
+    emitted = []
+    monitor = EventMonitor(kube_client=None, emit=emitted.append)
+    monitor.start_time = time.time()
+    monitor.track({'file': 'app.sh', 'content': DEPLOYMENT})
+
+    monitor._on_pod(pod_event('old', monitor.start_time - 3600))
+    monitor._on_pod(pod_event(
+        'new', monitor.start_time, waiting='ImagePullBackOff'))
+
+    [pod] = monitor.report()['pods']
+    assert pod['pod'] == 'new' and pod['step'] == 'app.sh'
+    assert pod['resource'] == 'Deployment/app'
+    assert [(m['pod'], m['category']) for m in emitted] == [
+        ('new', 'image pull')]
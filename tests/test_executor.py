@@ -0,0 +1,105 @@
+"""Tests of the deploy graph and its executor."""
+import time
+import threading
+from pumpwood_deploy.kubernets.executor import (
+    DeployGraph, DeployExecutor, command_stage, STAGE_SECRETS,
+    STAGE_DATABASE, STAGE_APPS)
+
+
+def deploy_graph(deploy):
+    cmds = deploy.create_deploy_files(write_files=False)
+    return DeployGraph.from_deploy_commands(
+        cmds['service_cmds'] + cmds['microservice_cmds'])
+
+
+def test_graph_dependencies(make_stack):
+    """Commands depend on the earlier stages of their microservice."""
+    graph = deploy_graph(make_stack())
+    shared = [
+        key for key, node in graph.nodes.items()
+        if node.cmd['microservice'] == 0 and
+        command_stage(node.cmd) == STAGE_SECRETS]
+    assert len(shared) != 0
+
+    stages = set()
+    for key, node in graph.nodes.items():
+        stage = command_stage(node.cmd)
+        stages.add(stage)
+        if stage == STAGE_SECRETS or node.cmd['type'] == 'services':
+            assert node.dependencies == []
+            continue
+
+        assert set(shared) <= set(node.dependencies)
+        earlier = [
+            k for k, n in graph.nodes.items()
+            if n.cmd['microservice'] == node.cmd['microservice'] and
+            command_stage(n.cmd) < stage]
+        assert set(earlier) <= set(node.dependencies)
+        for d in node.dependencies:
+            dependency = graph.nodes[d].cmd
+            assert command_stage(dependency) < stage
+            assert dependency['microservice'] in [
+                0, node.cmd['microservice']]
+    assert stages == set([STAGE_SECRETS, STAGE_DATABASE, STAGE_APPS])
+
+
+def test_graph_insertion_order_is_topological(make_stack):
+    """Nodes are added after their dependencies."""
+    graph = deploy_graph(make_stack())
+    position = dict([(key, i) for i, key in enumerate(graph.nodes)])
+    for key, node in graph.nodes.items():
+        for d in node.dependencies:
+            assert position[d] < position[key]
+
+
+def test_executor_runs_dependencies_first(make_stack):
+    """No command starts before all its dependencies finished."""
+    graph = deploy_graph(make_stack())
+    lock = threading.Lock()
+    started = {}
+    finished = {}
+
+    def run_function(cmd):
+        with lock:
+            started[cmd['file']] = time.time()
+        time.sleep(0.005)
+        with lock:
+            finished[cmd['file']] = time.time()
+        return 0
+
+    report = DeployExecutor(
+        run_function=run_function, max_workers=8).run(graph)
+    assert report['failed'] == [] and report['skipped'] == []
+    assert set(started) == set(graph.nodes)
+    for key, node in graph.nodes.items():
+        for d in node.dependencies:
+            assert finished[d] <= started[key]
+
+
+def test_executor_skips_dependents_of_failed(make_stack):
+    """Dependents of a failed command are skipped, others still run."""
+    graph = deploy_graph(make_stack())
+    failed = [
+        key for key, node in graph.nodes.items()
+        if command_stage(node.cmd) == STAGE_DATABASE and
+        node.cmd['microservice'] != 0][0]
+    failed_microservice = graph.nodes[failed].cmd['microservice']
+    ran = []
+
+    def run_function(cmd):
+        ran.append(cmd['file'])
+        if cmd['file'] == failed:
+            raise Exception('Apply failed')
+        return 0
+
+    report = DeployExecutor(
+        run_function=run_function, max_workers=4).run(graph)
+    assert report['failed'] == [failed]
+    dependents = graph.dependents()[failed]
+    assert len(dependents) != 0
+    assert set(dependents) <= set(report['skipped'])
+    assert not set(ran) & set(report['skipped'])
+    others = [
+        key for key, node in graph.nodes.items()
+        if node.cmd['microservice'] != failed_microservice]
+    assert set(others) <= set(ran)
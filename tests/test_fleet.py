@@ -0,0 +1,45 @@
+"""Tests of the fleet deploy of many targets."""
+from pumpwood_deploy.fleet import DeployTarget, FleetDeployer, fleet_summary
+
+
+def test_fleet_reports_failed_commands(
+        make_stack, api_server, api_client, tmp_path):
+    """
+    A target with a failed command is reported as failed.
+
+    Commands returning a non zero code do not raise, the fleet must report
+    them whatever the deploy arguments.
+    """
+    def build(target, **deploy_kwargs):
+        stack = make_stack(model_types=('model-a', ), **deploy_kwargs)
+        if target.name == 'broken':
+            run_deploy_command = stack.kube_client.run_deploy_command
+
+            def run(cmd, **kwargs):
+                if cmd['name'] == 'models__model-a__app':
+                    return 1
+                return run_deploy_command(cmd, **kwargs)
+            stack.kube_client.run_deploy_command = run
+        return stack
+
+    targets = [
+        DeployTarget(
+            name=name, cluster_name='cluster', cluster_zone='zone',
+            cluster_project='project', namespace=name,
+            api_client=api_client)
+        for name in ['healthy', 'broken']]
+    fleet = FleetDeployer(
+        build, targets=targets, max_concurrency=2,
+        output_path=str(tmp_path / 'fleet'))
+    report = fleet.deploy(wait_ready=True, timeout=30, write_files=False)
+
+    assert report['succeeded'] == ['healthy']
+    assert report['failed'] == ['broken']
+    healthy, broken = report['targets']
+    assert healthy['failed'] == [] and healthy['error'] is None
+    assert [f.split('__', 1)[-1] for f in broken['failed']] == [
+        'models__model-a__app.sh']
+    assert 'broken' in fleet_summary(report)
+
+    namespaces = set([k[1] for k in api_server.objects if k[0] == 'Secret'])
+    assert namespaces == set(['healthy', 'broken'])
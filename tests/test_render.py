@@ -0,0 +1,110 @@
+"""Tests of the in-memory render of the deploy steps."""
+import os
+from pumpwood_deploy import templates
+from pumpwood_deploy.benchmarks.render import synthetic_stack
+from pumpwood_deploy.manifests.model import load_documents
+from pumpwood_deploy.microservices.postgres import postgres
+from pumpwood_deploy.microservices.pumpwood_auth.deploy import (
+    PumpWoodAuthMicroservice)
+
+
+def test_render_is_in_memory(make_stack, tmp_path, monkeypatch):
+    """Render writes no deploy file and renders the same bundle twice."""
+    work_path = tmp_path / 'work'
+    work_path.mkdir()
+    monkeypatch.chdir(str(work_path))
+    stack = make_stack()
+    first = stack.render()
+    second = stack.render()
+    assert os.listdir(str(work_path)) == []
+    assert not os.path.exists(str(tmp_path / 'outputs'))
+    assert len(first.steps) != 0
+    assert first.files() == second.files()
+
+    output_path = str(tmp_path / 'written')
+    first.write(output_path)
+    for path, content, executable in first.files():
+        file_path = os.path.join(output_path, path)
+        with open(file_path, 'rb') as file:
+            assert file.read() == content
+        assert os.access(file_path, os.X_OK) == executable
+
+
+def test_concurrent_render_keeps_order(make_stack):
+    """Thread and process pool renders are the same as the serial one."""
+    model_types = ['model-%s' % i for i in range(6)]
+    serial = make_stack(model_types=model_types, render_workers=1).render()
+    threads = make_stack(
+        model_types=model_types, render_workers=4).render()
+    processes = make_stack(
+        model_types=model_types, render_workers=2,
+        render_processes=True).render()
+    assert threads.files() == serial.files()
+    assert processes.files() == serial.files()
+
+
+def test_certificates_are_created_on_render(monkeypatch):
+    """Constructors create no key, the first render creates it once."""
+    created = []
+    self_signed_key_crt = postgres.self_signed_key_crt
+
+    def counted(*args, **kwargs):
+        created.append(True)
+        return self_signed_key_crt(*args, **kwargs)
+    monkeypatch.setattr(postgres, 'self_signed_key_crt', counted)
+
+    auth = PumpWoodAuthMicroservice(
+        secret_key='secret', db_password='password',
+        microservice_password='password', bucket_name='bucket',
+        version_app='1', version_static='1', disk_name='auth-db',
+        disk_size='10Gi', email_host_user='user',
+        email_host_password='password')
+    assert created == []
+    first = auth.create_deployment_file()
+    assert auth.create_deployment_file() == first
+    assert len(created) == 1
+
+
+def test_templates_are_compiled_once(tmp_path, monkeypatch):
+    """Each template source is loaded once, later renders reuse it."""
+    monkeypatch.setenv('PUMPWOOD_DEPLOY_TEMPLATE_CACHE', '')
+    monkeypatch.setattr(templates, '_environment', None)
+    loader = templates.get_environment().loader
+    loaded = []
+    get_source = loader.get_source
+
+    def counted(environment, name):
+        loaded.append(name)
+        return get_source(environment, name)
+    monkeypatch.setattr(loader, 'get_source', counted)
+
+    bucket_key_path = str(tmp_path / 'key.json')
+    with open(bucket_key_path, 'w') as file:
+        file.write('{}')
+    for n_workers in [1, 20]:
+        stack = synthetic_stack(
+            n_workers, bucket_key_path=bucket_key_path,
+            output_path=str(tmp_path / 'outputs'), all_microservices=True)
+        for m in stack.microsservices_to_deploy:
+            m.create_deployment_file()
+        if n_workers == 1:
+            compiled = list(loaded)
+    assert len(compiled) != 0
+    assert sorted(set(compiled)) == sorted(compiled)
+    assert loaded == compiled
+
+
+def test_patches_change_rendered_documents(make_stack):
+    """Patches are applied in memory to the documents of their kinds."""
+    stack = make_stack()
+    stack.add_patch(
+        lambda m: m.set_resources(requests={'cpu': '10m'}),
+        kinds=['Deployment'])
+    documents = [
+        d for s in stack.render().steps
+        for d in load_documents(s['content'])]
+    deployments = [d for d in documents if d['kind'] == 'Deployment']
+    assert len(deployments) != 0
+    for d in deployments:
+        for c in d['spec']['template']['spec']['containers']:
+            assert c['resources']['requests']['cpu'] == '10m'
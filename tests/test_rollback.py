@@ -0,0 +1,36 @@
+"""Tests of the rollback to stored deploy snapshots."""
+from pumpwood_deploy.models.deploy import PumpwoodModels
+
+
+def deploy(stack):
+    report = stack.deploy_cluster(
+        max_workers=4, wait_ready=True, timeout=30, write_files=False)
+    assert report['failed'] == []
+
+
+def images(api_server) -> dict:
+    return dict([
+        (k[2], [c['image'] for c in obj['spec']['template']['spec'][
+            'containers']])
+        for k, obj in api_server.objects.items() if k[0] == 'Deployment'])
+
+
+def test_rollback_applies_only_changed_resources(make_stack, api_server):
+    """Rollback restores the previous deploy, applying what changed only."""
+    deploy(make_stack(model_types=('model-a', )))
+    first = images(api_server)
+
+    stack = make_stack(model_types=())
+    stack.add_microservice(PumpwoodModels(
+        model_type='model-a', version='2', bucket_name='bucket'))
+    deploy(stack)
+    changed = set([k for k, v in images(api_server).items()
+                   if v != first[k]])
+    assert len(changed) != 0
+    assert len(stack.snapshots()) == 2
+
+    result = stack.rollback(wait_ready=True, timeout=30)
+    assert result['failed'] == []
+    assert set([k.split('/')[-1] for k in result['applied']]) == changed
+    assert len(result['unchanged']) != 0
+    assert images(api_server) == first
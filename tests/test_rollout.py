@@ -0,0 +1,126 @@
+"""Tests of the health-gated canary rollout."""
+import pytest
+from pumpwood_deploy.kubernets.rollout import (
+    CanaryRollout, CanaryFailedError, HealthGate, CANARY_LABEL,
+    canary_document, health_check)
+from pumpwood_deploy.manifests.model import load_documents
+
+
+MANIFEST = """
+apiVersion: v1
+kind: Service
+metadata:
+  name: app
+spec:
+  selector:
+    app: app
+  ports:
+  - port: 5000
+---
+apiVersion: apps/v1
+kind: Deployment
+metadata:
+  name: app
+spec:
+  replicas: 2
+  selector:
+    matchLabels:
+      app: app
+  template:
+    metadata:
+      labels:
+        app: app
+    spec:
+      containers:
+      - name: app
+        image: app:{version}
+        readinessProbe:
+          httpGet:
+            path: /health-check/
+            port: 5000
+"""
+
+
+def gate():
+    return HealthGate(n_requests=3, interval=0, warmup=0)
+
+
+def deployment(version: str) -> dict:
+    return [
+        d for d in load_documents(MANIFEST.format(version=version))
+        if d['kind'] == 'Deployment'][0]
+
+
+def test_canary_document_keeps_stable_selector():
+    """Only the canary selector has the track label."""
+    stable = deployment('1')
+    canary = canary_document(stable)
+    assert stable['spec']['selector']['matchLabels'] == {'app': 'app'}
+    assert CANARY_LABEL not in stable['spec']['template']['metadata'][
+        'labels']
+    assert canary['metadata']['name'] == 'app-canary'
+    assert canary['spec']['replicas'] == 1
+    assert canary['spec']['selector']['matchLabels'] == {
+        'app': 'app', CANARY_LABEL: 'canary'}
+    assert canary['spec']['template']['metadata']['labels'] == {
+        'app': 'app', CANARY_LABEL: 'canary'}
+
+
+def test_rendered_app_selectors_have_no_track(make_stack):
+    """Rendering does not change app selectors, they are immutable."""
+    cmds = make_stack().create_deploy_files(write_files=False)
+    apps = [
+        d for c in cmds['microservice_cmds']
+        for d in load_documents(c['content'] or '')
+        if d.get('kind') == 'Deployment' and health_check(d) is not None]
+    assert len(apps) != 0
+    for d in apps:
+        assert CANARY_LABEL not in d['spec']['selector']['matchLabels']
+
+
+def test_rollout_probes_canary_and_applies(
+        api_server, api_client, kube_client):
+    """A healthy canary is probed, the manifest applied and it removed."""
+    api_client.apply_manifest(MANIFEST.format(version='1'))
+    probed = []
+
+    def proxy_function(obj, port, path):
+        probed.append((obj['metadata']['name'], path))
+        return 200, 'ok'
+    api_server.proxy_function = proxy_function
+
+    applied = []
+    content = MANIFEST.format(version='2')
+    reports = CanaryRollout(kube_client, gate=gate(), timeout=10).rollout(
+        content, lambda: applied.append(api_client.apply_manifest(content)))
+    assert [r['passed'] for r in reports] == [True]
+    assert len(applied) == 1
+    assert len(probed) == 3
+    assert all([p == (reports[0]['pod'], '/health-check/') for p in probed])
+    assert reports[0]['pod'].startswith('app-canary-')
+
+    stable = api_server.get_object('Deployment', 'default', 'app')
+    assert stable['spec']['selector']['matchLabels'] == {'app': 'app'}
+    assert stable['spec']['template']['spec']['containers'][0][
+        'image'] == 'app:2'
+    assert api_server.get_object(
+        'Deployment', 'default', 'app-canary') is None
+
+
+def test_unhealthy_canary_is_rolled_back(
+        api_server, api_client, kube_client):
+    """A failing canary is removed and the manifest is not applied."""
+    api_client.apply_manifest(MANIFEST.format(version='1'))
+    api_server.proxy_function = lambda obj, port, path: (500, 'error')
+
+    applied = []
+    with pytest.raises(CanaryFailedError) as error:
+        CanaryRollout(kube_client, gate=gate(), timeout=10).rollout(
+            MANIFEST.format(version='2'), lambda: applied.append(True))
+    assert applied == []
+    assert error.value.report['health']['error_rate'] == 1.0
+    stable = api_server.get_object('Deployment', 'default', 'app')
+    assert stable['spec']['template']['spec']['containers'][0][
+        'image'] == 'app:1'
+    assert api_server.get_object(
+        'Deployment', 'default', 'app-canary') is None
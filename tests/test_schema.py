@@ -0,0 +1,99 @@
+"""Tests of the offline validation of rendered manifests."""
+import os
+import pytest
+from pumpwood_deploy.manifests.schema import (
+    SchemaValidator, ManifestValidationError)
+
+
+DEPLOYMENT = """apiVersion: apps/v1
+kind: Deployment
+metadata:
+  name: app
+spec:
+  replicas: 1
+  selector:
+    matchLabels:
+      app: app
+  template:
+    metadata:
+      labels:
+        app: app
+    spec:
+      containers:
+      - name: app
+        image: app:1
+        ports:
+        - containerPort: 5000
+"""
+
+DUPLICATED = DEPLOYMENT.replace(
+    '  replicas: 1\n', '  replicas: 1\n  replicas: 2\n')
+
+BAD_INDENTATION = DEPLOYMENT.replace(
+    '        image: app:1\n', '      image: app:1\n')
+
+
+class TemplateMicroservice:
+    """Microservice rendering one deploy resource from a template."""
+
+    def __init__(self, content: str):
+        """__init__."""
+        self.content = content
+
+    def create_deployment_file(self):
+        """Create the deployment file."""
+        return [{'type': 'deploy', 'name': 'app', 'content': self.content}]
+
+
+def errors_by_path(errors: list) -> dict:
+    return dict([(e['path'], e) for e in errors])
+
+
+def test_validator_reports_fields_with_lines():
+    """Type, unknown field and quoted number errors have exact lines."""
+    content = DEPLOYMENT.replace(
+        'containerPort: 5000', "containerPort: '5000'").replace(
+        '  replicas: 1\n', '  replicas: 1\n  replica: 1\n')
+    errors = errors_by_path(SchemaValidator().validate(content, file='f'))
+    port = 'spec.template.spec.containers[0].ports[0].containerPort'
+    assert set(errors) == set(['spec.replica', port])
+    assert errors['spec.replica']['line'] == 7
+    assert errors['spec.replica']['message'] == 'unknown field'
+    assert errors[port]['line'] == 20
+    assert 'expected integer' in errors[port]['message']
+    assert errors[port]['kind'] == 'Deployment'
+    assert errors[port]['name'] == 'app'
+    assert SchemaValidator().validate(DEPLOYMENT) == []
+
+
+def test_duplicated_field_on_template_is_reported(make_stack):
+    """Duplicated keys are found on the template, before it is parsed."""
+    deploy = make_stack(model_types=())
+    deploy.add_microservice(TemplateMicroservice(DUPLICATED))
+    errors = deploy.validate()
+    assert [(e['file'], e['line'], e['path'], e['message']) for e in errors
+            ] == [('TemplateMicroservice/app', 7, 'spec.replicas',
+                   'duplicated field')]
+
+
+def test_validate_fails_before_writing(make_stack, tmp_path):
+    """create_deploy_files with validate does not write invalid stacks."""
+    deploy = make_stack(model_types=())
+    deploy.add_microservice(TemplateMicroservice(DUPLICATED))
+    with pytest.raises(ManifestValidationError) as error:
+        deploy.create_deploy_files(validate=True)
+    assert 'TemplateMicroservice/app:7:' in str(error.value)
+    assert not os.path.exists(str(tmp_path / 'outputs' / 'deploy_output'))
+
+
+def test_invalid_yaml_template_reports_template_and_line(make_stack):
+    """Templates that are not YAML fail render with template and line."""
+    deploy = make_stack(model_types=())
+    deploy.add_microservice(TemplateMicroservice(BAD_INDENTATION))
+    with pytest.raises(ManifestValidationError) as error:
+        deploy.render()
+    [e] = error.value.errors
+    assert e['file'] == 'TemplateMicroservice/app'
+    assert e['line'] == 18
+    assert e['message'].startswith('invalid YAML')
+    assert 'TemplateMicroservice/app:18: invalid YAML' in str(error.value)
@@ -0,0 +1,111 @@
+"""Tests of the readiness conditions against the fake API server."""
+import pytest
+from pumpwood_deploy.kubernets.wait import (
+    ServiceExists, DeploymentRollout, WaitTimeoutError,
+    conditions_from_manifest, wait_for_conditions)
+
+
+SERVICE = """
+apiVersion: v1
+kind: Service
+metadata:
+  name: app
+spec:
+  selector:
+    app: app
+  ports:
+  - port: 5000
+"""
+
+DEPLOYMENT = """
+apiVersion: apps/v1
+kind: Deployment
+metadata:
+  name: app
+spec:
+  replicas: 2
+  selector:
+    matchLabels:
+      app: app
+  template:
+    metadata:
+      labels:
+        app: app
+    spec:
+      containers:
+      - name: app
+        image: app:1
+"""
+
+
+def endpoint_ips(api_server, name: str) -> list:
+    endpoints = api_server.get_object('Endpoints', 'default', name)
+    if endpoints is None:
+        return None
+    return sorted([
+        address['ip'] for subset in endpoints['subsets']
+        for address in subset.get('addresses', [])])
+
+
+def test_conditions_from_manifest():
+    """Services must exist, Deployments must roll out."""
+    conditions = conditions_from_manifest(SERVICE + '---' + DEPLOYMENT)
+    assert [type(c) for c in conditions] == [
+        ServiceExists, DeploymentRollout]
+    assert [c.name for c in conditions] == ['app', 'app']
+
+
+def test_service_ready_before_its_pods(api_server, api_client):
+    """
+    A Service applied before its Deployment is ready without endpoints.
+
+    Services are deployed before the Deployments of their pods, waiting
+    for their endpoints would never finish.
+    """
+    api_client.apply_manifest(SERVICE)
+    assert endpoint_ips(api_server, 'app') == []
+    conditions = conditions_from_manifest(SERVICE)
+    wait_for_conditions(conditions, api_client.get_resource, timeout=1)
+
+
+def test_endpoints_follow_ready_pods(api_server, api_client):
+    """Endpoints have the addresses of the ready pods of the selector."""
+    api_client.apply_manifest(SERVICE)
+    api_client.apply_manifest(DEPLOYMENT)
+    wait_for_conditions(
+        conditions_from_manifest(DEPLOYMENT), api_client.get_resource,
+        timeout=5)
+
+    pods = [
+        o for k, o in api_server.objects.items() if k[0] == 'Pod' and
+        o['metadata']['labels'].get('app') == 'app']
+    assert len(pods) == 2
+    assert endpoint_ips(api_server, 'app') == sorted([
+        p['status']['podIP'] for p in pods])
+
+    api_client.delete(kind='deployment', name='app')
+    assert endpoint_ips(api_server, 'app') == []
+
+
+def test_deployment_not_rolled_out_times_out():
+    """Not ready Deployments time out with the pending conditions."""
+    condition = DeploymentRollout('app')
+    with pytest.raises(WaitTimeoutError, match='app'):
+        wait_for_conditions(
+            [condition], lambda kind, name: None, timeout=0.2,
+            initial_delay=0.05)
+
+
+def test_stack_deploy_waits_without_deadlock(make_stack, api_server):
+    """A stack deploys services first and waits every step to be ready."""
+    deploy = make_stack()
+    report = deploy.deploy_cluster(
+        max_workers=4, wait_ready=True, timeout=30, write_files=False)
+    assert report['failed'] == [] and report['skipped'] == []
+
+    services = [k for k in api_server.objects if k[0] == 'Service']
+    assert len(services) != 0
+    for kind, namespace, name in services:
+        service = api_server.get_object(kind, namespace, name)
+        if service['spec'].get('selector'):
+            assert endpoint_ips(api_server, name), name